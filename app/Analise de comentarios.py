@@ -4,13 +4,16 @@ from dotenv import load_dotenv
 import logging
 import pandas as pd
 import numpy as np
-from transformers import pipeline
 from dash import Dash, dcc, html
 import pandas as pd
 import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 
+from app.sentimento import analisar_sentimentos
+from app.snapshot import carregar_snapshot
+from app.estatisticas_motoristas import atualizar_estatisticas, stats_collection
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
@@ -30,41 +33,23 @@ collection = db['rides_original']
 # Configurar o Dash
 app = Dash(__name__)
 
-# Carregar dados em um DataFrame
-print("Conectando ao MongoDB...")
-data = pd.DataFrame(list(collection.find()))
+# Carregar do snapshot mapeado em memória apenas as colunas usadas pela análise de sentimento
+data = carregar_snapshot('rides_original', ['driver_id', 'finalizada', 'rating_comment'])
 
 # Filtrar corridas canceladas e com comentários válidos
-cancelled_rides = data[(data['finalizada'] == 0) & data['rating_comment'].notnull()]
-
-# Configurar o pipeline de análise de sentimento com modelo acessível
-def setup_sentiment_pipeline():
-    return pipeline("sentiment-analysis", model="nlptown/bert-base-multilingual-uncased-sentiment")
-
-sentiment_analyzer = setup_sentiment_pipeline()
-
-# Função de análise de sentimento
-def analyze_sentiment(comment):
-    if isinstance(comment, str):
-        result = sentiment_analyzer(comment)
-        return result[0]['label']  # Retorna o rótulo do sentimento (e.g., POSITIVE, NEGATIVE, NEUTRAL)
-    return 'neutral'
-
-# Aplicar análise de sentimento nos comentários
-cancelled_rides['sentiment'] = cancelled_rides['rating_comment'].apply(analyze_sentiment)
+cancelled_rides = data[(data['finalizada'] == 0) & data['rating_comment'].notnull()].copy()
 
-# Agrupar dados por motorista para calcular estatísticas
-driver_stats = data.groupby('driver_id').agg({
-    'rating_score': 'mean',
-    'finalizada': ['sum', 'count'],
-    'rating_comment': 'count'
-}).reset_index()
-driver_stats.columns = ['driver_id', 'average_rating', 'rides_completed', 'total_rides', 'comments_count']
+# Aplicar análise de sentimento nos comentários (deduplicados e com cache por hash do texto;
+# apenas comentários inéditos passam pelo modelo)
+cancelled_rides['sentiment'] = analisar_sentimentos(cancelled_rides['rating_comment'])['sentimento']
 
-# Calcular taxas de cancelamento
-cancelled_counts = data[data['finalizada'] == 0].groupby('driver_id').size().reset_index(name='cancelled_rides')
-driver_stats = driver_stats.merge(cancelled_counts, on='driver_id', how='left').fillna(0)
-driver_stats['cancel_rate'] = driver_stats['cancelled_rides'] / driver_stats['total_rides']
+# Estatísticas por motorista mantidas no MongoDB (driver_stats); só os motoristas com corridas
+# novas desde a última execução são recalculados
+atualizar_estatisticas()
+driver_stats = pd.DataFrame(list(stats_collection.find({}, {'atualizado_em': 0})))
+driver_stats = driver_stats.rename(columns={'_id': 'driver_id'})
+driver_stats['driver_id'] = driver_stats['driver_id'].astype(str)
+driver_stats[['average_rating', 'cancel_rate']] = driver_stats[['average_rating', 'cancel_rate']].fillna(0)
 
 # Análise de sentimento por motorista
 sentiment_summary = cancelled_rides.groupby(['driver_id', 'sentiment']).size().unstack(fill_value=0).reset_index()
@@ -83,9 +68,9 @@ driver_analysis['total_comments'] = driver_analysis['negative_comments'] + drive
 # Correlação entre sentimentos e taxas de cancelamento
 correlation_matrix = driver_analysis[['average_rating', 'rides_completed', 'cancel_rate', 'negative_comments', 'positive_comments']].corr()
 
-# Identificar bairros mais cancelados por motorista
-neighborhood_cancel = data[data['finalizada'] == 0].groupby(['driver_id', 'suburb_client']).size().reset_index(name='cancel_count')
-most_cancelled_neighborhoods = neighborhood_cancel.loc[neighborhood_cancel.groupby('driver_id')['cancel_count'].idxmax()]
+# Bairros mais cancelados por motorista
+most_cancelled_neighborhoods = driver_stats.dropna(subset=['top_cancel_suburb']).rename(
+    columns={'top_cancel_suburb': 'suburb_client', 'top_cancel_count': 'cancel_count'})
 
 # Layout do Dash
 app.layout = html.Div([
@@ -1,138 +1,203 @@
 import os
+import json
 import pandas as pd
 import numpy as np
-import pymongo
 import dash
 import plotly.graph_objects as go
 import plotly.express as px
-import tempfile
 from dash.dependencies import Input, Output
 from dash import dcc, html
 from dotenv import load_dotenv
-from flask import Flask
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import silhouette_score
-from sklearn.ensemble import IsolationForest
-from folium.plugins import MarkerCluster
+from flask import Flask, jsonify
 import folium
 
+from app import registro
+from app.favelas import URL_LIMITES, NIVEIS_CAMADA
+from app.instrumentacao import medir
+from app.normalizacao import indicadores_status
+from app.mapa_canvas import CamadaPontos, CamadaLimites, CamadaCelulas
+from app.rollups import URL_CELULAS
+from app.registro import registrar
+from app.snapshot import carregar_snapshot, hash_snapshot
+from app.tarefas import tarefa, submeter, consultar
+
 
 # 🔹 Carregar variáveis de ambiente
 load_dotenv()
 
-# 🔹 Conectar ao MongoDB
-MONGO_URI = os.getenv("MONGO_URI")
-client = pymongo.MongoClient(MONGO_URI)
-db = client["mobility_data"]
-collection = db["rides_original"]
-
-# 🔹 Buscar os dados da coleção
-cursor = collection.find({}, {
-    "_id": 0,
-    "status": 1,
-    "driver_distance": 1,
-    "route_distance": 1,
-    "origin_lat": 1,
-    "origin_lng": 1,
-    "created_at": 1,
-    "turno": 1
-})
-
-# 🔹 Converter para DataFrame
-df = pd.DataFrame(list(cursor))
-
-# 🔹 Processar dados
-df.dropna(subset=["driver_distance", "route_distance", "origin_lat", "origin_lng"], inplace=True)
-df["driver_distance"] = df["driver_distance"].astype(np.float32)
-df["route_distance"] = df["route_distance"].astype(np.float32)
-
-# 🔹 Criar colunas de cancelamento
-df["canceled_by_driver"] = df["status"].apply(lambda x: 1 if "Cancelada pelo Taxista" in x else 0)
-df["canceled_by_passenger"] = df["status"].apply(lambda x: 1 if "Cancelada pelo Passageiro" in x else 0)
-df["completed"] = df["status"].apply(lambda x: 1 if "Finalizada" in x else 0)
-
-# 🔹 Padronizar dados para KMeans
-features = ["driver_distance", "route_distance", "canceled_by_driver", "canceled_by_passenger", "completed"]
-scaler = StandardScaler()
-df_scaled = scaler.fit_transform(df[features])
-
-# 🔹 Determinar o número ideal de clusters
-wcss = []
-silhouette_scores = []
-k_values = range(2, 10)
-
-for k in k_values:
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(df_scaled)
-    wcss.append(kmeans.inertia_)
-    silhouette_scores.append(silhouette_score(df_scaled, labels))
-
-# 🔹 Escolher melhor número de clusters
-optimal_k = k_values[np.argmax(silhouette_scores)]
-df["cluster"] = KMeans(n_clusters=optimal_k, random_state=42, n_init=10).fit_predict(df_scaled)
-
-# 🔹 Aplicar Isolation Forest para detectar outliers
-iso_forest = IsolationForest(contamination=0.05, random_state=42)
-df["outlier"] = iso_forest.fit_predict(df_scaled)
-
-
-# 🔹 Criar mapa interativo com agrupamento por cluster
-def generate_folium_map(df):
+# 🔹 Configuração do pipeline de clusters
+# Tamanho da amostra usada no Silhouette Score (0 = todas as corridas; o cálculo é quadrático)
+CLUSTER_AMOSTRA_SILHOUETTE = int(os.getenv("CLUSTER_AMOSTRA_SILHOUETTE", 10000))
+# Usar MiniBatchKMeans em vez de KMeans
+CLUSTER_MINIBATCH = os.getenv("CLUSTER_MINIBATCH", "0") == "1"
+# Número de candidatos de k avaliados em paralelo (-1 = todos os núcleos)
+CLUSTER_N_JOBS = int(os.getenv("CLUSTER_N_JOBS", -1))
+# Incrementar ao mudar o pipeline, para invalidar os artefatos já gravados
+VERSAO_MODELO_CLUSTERS = 3
+# Intervalo (ms) entre as verificações do dashboard enquanto o treinamento roda em segundo plano
+INTERVALO_VERIFICACAO_CLUSTERS = 5000
+
+
+# 🔹 Versão do artefato: hash do snapshot de corridas + configuração do pipeline. O registro a
+# calcula atualizando o snapshot antes (treino e aquecimento); os callbacks do dashboard usam
+# `atualizar=False` e apenas comparam com o snapshot já gravado.
+def versao_clusters(atualizar=True):
+    configuracao = f"v{VERSAO_MODELO_CLUSTERS}-s{CLUSTER_AMOSTRA_SILHOUETTE}-mb{int(CLUSTER_MINIBATCH)}"
+    return f"{hash_snapshot('rides_original', atualizar=atualizar)}-{configuracao}"
+
+
+# 🔹 Criar o modelo de agrupamento para um valor de k
+def criar_kmeans(k):
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if CLUSTER_MINIBATCH:
+        return MiniBatchKMeans(n_clusters=k, random_state=42, n_init=10, batch_size=4096)
+    return KMeans(n_clusters=k, random_state=42, n_init=10)
+
+
+# 🔹 Ajustar um candidato de k e calcular WCSS e Silhouette Score (amostrado). `threads` limita
+# as threads OpenMP do KMeans nesta thread (o limite do OpenMP vale por thread)
+def avaliar_k(df_scaled, k, threads=None):
+    from sklearn.metrics import silhouette_score
+    from threadpoolctl import threadpool_limits
+
+    with threadpool_limits(limits=threads, user_api="openmp"):
+        kmeans = criar_kmeans(k)
+        labels = kmeans.fit_predict(df_scaled)
+        amostra = CLUSTER_AMOSTRA_SILHOUETTE if 0 < CLUSTER_AMOSTRA_SILHOUETTE < len(df_scaled) else None
+        score = silhouette_score(df_scaled, labels, sample_size=amostra, random_state=42)
+    return kmeans, labels, kmeans.inertia_, score
+
+
+# 🔹 Treinar o modelo de clusters. Executado sob demanda pelo registro (ou no aquecimento com
+# `python -m app.registro`), e não mais na importação do módulo; o resultado é compartilhado
+# entre os workers por meio do artefato gravado em disco e só é refeito quando o snapshot muda.
+@registrar("clusters", versao=versao_clusters)
+def treinar_clusters():
+    # scikit-learn é importado aqui para não pesar na importação do app
+    from joblib import Parallel, delayed, effective_n_jobs
+    from threadpoolctl import threadpool_limits
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.ensemble import IsolationForest
+
+    # 🔹 Carregar os dados da coleção a partir do snapshot mapeado em memória (já atualizado ao
+    # calcular a versão, de modo que o artefato corresponda à versão com que é gravado)
+    df = carregar_snapshot("rides_original", [
+        "status",
+        "driver_distance",
+        "route_distance",
+        "origin_lat",
+        "origin_lng",
+        "created_at",
+        "turno"
+    ], atualizar=False)
+
+    # 🔹 Processar dados
+    df.dropna(subset=["driver_distance", "route_distance", "origin_lat", "origin_lng"], inplace=True)
+    df["driver_distance"] = df["driver_distance"].astype(np.float32)
+    df["route_distance"] = df["route_distance"].astype(np.float32)
+
+    # 🔹 Criar colunas de cancelamento (uma passada sobre os códigos do status)
+    df = df.join(indicadores_status(df["status"]))
+
+    # 🔹 Padronizar dados para KMeans
+    features = ["driver_distance", "route_distance", "canceled_by_driver", "canceled_by_passenger", "completed"]
+    scaler = StandardScaler()
+    df_scaled = scaler.fit_transform(df[features])
+
+    # 🔹 Determinar o número ideal de clusters (candidatos avaliados em paralelo; o scikit-learn
+    # libera o GIL nos trechos pesados, então threads bastam e evitam copiar os dados). Com vários
+    # candidatos ao mesmo tempo, cada um usa uma thread de OpenMP e de BLAS, para não disputarem
+    # os núcleos; avaliados um a um, cada ajuste usa todos os núcleos.
+    k_values = range(2, 10)
+    paralelos = min(effective_n_jobs(CLUSTER_N_JOBS), len(k_values))
+    threads = 1 if paralelos > 1 else None
+    with threadpool_limits(limits=threads, user_api="blas"):
+        candidatos = Parallel(n_jobs=paralelos, prefer="threads")(
+            delayed(avaliar_k)(df_scaled, k, threads) for k in k_values)
+    wcss = [inercia for _, _, inercia, _ in candidatos]
+    silhouette_scores = [score for _, _, _, score in candidatos]
+
+    # 🔹 Escolher melhor número de clusters (reaproveitando o modelo já ajustado)
+    melhor = int(np.argmax(silhouette_scores))
+    optimal_k = k_values[melhor]
+    kmeans, labels, _, _ = candidatos[melhor]
+    df["cluster"] = labels
+
+    # 🔹 Aplicar Isolation Forest para detectar outliers
+    iso_forest = IsolationForest(contamination=0.05, random_state=42)
+    df["outlier"] = iso_forest.fit_predict(df_scaled)
+
+    # 🔹 Ordenar por camada do mapa (outliers e depois cada cluster), para que cada camada ocupe
+    # um intervalo contíguo de posições e o popup possa ser buscado pela posição da corrida
+    df = df.assign(camada=np.where(df["outlier"] == -1, -1, df["cluster"]))
+    df = df.sort_values("camada", kind="stable").reset_index(drop=True)
+
+    return {
+        "df": df,
+        "features": features,
+        "scaler": scaler,
+        "kmeans": kmeans,
+        "centroids": kmeans.cluster_centers_,
+        "iso_forest": iso_forest,
+        "k_values": list(k_values),
+        "wcss": wcss,
+        "silhouette_scores": silhouette_scores,
+        "optimal_k": optimal_k,
+    }
+
+
+# 🔹 Definir cores para os clusters
+cluster_colors = ["blue", "green", "purple", "orange", "darkred", "pink", "cadetblue"]
+
+# 🔹 Endpoint que devolve o popup de uma corrida sob demanda (/api/clusters/corrida/<versão>/<posição>).
+# A versão do artefato vai na URL: a posição só vale para o artefato com que o mapa foi gerado.
+URL_POPUP_CORRIDA = "/api/clusters/corrida/"
+
+
+# 🔹 Texto do popup de uma corrida (pela posição no DataFrame do artefato)
+def gerar_popup_corrida(df, posicao):
+    row = df.iloc[posicao]
+    if row["outlier"] == -1:
+        return f"🚨 OUTLIER 🚨<br>Distância do Motorista: {row['driver_distance']}m"
+    return f"Cluster {row['cluster']}<br>Distância do Motorista: {row['driver_distance']}m"
+
+
+# 🔹 Criar mapa interativo com uma camada canvas por cluster e outra para os outliers.
+# O HTML leva apenas as coordenadas de cada camada; os popups são buscados sob demanda.
+def generate_folium_map(df, optimal_k, versao):
     map_center = [-22.9068, -43.1729]  # Rio de Janeiro
-    folium_map = folium.Map(location=map_center, zoom_start=11)
-
-    # Criando grupos separados para cada cluster e para outliers
-    cluster_groups = {i: MarkerCluster(name=f"Cluster {i}") for i in range(optimal_k)}
-    outlier_group = MarkerCluster(name="Outliers")
-
-    # Definir cores para os clusters
-    cluster_colors = ["blue", "green", "purple", "orange", "darkred", "pink", "cadetblue"]
-
-    for _, row in df.iterrows():
-        if row["outlier"] == -1:
-            color = "red"
-            popup_text = f"🚨 OUTLIER 🚨<br>Distância do Motorista: {row['driver_distance']}m"
-            folium.CircleMarker(
-                location=[row["origin_lat"], row["origin_lng"]],
-                radius=4,
-                color=color,
-                fill=True,
-                fill_color=color,
-                fill_opacity=0.6,
-                popup=popup_text
-            ).add_to(outlier_group)
+    folium_map = folium.Map(location=map_center, zoom_start=11, prefer_canvas=True)
+
+    # Cada camada ocupa um intervalo contíguo do DataFrame (ordenado por 'camada' no treino)
+    camadas = df["camada"].to_numpy()
+    latitudes = df["origin_lat"].to_numpy()
+    longitudes = df["origin_lng"].to_numpy()
+    for camada in list(range(optimal_k)) + [-1]:
+        inicio = int(np.searchsorted(camadas, camada, side="left"))
+        fim = int(np.searchsorted(camadas, camada, side="right"))
+        if camada == -1:
+            nome, cor = "Outliers", "red"
         else:
-            color = cluster_colors[row["cluster"] % len(cluster_colors)]
-            popup_text = f"Cluster {row['cluster']}<br>Distância do Motorista: {row['driver_distance']}m"
-            folium.CircleMarker(
-                location=[row["origin_lat"], row["origin_lng"]],
-                radius=4,
-                color=color,
-                fill=True,
-                fill_color=color,
-                fill_opacity=0.6,
-                popup=popup_text
-            ).add_to(cluster_groups[row["cluster"]])
-
-    # Adicionar os grupos ao mapa
-    for group in cluster_groups.values():
-        folium_map.add_child(group)
-    folium_map.add_child(outlier_group)
+            nome, cor = f"Cluster {camada}", cluster_colors[camada % len(cluster_colors)]
+        CamadaPontos(latitudes[inicio:fim], longitudes[inicio:fim], nome, cor=cor,
+                     url_popup=f"{URL_POPUP_CORRIDA}{versao}/", deslocamento=inicio).add_to(folium_map)
+
+    # Limites das favelas (desligados por padrão), buscados do app conforme o zoom
+    CamadaLimites(URL_LIMITES, NIVEIS_CAMADA, show=False).add_to(folium_map)
+
+    # Todas as corridas agregadas em grade, lidas dos agregados em vez das linhas (desligada por padrão)
+    CamadaCelulas(URL_CELULAS + "rides_original", "Corridas por célula", show=False).add_to(folium_map)
 
     # Adicionar controle de camadas
     folium.LayerControl().add_to(folium_map)
 
-    # Salvar o mapa como HTML temporário
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-    folium_map.save(temp_file.name)
-
-    with open(temp_file.name, "r", encoding="utf-8") as f:
-        return f.read()
+    # Gerar o HTML em memória
+    return folium_map.get_root().render()
 
 
 # 🔹 Criar estrutura para Circle Packing com Status das Corridas
-def generate_circle_packing():
+def generate_circle_packing(df):
     cluster_summary = df.groupby("cluster")[["driver_distance", "route_distance",
                                              "canceled_by_driver", "canceled_by_passenger",
                                              "completed"]].mean()
@@ -163,6 +228,63 @@ def generate_circle_packing():
                       title="Perfil dos Clusters com Status das Corridas")
 
 
+# 🔹 Gráficos e mapa do dashboard a partir do artefato de clusters (figuras já em JSON)
+def gerar_visuais(resultado, versao):
+    df = resultado["df"]
+    k_values = resultado["k_values"]
+    optimal_k = resultado["optimal_k"]
+
+    with medir("mapa"):
+        mapa_html = generate_folium_map(df, optimal_k, versao)
+
+    # 🔸 Gráfico combinado de WCSS e Silhouette Score
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=k_values, y=resultado["wcss"], mode="lines+markers",
+                             name="WCSS", yaxis="y1"))
+    fig.add_trace(go.Scatter(x=k_values, y=resultado["silhouette_scores"], mode="lines+markers",
+                             name="Silhouette Score", yaxis="y2"))
+    fig.add_vline(x=optimal_k, line_dash="dash", line_color="red",
+                  annotation_text=f"Melhor K = {optimal_k}")
+
+    fig.update_layout(
+        title="WCSS e Silhouette Score para Diferentes Números de Clusters",
+        xaxis_title="Número de Clusters",
+        yaxis=dict(title="WCSS", side="left"),
+        yaxis2=dict(title="Silhouette Score", overlaying="y", side="right"),
+        legend_title="Métrica"
+    )
+
+    # 🔸 Boxplot da distância do motorista
+    boxplot_fig = go.Figure()
+    for status in df["status"].unique():
+        subset = df[df["status"] == status]
+        boxplot_fig.add_trace(go.Box(y=subset["driver_distance"], name=status))
+
+    boxplot_fig.update_layout(title="Distância do Motorista por Status da Corrida")
+
+    with medir("circle_packing"):
+        circle_packing_fig = generate_circle_packing(df)
+
+    return {
+        "boxplot": json.loads(boxplot_fig.to_json()),
+        "wcss_silhouette": json.loads(fig.to_json()),
+        "circle_packing": json.loads(circle_packing_fig.to_json()),
+        "mapa": mapa_html,
+    }
+
+
+# 🔹 Tarefa em segundo plano do dashboard: constrói (e grava em disco) o artefato do registro, se
+# preciso, e gera os gráficos e o mapa, guardados como resultado da tarefa
+@tarefa("visualizar_clusters")
+def tarefa_visualizar_clusters(parametros, reportar):
+    versao = versao_clusters()
+    return gerar_visuais(registro.obter("clusters", versao), versao)
+
+
+# 🔹 Gráficos e mapa já lidos do resultado da tarefa neste worker: versão -> visuais
+_visuais = {}
+
+
 # 🔹 Criar a aplicação Dash dentro do Flask como um Blueprint
 def create_analise_espacial_cluster_app(flask_app):
     dash_app = dash.Dash(
@@ -172,10 +294,28 @@ def create_analise_espacial_cluster_app(flask_app):
         suppress_callback_exceptions=True
     )
 
+    # 🔸 Popup de uma corrida do mapa, buscado pelo navegador ao clicar no ponto. Não treina o
+    # modelo: sem o artefato atual responde 503, e um mapa de outra versão recebe 409.
+    @flask_app.route(f"{URL_POPUP_CORRIDA}<versao>/<int:posicao>")
+    def popup_corrida(versao, posicao):
+        atual = versao_clusters(atualizar=False)
+        if versao != atual:
+            return jsonify({"error": "O modelo de clusters mudou; recarregue o mapa"}), 409
+        if not registro.disponivel("clusters", atual):
+            return jsonify({"error": "Modelo de clusters em treinamento; tente novamente"}), 503
+        df = registro.obter("clusters", atual)["df"]
+        if not 0 <= posicao < len(df):
+            return jsonify({"error": "Corrida não encontrada"}), 404
+        return jsonify({"html": gerar_popup_corrida(df, posicao)})
+
     # 🔸 Layout do Dash
     dash_app.layout = html.Div([
         html.H1("Análise do comportamento das corridas em relação à distância do motorista até passageiro"),
 
+        # 🔸 Situação do treinamento, verificada periodicamente até o modelo ficar disponível
+        html.Div(id="status-clusters"),
+        dcc.Interval(id="verificar-clusters", interval=INTERVALO_VERIFICACAO_CLUSTERS),
+
         # 🔸 Boxplot das corridas por distância do motorista
         dcc.Graph(id="boxplot-distancia"),
 
@@ -194,37 +334,30 @@ def create_analise_espacial_cluster_app(flask_app):
         [Output("boxplot-distancia", "figure"),
          Output("combined-clustering-chart", "figure"),
          Output("circle-packing-clusters", "figure"),
-         Output("mapa-clusters", "srcDoc")],
-        Input("mapa-clusters", "id")
+         Output("mapa-clusters", "srcDoc"),
+         Output("status-clusters", "children"),
+         Output("verificar-clusters", "disabled")],
+        Input("verificar-clusters", "n_intervals")
     )
     def update_visuals(_):
-        mapa_html = generate_folium_map(df)
-
-        # 🔸 Gráfico combinado de WCSS e Silhouette Score
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(x=list(k_values), y=wcss, mode="lines+markers",
-                                 name="WCSS", yaxis="y1"))
-        fig.add_trace(go.Scatter(x=list(k_values), y=silhouette_scores, mode="lines+markers",
-                                 name="Silhouette Score", yaxis="y2"))
-        fig.add_vline(x=optimal_k, line_dash="dash", line_color="red",
-                      annotation_text=f"Melhor K = {optimal_k}")
-
-        fig.update_layout(
-            title="WCSS e Silhouette Score para Diferentes Números de Clusters",
-            xaxis_title="Número de Clusters",
-            yaxis=dict(title="WCSS", side="left"),
-            yaxis2=dict(title="Silhouette Score", overlaying="y", side="right"),
-            legend_title="Métrica"
-        )
-
-        # 🔸 Boxplot da distância do motorista
-        boxplot_fig = go.Figure()
-        for status in df["status"].unique():
-            subset = df[df["status"] == status]
-            boxplot_fig.add_trace(go.Box(y=subset["driver_distance"], name=status))
-
-        boxplot_fig.update_layout(title="Distância do Motorista por Status da Corrida")
-
-        return boxplot_fig, fig, generate_circle_packing(), mapa_html
+        # 🔸 Gráficos e mapa ainda não gerados para os dados atuais: treinar (se preciso) e gerá-los
+        # em segundo plano e aguardar. A versão é comparada com o snapshot já gravado; atualizá-lo
+        # fica com a tarefa.
+        versao = versao_clusters(atualizar=False)
+        visuais = _visuais.get(versao)
+        if visuais is None:
+            estado = consultar(submeter("visualizar_clusters", {"versao": versao}))
+            if estado["status"] == "erro":
+                return dash.no_update, dash.no_update, dash.no_update, dash.no_update, \
+                    f"Erro ao treinar o modelo de clusters: {estado['erro']}", True
+            if estado["status"] != "concluida":
+                return dash.no_update, dash.no_update, dash.no_update, dash.no_update, \
+                    "Treinando o modelo de clusters, aguarde...", False
+            visuais = estado["resultado"]
+            _visuais.clear()
+            _visuais[versao] = visuais
+
+        return visuais["boxplot"], visuais["wcss_silhouette"], visuais["circle_packing"], \
+            visuais["mapa"], "", True
 
     return dash_app
@@ -1,5 +1,4 @@
 import os
-from pymongo import MongoClient
 from dotenv import load_dotenv
 import logging
 import pandas as pd
@@ -8,10 +7,14 @@ from datetime import timedelta
 import folium
 from flask import Flask, render_template_string, request
 import numpy as np
-from sklearn.neighbors import KDTree
+from sklearn.neighbors import BallTree
 from shapely.geometry import Point
 import json
 
+from app.consultas import carregar, filtros_corridas
+from app.tabelas import texto_objectid
+from app.instrumentacao import instrumentar_app, medir
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
@@ -19,34 +22,84 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Obter a string de conexão do MongoDB
-MONGO_URI = os.getenv("MONGO_URI")
-
-# Conectar ao MongoDB
-logger.info("Conectando ao MongoDB...")
-client = MongoClient(MONGO_URI)
-db = client['mobility_data']
-
-# Carregar os dados das coleções do MongoDB
-logger.info("Carregando dados das coleções do MongoDB...")
-rides_data = pd.DataFrame(list(db['rides_original'].find()))
-events_data = pd.DataFrame(list(db['events'].find()))
+# Carregar os dados a partir dos snapshots mapeados em memória (datas e coordenadas já tipadas);
+# das corridas, apenas as canceladas pelo taxista são lidas
+logger.info("Carregando snapshots das coleções do MongoDB...")
+rides_data = carregar('rides_original', filtros_corridas(status=["Cancelada pelo Taxista"]),
+                      ['_id', 'created_at', 'origin_lat', 'origin_lng', 'status'])
+events_data = carregar('events', colunas=['_id', 'date', 'latitude', 'longitude'])
+
+RAIO_TERRA_KM = 6371.0
+
+# Limite de baldes temporais (e de BallTrees) por consulta
+MAX_BALDES_TEMPORAIS = 2000
+
+
+# Encontrar todos os pares (corrida, evento) a até `distancia_km` e `janela_horas` um do outro.
+# As corridas são agrupadas em baldes temporais de largura >= janela; cada balde consulta, com
+# BallTree.query_radius (métrica haversine), apenas os eventos do próprio balde e dos vizinhos.
+# A janela exata é aplicada como máscara numpy sobre o resultado irregular: como os eventos estão
+# ordenados por data, os eventos válidos de cada corrida formam o intervalo [lo, hi).
+def correlacionar_cancelamentos(cancelled_rides, events, distancia_km, janela_horas):
+    if cancelled_rides.empty or events.empty:
+        return pd.DataFrame()
+
+    events = events.sort_values('date', kind='stable')
+    tempos_eventos = pd.to_datetime(events['date'], utc=True).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    tempos_corridas = pd.to_datetime(cancelled_rides['created_at'], utc=True).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    # A métrica haversine espera [lat, lng] em radianos
+    coords_eventos = np.radians(events[['latitude', 'longitude']].to_numpy(dtype=np.float64))
+    coords_corridas = np.radians(cancelled_rides[['origin_lat', 'origin_lng']].to_numpy(dtype=np.float64))
+
+    janela_ns = int(janela_horas * 3600 * 1e9)
+    lo = np.searchsorted(tempos_eventos, tempos_corridas - janela_ns, side='left')
+    hi = np.searchsorted(tempos_eventos, tempos_corridas + janela_ns, side='right')
+
+    t0 = min(tempos_eventos[0], tempos_corridas.min())
+    extensao = max(tempos_eventos[-1], tempos_corridas.max()) - t0
+    largura = max(janela_ns, extensao // MAX_BALDES_TEMPORAIS, 1)
+    balde_corridas = (tempos_corridas - t0) // largura
+
+    pares_corridas, pares_eventos, pares_distancias = [], [], []
+    ordem = np.argsort(balde_corridas, kind='stable')
+    baldes, inicios = np.unique(balde_corridas[ordem], return_index=True)
+    for balde, corridas_balde in zip(baldes, np.split(ordem, inicios[1:])):
+        inicio = np.searchsorted(tempos_eventos, t0 + (balde - 1) * largura, side='left')
+        fim = np.searchsorted(tempos_eventos, t0 + (balde + 2) * largura, side='left')
+        if fim <= inicio:
+            continue
+
+        balltree = BallTree(coords_eventos[inicio:fim], metric='haversine')
+        idx, dist = balltree.query_radius(coords_corridas[corridas_balde], r=distancia_km / RAIO_TERRA_KM,
+                                          return_distance=True)
+        tamanhos = np.fromiter(map(len, idx), dtype=np.int64, count=len(idx))
+        if tamanhos.sum() == 0:
+            continue
+
+        idx_corrida = np.repeat(corridas_balde, tamanhos)
+        idx_evento = np.concatenate(idx) + inicio
+        dentro_da_janela = (idx_evento >= lo[idx_corrida]) & (idx_evento < hi[idx_corrida])
+        pares_corridas.append(idx_corrida[dentro_da_janela])
+        pares_eventos.append(idx_evento[dentro_da_janela])
+        pares_distancias.append(np.concatenate(dist)[dentro_da_janela] * RAIO_TERRA_KM)
+
+    if not pares_corridas:
+        return pd.DataFrame()
+
+    idx_corrida = np.concatenate(pares_corridas)
+    idx_evento = np.concatenate(pares_eventos)
+    return pd.DataFrame({
+        "Ride ID": [texto_objectid(v) for v in cancelled_rides['_id'].to_numpy()[idx_corrida]],
+        "Event ID": [texto_objectid(v) for v in events['_id'].to_numpy()[idx_evento]],
+        "Distance (km)": np.concatenate(pares_distancias),
+        "Time Difference (hours)": np.abs(tempos_corridas[idx_corrida] - tempos_eventos[idx_evento]) / 3.6e12,
+    })
 
-# Converter coordenadas e datas
-rides_data['origin_coordinates'] = rides_data['location'].apply(lambda x: x['coordinates'] if pd.notnull(x) else None)
-events_data['event_coordinates'] = events_data['location'].apply(lambda x: x['coordinates'] if pd.notnull(x) else None)
-
-# Ajustar a conversão de datas para lidar com diferentes formatos
-def convert_to_datetime(date_value):
-    if isinstance(date_value, dict) and '$date' in date_value:
-        return pd.to_datetime(date_value['$date'], errors='coerce')
-    return pd.to_datetime(date_value, errors='coerce')
-
-rides_data['created_at'] = rides_data['created_at'].apply(convert_to_datetime)
-events_data['date'] = events_data['date'].apply(convert_to_datetime)
 
 # Inicializar o app Flask
 app = Flask(__name__)
+instrumentar_app(app)
 
 # Rota principal
 @app.route('/', methods=['GET', 'POST'])
@@ -54,31 +107,12 @@ def index():
     distancia_maxima_km = float(request.form.get('distancia', 10))
     janela_temporal_horas = float(request.form.get('tempo', 24))
 
-    cancelled_rides = rides_data[rides_data['status'] == "Cancelada pelo Taxista"].dropna(subset=['origin_coordinates'])
-    events = events_data.dropna(subset=['event_coordinates'])
-
-    cancelled_coords = np.radians(np.array(cancelled_rides['origin_coordinates'].tolist()))
-    event_coords = np.radians(np.array(events['event_coordinates'].tolist()))
-
-    kdtree = KDTree(event_coords)
-    dist, idx = kdtree.query(cancelled_coords, k=10, return_distance=True)
-    dist_km = dist * 6371.0
-
-    related_events = []
-    for ride_idx, distances in enumerate(dist_km):
-        for d, event_idx in zip(distances, idx[ride_idx]):
-            if d <= distancia_maxima_km:
-                ride_time = cancelled_rides.iloc[ride_idx]['created_at']
-                event_time = events.iloc[event_idx]['date']
-                if abs((ride_time - event_time).total_seconds()) / 3600 <= janela_temporal_horas:
-                    related_events.append({
-                        "Ride ID": cancelled_rides.iloc[ride_idx]['_id']['$oid'],
-                        "Event ID": events.iloc[event_idx]['_id']['$oid'],
-                        "Distance (km)": d,
-                        "Time Difference (hours)": abs((ride_time - event_time).total_seconds()) / 3600
-                    })
-
-    resultados_df = pd.DataFrame(related_events)
+    cancelled_rides = rides_data[rides_data['status'] == "Cancelada pelo Taxista"].dropna(
+        subset=['origin_lat', 'origin_lng', 'created_at'])
+    events = events_data.dropna(subset=['latitude', 'longitude', 'date'])
+
+    with medir("juncao"):
+        resultados_df = correlacionar_cancelamentos(cancelled_rides, events, distancia_maxima_km, janela_temporal_horas)
 
     tabela_html = resultados_df.to_html(index=False, classes='table table-striped') if not resultados_df.empty else "<p>Nenhuma correlação encontrada dentro dos parâmetros especificados.</p>"
 
@@ -3,13 +3,21 @@ from pymongo import MongoClient
 from dotenv import load_dotenv
 import logging
 import pandas as pd
-import numpy as np
-from math import radians, cos, sin, sqrt, atan2
 import folium
 from folium.plugins import MarkerCluster
-from flask import Flask, Blueprint, jsonify, render_template_string, request
+from flask import Flask, Blueprint, jsonify, render_template, render_template_string, request
 import plotly.graph_objects as go
 
+from app.juncao_paralela import contar_cancelamentos
+from app.instrumentacao import medir
+from app.cache_resultados import CacheResultados
+from app.favelas import URL_LIMITES, NIVEIS_CAMADA
+from app.mapa_canvas import CamadaLimites, CamadaCelulas
+from app.rollups import URL_CELULAS
+from app.consultas import carregar, filtros_corridas, filtros_ocorrencias, resolver_id_pop
+from app.snapshot import versao_dados
+from app.tarefas import tarefa, submeter, consultar, resposta_submetida
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
@@ -23,29 +31,40 @@ logger.info("Conectando ao MongoDB...")
 client = MongoClient(MONGO_URI)
 db = client['mobility_data']
 
+# Coleções das quais o resultado depende (mudanças nelas invalidam o cache)
+COLECOES_MAPA = ['rides_original', 'ocorrencias', 'procedimento_operacional_padrao']
+
+# Cache dos resultados já calculados (tabela, Sankey e mapa), por worker
+CACHE_MAPA_BYTES = int(os.getenv("CACHE_MAPA_BYTES", 128 * 1024 * 1024))
+cache_mapa = CacheResultados(CACHE_MAPA_BYTES)
+
 
-# Função para carregar os DataFrames sob demanda
-def carregar_dados():
-    rides_data = pd.DataFrame(
-        list(db['rides_original'].find({}, {"created_at": 1, "origin_lat": 1, "origin_lng": 1, "status": 1, "suburb_client": 1})))  # Adicionando suburb_client
+# Função para carregar os DataFrames sob demanda (a partir dos snapshots mapeados em memória).
+# Os filtros de período, de tipo de evento e de área do mapa (limites) são aplicados na leitura, de
+# modo que só as corridas e ocorrências selecionadas são materializadas.
+def carregar_dados(data_inicio=None, data_fim=None, tipo_evento=None, limites=None):
+    rides_data = carregar('rides_original', filtros_corridas(data_inicio, data_fim, limites=limites), [
+        "_id", "created_at", "origin_lat", "origin_lng", "status", "suburb_client"])  # Adicionando suburb_client
 
-    ocorrencias_data = pd.DataFrame(list(db['ocorrencias'].find({}, {
-        "data_inicio": 1, "data_fim": 1, "latitude": 1, "longitude": 1, "id_pop": 1, "descricao": 1  # Incluindo descricao
-    })))
+    id_pops = resolver_id_pop(tipo_evento) if tipo_evento else None
+    ocorrencias_data = carregar('ocorrencias', filtros_ocorrencias(data_inicio, data_fim, id_pops, limites), [
+        "_id", "data_inicio", "data_fim", "latitude", "longitude", "id_pop", "descricao",  # Incluindo descricao
+        "favela", "bairro_favela"  # Território gravado por app.favelas
+    ])
 
-    procedimentos_data = pd.DataFrame(
-        list(db['procedimento_operacional_padrao'].find({}, {"id_pop": 1, "pop_titulo": 1})))  # Incluindo pop_titulo
+    procedimentos_data = carregar('procedimento_operacional_padrao', colunas=["id_pop", "pop_titulo"])  # Incluindo pop_titulo
 
     if rides_data.empty or ocorrencias_data.empty:
         logger.warning("Um dos datasets está vazio! Verifique a conexão com o MongoDB.")
 
-    # Converter datas para datetime
-    rides_data['created_at'] = pd.to_datetime(rides_data['created_at'])
-    ocorrencias_data['data_inicio'] = pd.to_datetime(ocorrencias_data['data_inicio'])
-    ocorrencias_data['data_fim'] = pd.to_datetime(ocorrencias_data['data_fim'])
+    with medir("transformacao"):
+        # Converter datas para datetime
+        rides_data['created_at'] = pd.to_datetime(rides_data['created_at'])
+        ocorrencias_data['data_inicio'] = pd.to_datetime(ocorrencias_data['data_inicio'])
+        ocorrencias_data['data_fim'] = pd.to_datetime(ocorrencias_data['data_fim'])
 
-    # Mesclar ocorrências com procedimentos operacionais para trazer 'pop_titulo'
-    ocorrencias_data = ocorrencias_data.merge(procedimentos_data, on='id_pop', how='left')
+        # Mesclar ocorrências com procedimentos operacionais para trazer 'pop_titulo'
+        ocorrencias_data = ocorrencias_data.merge(procedimentos_data, on='id_pop', how='left')
 
     # Garantir que 'pop_titulo' existe
     if 'pop_titulo' not in ocorrencias_data.columns:
@@ -59,115 +78,111 @@ def carregar_dados():
 
 
 
-# Função para calcular distância entre coordenadas geográficas (em km) de forma vetorizada
-def calcular_distancia(coord1, coord2):
-    lat1, lon1 = np.radians(coord1)
-    lat2, lon2 = np.radians(coord2)
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
-    return 6371.0 * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
-
 # Inicializar Flask
 mapa_ocorrencias_app = Blueprint("mapa_ocorrencias_app", __name__)
 
 
-@mapa_ocorrencias_app.route('/', methods=['GET', 'POST'])
-def index():
-    rides_data, ocorrencias_data = carregar_dados()
+# Calcular mapa, Sankey e tabela para um conjunto de filtros. Também é executada como tarefa em
+# segundo plano (modo assíncrono do endpoint), reportando o progresso da junção.
+@tarefa("mapa_ocorrencias")
+def calcular_mapa_ocorrencias(parametros, reportar=None):
+    rides_data, ocorrencias_data = carregar_dados(parametros['data_inicio'], parametros['data_fim'],
+                                                  parametros['tipo_evento'], parametros.get('limites'))
 
-    # Definir intervalo padrão para filtros
-    min_date = rides_data['created_at'].min().strftime('%Y-%m-%d')
-    max_date = rides_data['created_at'].max().strftime('%Y-%m-%d')
+    distancia_maxima_km = parametros['distancia']
+    janela_temporal_horas = parametros['tempo']
+    data_inicio = parametros['data_inicio']
+    data_fim = parametros['data_fim']
+    tipo_evento = parametros['tipo_evento']
 
-    distancia_maxima_km = float(request.form.get('distancia', 5))
-    janela_temporal_horas = float(request.form.get('tempo', 2))
-    data_inicio = request.form.get('data_inicio', min_date)
-    data_fim = request.form.get('data_fim', max_date)
-    tipo_evento = request.form.getlist('tipo_evento')
-
-    # Converter filtros para datetime
-    data_inicio_dt = pd.to_datetime(data_inicio)
-    data_fim_dt = pd.to_datetime(data_fim)
-
-    # Filtragem antes do processamento
-    rides_filtradas = rides_data[
-        (rides_data['created_at'] >= data_inicio_dt) & (rides_data['created_at'] <= data_fim_dt)]
-    ocorrencias_filtradas = ocorrencias_data[
-        (ocorrencias_data['data_inicio'] >= data_inicio_dt) & (ocorrencias_data['data_fim'] <= data_fim_dt)]
+    if rides_data.empty or ocorrencias_data.empty:
+        # Nada a cruzar no período escolhido: mapa, Sankey e tabela saem vazios
+        logger.info("Nenhuma corrida ou ocorrência no período; resultado vazio.")
+        rides_filtradas, ocorrencias_filtradas = rides_data.iloc[:0], ocorrencias_data.iloc[:0]
+    else:
+        # Definir intervalo padrão para filtros (período das corridas carregadas)
+        data_inicio = data_inicio or rides_data['created_at'].min().strftime('%Y-%m-%d')
+        data_fim = data_fim or rides_data['created_at'].max().strftime('%Y-%m-%d')
+
+        # Converter filtros para datetime
+        data_inicio_dt = pd.to_datetime(data_inicio)
+        data_fim_dt = pd.to_datetime(data_fim)
+
+        # Filtragem antes do processamento
+        rides_filtradas = rides_data[
+            (rides_data['created_at'] >= data_inicio_dt) & (rides_data['created_at'] <= data_fim_dt)]
+        ocorrencias_filtradas = ocorrencias_data[
+            (ocorrencias_data['data_inicio'] >= data_inicio_dt) & (ocorrencias_data['data_fim'] <= data_fim_dt)]
 
     if tipo_evento:
         ocorrencias_filtradas = ocorrencias_filtradas[ocorrencias_filtradas['pop_titulo'].isin(tipo_evento)]
 
-    resultados = []
-    resultados_sankey = []
+    # Junção espaço-temporal vetorizada entre ocorrências e corridas (em fatias de tempo, em vários
+    # processos, para volumes grandes; ver app.juncao_paralela)
+    with medir("juncao"):
+        contagens = contar_cancelamentos(
+            ocorrencias_filtradas, rides_filtradas, distancia_maxima_km, janela_temporal_horas,
+            progresso=(lambda fracao, parcial: reportar(round(fracao * 0.9, 3), parcial)) if reportar else None)
+    eventos = ocorrencias_filtradas.join(contagens)
+    eventos = eventos[eventos['total_cancelamentos'] > 0]
+
+    # Bairro do evento: o do polígono de favela que contém a ocorrência (gravado por app.favelas);
+    # fora das favelas, o bairro da primeira corrida próxima encontrada
+    bairros_corridas = rides_filtradas['bairro'].to_numpy()
+    bairro_corrida = pd.Series(bairros_corridas[eventos['primeira_corrida'].to_numpy()], index=eventos.index)
+    bairro_evento = eventos['bairro_favela'].astype(object).fillna(bairro_corrida.astype(object))
+    bairro_evento = bairro_evento.fillna("Desconhecido")
+    favela_evento = eventos['favela'].astype(object).fillna("-")
+
+    data_evento = eventos['data_inicio'].dt.strftime('%Y-%m-%d')
+    event_duration = (eventos['data_fim'] - eventos['data_inicio']).dt.total_seconds() / 3600
+    percentual_cancelamento_bairro = eventos['total_cancelamentos'] / eventos['corridas_proximas'] * 100
+
+    resultados = pd.DataFrame({
+        'Bairro': bairro_evento,
+        'Favela': favela_evento,
+        'Data': data_evento,
+        'Horário Ocorrência': eventos['data_inicio'].dt.strftime('%H:%M:%S'),
+        'Duração Ocorrência (h)': event_duration.round(2),
+        'Evento': eventos['pop_titulo'],
+        'Cancelamentos pelo Taxista': eventos['cancelamentos_taxista'],
+        'Cancelamentos pelo Passageiro': eventos['cancelamentos_passageiro'],
+        'Total Cancelamentos': eventos['total_cancelamentos'],
+        'Percentual de Cancelamentos Relacionados no Bairro (%)': percentual_cancelamento_bairro,
+    })
+
+    # Criar visualização Mapa usando Marker Cluster (apenas eventos com cancelamentos)
     mapa_cancelamentos = folium.Map(location=[-22.9068, -43.1729], zoom_start=12)
     marker_cluster = MarkerCluster().add_to(mapa_cancelamentos)
-
-    for _, evento in ocorrencias_filtradas.iterrows():
-        event_location = [evento['latitude'], evento['longitude']]
-        event_duration = (evento['data_fim'] - evento['data_inicio']).total_seconds() / 3600
-
-        rides_proximas = rides_filtradas.copy()
-        rides_proximas['distancia'] = rides_proximas.apply(lambda row: calcular_distancia(
-            (row['origin_lat'], row['origin_lng']), event_location), axis=1)
-        rides_proximas = rides_proximas[rides_proximas['distancia'] <= distancia_maxima_km]
-
-        rides_proximas['tempo_diferenca'] = abs(
-            (rides_proximas['created_at'] - evento['data_inicio']).dt.total_seconds() / 3600)
-        rides_proximas = rides_proximas[rides_proximas['tempo_diferenca'] <= janela_temporal_horas]
-
-        # Se houver corridas próximas, pegar o primeiro bairro encontrado
-        if not rides_proximas.empty:
-            bairro_evento = rides_proximas.iloc[0]['bairro']
-        else:
-            bairro_evento = "Desconhecido"  # Se não houver corridas próximas, manter "Desconhecido"
-
-        cancelamentos_taxista = rides_proximas[rides_proximas['status'] == 'Cancelada pelo Taxista']
-        cancelamentos_passageiro = rides_proximas[rides_proximas['status'] == 'Cancelada pelo Passageiro']
-        total_cancelamentos = cancelamentos_taxista.shape[0] + cancelamentos_passageiro.shape[0]
-
-        if total_cancelamentos > 0:
-            percentual_cancelamento_bairro = (total_cancelamentos / rides_proximas.shape[0]) * 100 if \
-                rides_proximas.shape[0] > 0 else 0
-
-            # Criar visualização Mapa usando Marker Cluster
-            folium.Marker(
-                location=event_location,
-                popup=f"""
-                                            <b>Evento:</b> {evento['pop_titulo']}<br>
-                                            <b>Bairro:</b> {bairro_evento}<br>
-                                            <b>Data:</b> {evento['data_inicio'].strftime('%Y-%m-%d %H:%M:%S')}<br>
-                                            <b>Raio de influência:</b> {distancia_maxima_km} km<br>
-                                            <b>Cancelamentos pelo Taxista:</b> {cancelamentos_taxista.shape[0]}<br>
-                                            <b>Cancelamentos pelo Passageiro:</b> {cancelamentos_passageiro.shape[0]}<br>
-                                            <b>Total Cancelamentos:</b> {total_cancelamentos}
-                                        """,
-            ).add_to(marker_cluster)
-
-            resultados.append({
-                'Bairro': bairro_evento,
-                'Data': evento['data_inicio'].strftime('%Y-%m-%d'),
-                'Horário Ocorrência': evento['data_inicio'].strftime('%H:%M:%S'),
-                'Duração Ocorrência (h)': round(event_duration, 2),
-                'Evento': evento['pop_titulo'],
-                'Cancelamentos pelo Taxista': cancelamentos_taxista.shape[0],
-                'Cancelamentos pelo Passageiro': cancelamentos_passageiro.shape[0],
-                'Total Cancelamentos': total_cancelamentos,
-                'Percentual de Cancelamentos Relacionados no Bairro (%)': percentual_cancelamento_bairro,
-            })
-
-            resultados_sankey.append({
-                'Bairro': bairro_evento,
-                'Data': evento['data_inicio'].strftime('%Y-%m-%d'),
-                'Evento': evento['pop_titulo'],
-                'Total Cancelamentos': total_cancelamentos,
-            })
-
-    tabela_html = pd.DataFrame(resultados).to_html(index=False, classes='table table-striped')
+    for evento, bairro, favela in zip(eventos.itertuples(index=False), bairro_evento, favela_evento):
+        folium.Marker(
+            location=[evento.latitude, evento.longitude],
+            popup=f"""
+                                        <b>Evento:</b> {evento.pop_titulo}<br>
+                                        <b>Bairro:</b> {bairro}<br>
+                                        <b>Favela:</b> {favela}<br>
+                                        <b>Data:</b> {evento.data_inicio.strftime('%Y-%m-%d %H:%M:%S')}<br>
+                                        <b>Raio de influência:</b> {distancia_maxima_km} km<br>
+                                        <b>Cancelamentos pelo Taxista:</b> {evento.cancelamentos_taxista}<br>
+                                        <b>Cancelamentos pelo Passageiro:</b> {evento.cancelamentos_passageiro}<br>
+                                        <b>Total Cancelamentos:</b> {evento.total_cancelamentos}
+                                    """,
+        ).add_to(marker_cluster)
+
+    # Limites das favelas, buscados do app conforme o zoom
+    CamadaLimites(URL_LIMITES, NIVEIS_CAMADA).add_to(mapa_cancelamentos)
+
+    # Corridas do período agregadas em grade (desligada por padrão)
+    CamadaCelulas(URL_CELULAS + 'rides_original', 'Corridas por célula',
+                  parametros={'inicio': parametros['data_inicio'], 'fim': parametros['data_fim']},
+                  show=False).add_to(mapa_cancelamentos)
+    folium.LayerControl().add_to(mapa_cancelamentos)
+
+    with medir("tabela"):
+        tabela_html = resultados.to_html(index=False, classes='table table-striped')
 
     # Criar visualização Sankey
-    sankey_df = pd.DataFrame(resultados_sankey)
+    sankey_df = resultados[['Bairro', 'Data', 'Evento', 'Total Cancelamentos']]
     nodes = list(set(sankey_df['Evento'].tolist() + sankey_df['Bairro'].tolist() + sankey_df['Data'].tolist()))
     nodes_dict = {node: i for i, node in enumerate(nodes)}
 
@@ -191,12 +206,60 @@ def index():
         )
     ))
     fig.update_layout(title_text="Eventos e os bairros atingidos", font_size=16)
-    sankey_html = fig.to_html(full_html=False)
+    with medir("sankey"):
+        sankey_html = fig.to_html(full_html=False)
+
+    with medir("mapa"):
+        mapa_html = mapa_cancelamentos._repr_html_()
 
-    mapa_html = mapa_cancelamentos._repr_html_()
+    return {"mapa": mapa_html, "sankey": sankey_html, "tabela": tabela_html}
+
+
+# Normalizar os filtros do formulário, para que combinações equivalentes gerem a mesma chave
+def normalizar_filtros(formulario):
+    def normalizar_data(valor):
+        return pd.Timestamp(valor).isoformat() if valor else None
+
+    # Área do mapa (lat_min, lng_min, lat_max, lng_max), só quando os quatro limites são informados
+    limites = [formulario.get(campo) for campo in ('lat_min', 'lng_min', 'lat_max', 'lng_max')]
+
+    return {
+        'distancia': round(float(formulario.get('distancia', 5)), 6),
+        'tempo': round(float(formulario.get('tempo', 2)), 6),
+        'data_inicio': normalizar_data(formulario.get('data_inicio')),
+        'data_fim': normalizar_data(formulario.get('data_fim')),
+        'tipo_evento': sorted(set(formulario.getlist('tipo_evento'))),
+        'limites': [round(float(valor), 6) for valor in limites] if all(limites) else None,
+    }
+
+
+def chave_filtros(parametros):
+    return (parametros['distancia'], parametros['tempo'], parametros['data_inicio'],
+            parametros['data_fim'], tuple(parametros['tipo_evento']), tuple(parametros['limites'] or ()))
+
+
+@mapa_ocorrencias_app.route('/', methods=['GET', 'POST'])
+def index():
+    # Página com os filtros, que busca os resultados por POST
+    if request.method == 'GET':
+        return render_template('impacto_eventos.html')
+
+    parametros = normalizar_filtros(request.form)
+    versao = versao_dados(COLECOES_MAPA)
+
+    # Só resultados prontos (no cache do worker ou de uma tarefa já concluída) são devolvidos na
+    # requisição; os demais são calculados em segundo plano e o cliente acompanha em /tarefas/<id>
+    chave = chave_filtros(parametros)
+    resultado = cache_mapa.obter(chave, versao)
+    if resultado is None:
+        identificador = submeter("mapa_ocorrencias", {**parametros, 'versao_dados': versao})
+        estado = consultar(identificador)
+        if estado['status'] != 'concluida':
+            return resposta_submetida(identificador)
+        resultado = estado['resultado']
+        cache_mapa.guardar(chave, versao, resultado)
+    return jsonify(resultado)
 
-    return jsonify({"mapa": mapa_html, "sankey": sankey_html, "tabela": tabela_html})
-    
 
 if __name__ == '__main__':
     try:
@@ -1,11 +1,13 @@
 import os
 import logging
-from pymongo import MongoClient
-import pandas as pd
-from sklearn.cluster import KMeans
-from sklearn.impute import KNNImputer
+import argparse
+from pymongo import MongoClient, UpdateOne
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
 from dotenv import load_dotenv
 
+from app.snapshot import registrar_alteracao
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
@@ -20,32 +22,140 @@ client = MongoClient(MONGO_URI)
 db = client["mobility_data"]
 collection = db["ocorrencias"]
 
-# Carregar os dados em um DataFrame
-df = pd.DataFrame(list(collection.find()))
-
-# Filtrar registros com valores nulos
-df_null = df[(df['latitude'].isnull()) | (df['longitude'].isnull())]
-df_full = df.dropna(subset=['latitude', 'longitude'])
-
-# Usar o KNN Imputer para preencher valores nulos
-imputer = KNNImputer(n_neighbors=5)
-df[['latitude', 'longitude']] = imputer.fit_transform(df[['latitude', 'longitude']])
-
-# Criar o campo 'location'
-df['location'] = df.apply(lambda row: {
-    "type": "Point",
-    "coordinates": [row['longitude'], row['latitude']]
-}, axis=1)
-
-# Atualizar o MongoDB
-for _, row in df.iterrows():
-    collection.update_one(
-        {"_id": row["_id"]},
-        {"$set": {
-            "latitude": row['latitude'],
-            "longitude": row['longitude'],
-            "location": row['location']
-        }}
-    )
-
-print("Valores nulos preenchidos com sucesso!")
\ No newline at end of file
+# Vizinhos usados na imputação (como no KNNImputer original) e documentos por bulk_write
+N_VIZINHOS = 5
+TAMANHO_LOTE = 1000
+
+# Documentos com latitude ou longitude nula, ausente ou NaN
+FILTRO_NULOS = {"$or": [
+    {"latitude": None}, {"longitude": None},
+    {"latitude": float("nan")}, {"longitude": float("nan")},
+]}
+
+# Documentos com as duas coordenadas numéricas, mas sem o campo 'location'
+FILTRO_SEM_LOCATION = {
+    "location": {"$exists": False},
+    "latitude": {"$type": "number", "$ne": float("nan")},
+    "longitude": {"$type": "number", "$ne": float("nan")},
+}
+
+
+def _numero(valor):
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        return np.nan
+    return valor
+
+
+# Índice dos pontos conhecidos. Segue a semântica do KNNImputer com duas colunas: a coordenada
+# ausente é a média das N_VIZINHOS ocorrências completas mais próximas na coordenada presente;
+# se as duas estiverem ausentes, usa-se a média de cada coluna.
+class ImputadorCoordenadas:
+    def __init__(self, n_vizinhos=N_VIZINHOS):
+        latitudes, longitudes = [], []
+        cursor = collection.find({}, {"_id": 0, "latitude": 1, "longitude": 1})
+        for documento in cursor.batch_size(50_000):
+            latitudes.append(_numero(documento.get("latitude")))
+            longitudes.append(_numero(documento.get("longitude")))
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+
+        completos = np.isfinite(self.latitudes) & np.isfinite(self.longitudes)
+        if not completos.any():
+            raise ValueError("Não há ocorrências com coordenadas conhecidas para a imputação.")
+        # Médias de cada coluna sobre todos os valores presentes, como no KNNImputer
+        self.media = (np.nanmean(self.latitudes), np.nanmean(self.longitudes))
+        self.latitudes, self.longitudes = self.latitudes[completos], self.longitudes[completos]
+
+        n_vizinhos = min(n_vizinhos, len(self.latitudes))
+        self.por_longitude = NearestNeighbors(n_neighbors=n_vizinhos).fit(self.longitudes[:, None])
+        self.por_latitude = NearestNeighbors(n_neighbors=n_vizinhos).fit(self.latitudes[:, None])
+        logging.info(f"Índice com {len(self.latitudes)} ocorrências de coordenadas conhecidas.")
+
+    # Imputar arrays de latitude/longitude (NaN nas posições ausentes)
+    def imputar(self, latitudes, longitudes):
+        latitudes, longitudes = latitudes.copy(), longitudes.copy()
+        sem_lat = np.isnan(latitudes)
+        sem_lng = np.isnan(longitudes)
+
+        so_lat = sem_lat & ~sem_lng
+        if so_lat.any():
+            vizinhos = self.por_longitude.kneighbors(longitudes[so_lat, None], return_distance=False)
+            latitudes[so_lat] = self.latitudes[vizinhos].mean(axis=1)
+
+        so_lng = sem_lng & ~sem_lat
+        if so_lng.any():
+            vizinhos = self.por_latitude.kneighbors(latitudes[so_lng, None], return_distance=False)
+            longitudes[so_lng] = self.longitudes[vizinhos].mean(axis=1)
+
+        ambas = sem_lat & sem_lng
+        latitudes[ambas], longitudes[ambas] = self.media
+        return latitudes, longitudes
+
+
+def contar_pendentes():
+    return {
+        "sem_coordenadas": collection.count_documents(FILTRO_NULOS),
+        "sem_location": collection.count_documents(FILTRO_SEM_LOCATION),
+    }
+
+
+# Imputar as coordenadas ausentes em lotes. Os documentos corrigidos deixam de casar com
+# FILTRO_NULOS, então uma execução interrompida recomeça naturalmente de onde parou. A marca do
+# território é removida para que `python -m app.favelas` os classifique de novo.
+def imputar_coordenadas(n_vizinhos=N_VIZINHOS, tamanho_lote=TAMANHO_LOTE):
+    imputador = ImputadorCoordenadas(n_vizinhos)
+    atualizados = 0
+    ultimo_id = None
+    while True:
+        filtro = FILTRO_NULOS if ultimo_id is None else {"$and": [FILTRO_NULOS, {"_id": {"$gt": ultimo_id}}]}
+        lote = list(collection.find(filtro, {"latitude": 1, "longitude": 1})
+                    .sort("_id", 1).limit(tamanho_lote))
+        if not lote:
+            break
+        ultimo_id = lote[-1]["_id"]
+
+        latitudes = np.array([_numero(d.get("latitude")) for d in lote], dtype=np.float64)
+        longitudes = np.array([_numero(d.get("longitude")) for d in lote], dtype=np.float64)
+        latitudes, longitudes = imputador.imputar(latitudes, longitudes)
+
+        operacoes = [
+            UpdateOne({"_id": documento["_id"]}, {"$set": {
+                "latitude": lat,
+                "longitude": lng,
+                "location": {"type": "Point", "coordinates": [lng, lat]},
+                "coordenadas_imputadas": True,
+            }, "$unset": {"territorio_versao": ""}})
+            for documento, lat, lng in zip(lote, latitudes.tolist(), longitudes.tolist())
+        ]
+        atualizados += collection.bulk_write(operacoes, ordered=False).modified_count
+        logging.info(f"{atualizados} ocorrências com coordenadas imputadas.")
+    return atualizados
+
+
+# Preencher 'location' a partir de latitude/longitude, no próprio servidor, para os documentos
+# completos que ainda não têm o campo
+def preencher_location():
+    resultado = collection.update_many(FILTRO_SEM_LOCATION, [
+        {"$set": {"location": {"type": "Point", "coordinates": ["$longitude", "$latitude"]}}},
+    ])
+    logging.info(f"'location' preenchido em {resultado.modified_count} ocorrências.")
+    return resultado.modified_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Imputa as coordenadas ausentes das ocorrências.")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas conta os documentos pendentes.")
+    parser.add_argument("--vizinhos", type=int, default=N_VIZINHOS)
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE)
+    args = parser.parse_args()
+
+    pendentes = contar_pendentes()
+    logging.info(f"{pendentes['sem_coordenadas']} ocorrências sem coordenadas; "
+                 f"{pendentes['sem_location']} sem o campo 'location'.")
+    if not args.dry_run:
+        alterados = imputar_coordenadas(args.vizinhos, args.lote) + preencher_location()
+        if alterados:
+            registrar_alteracao("ocorrencias")
+        print("Valores nulos preenchidos com sucesso!")
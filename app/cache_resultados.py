@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+# Tamanho aproximado (bytes) de um resultado: soma dos textos/bytes que ele contém
+def _tamanho(valor):
+    if isinstance(valor, str):
+        return len(valor.encode('utf-8'))
+    if isinstance(valor, (bytes, bytearray)):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(_tamanho(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sum(_tamanho(v) for v in valor)
+    return 64
+
+
+# Cache LRU em memória, limitado pelo tamanho total dos resultados guardados.
+# As entradas são chaveadas pelos parâmetros normalizados e valem para uma única versão dos
+# dados: quando a versão muda, todas as entradas anteriores são descartadas.
+class CacheResultados:
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()
+        self._tamanhos = {}
+        self._total = 0
+        self._versao = None
+        self._trava = threading.Lock()
+
+    def _trocar_versao(self, versao):
+        if versao != self._versao:
+            self._itens.clear()
+            self._tamanhos.clear()
+            self._total = 0
+            self._versao = versao
+
+    def obter(self, chave, versao):
+        with self._trava:
+            self._trocar_versao(versao)
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def guardar(self, chave, versao, valor):
+        tamanho = _tamanho(valor)
+        with self._trava:
+            self._trocar_versao(versao)
+            if tamanho > self.limite_bytes:
+                return
+            if chave in self._itens:
+                self._total -= self._tamanhos.pop(chave)
+                del self._itens[chave]
+
+            # Remover os menos usados recentemente até caber o novo resultado
+            while self._itens and self._total + tamanho > self.limite_bytes:
+                antiga, _ = self._itens.popitem(last=False)
+                self._total -= self._tamanhos.pop(antiga)
+
+            self._itens[chave] = valor
+            self._tamanhos[chave] = tamanho
+            self._total += tamanho
+
+    def limpar(self):
+        with self._trava:
+            self._trocar_versao(None)
+
+    def estatisticas(self):
+        with self._trava:
+            return {'entradas': len(self._itens), 'bytes': self._total, 'limite_bytes': self.limite_bytes}
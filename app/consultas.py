@@ -0,0 +1,161 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.instrumentacao import medir
+from app.snapshot import db, ESQUEMAS, carregar_snapshot, _lote_para_arrow, _esquema_arrow, _projecao, TAMANHO_LOTE
+from app.tabelas import CATEGORIA, DATA, OBJECTID, TEXTO, bytes_objectid, para_pandas
+
+logger = logging.getLogger(__name__)
+
+# Camada de consultas: os filtros dos dashboards são descritos como uma lista de condições
+# (campo, operador, valor) e traduzidos tanto para um filtro do MongoDB (com projeção) quanto
+# para uma expressão do Arrow aplicada na leitura do snapshot, antes de gerar o DataFrame.
+# Operadores: '>=', '<=', 'in' e 'caixa' (valor = (lat_min, lng_min, lat_max, lng_max)).
+
+# Colunas de latitude/longitude no snapshot de cada coleção (no MongoDB a caixa usa `location`)
+COLUNAS_GEO = {
+    'rides_original': ('origin_lat', 'origin_lng'),
+    'ocorrencias': ('latitude', 'longitude'),
+    'events': ('latitude', 'longitude'),
+}
+
+# Origem das consultas dos dashboards: o MongoDB diretamente (filtro e projeção aplicados no
+# servidor) ou os snapshots. Com CONSULTAS_AO_VIVO=1 sempre o MongoDB, com 0 sempre os snapshots
+# e, no padrão (auto), o MongoDB para consultas estreitas (período de até CONSULTAS_DIAS_AO_VIVO
+# dias ou caixa geográfica), que os índices de data e 2dsphere resolvem lendo só as linhas
+# selecionadas; as amplas, que trariam boa parte da coleção, ficam com os snapshots.
+CONSULTAS_AO_VIVO = os.getenv("CONSULTAS_AO_VIVO", "auto")
+CONSULTAS_DIAS_AO_VIVO = float(os.getenv("CONSULTAS_DIAS_AO_VIVO", 31))
+
+
+def _data(valor):
+    return pd.Timestamp(valor).to_pydatetime() if valor is not None else None
+
+
+def periodo(campo_inicio, inicio=None, fim=None, campo_fim=None):
+    condicoes = []
+    if inicio is not None:
+        condicoes.append((campo_inicio, '>=', _data(inicio)))
+    if fim is not None:
+        condicoes.append((campo_fim or campo_inicio, '<=', _data(fim)))
+    return condicoes
+
+
+def caixa(limites):
+    return [('location', 'caixa', tuple(float(v) for v in limites))] if limites else []
+
+
+# Corridas: intervalo de created_at, status e caixa geográfica
+def filtros_corridas(inicio=None, fim=None, status=None, limites=None):
+    condicoes = periodo('created_at', inicio, fim)
+    if status:
+        condicoes.append(('status', 'in', list(status)))
+    return condicoes + caixa(limites)
+
+
+# Ocorrências: início a partir de `inicio` e fim até `fim`, procedimentos (pelos ids resolvidos
+# a partir dos títulos) e caixa geográfica
+def filtros_ocorrencias(inicio=None, fim=None, id_pops=None, limites=None):
+    condicoes = periodo('data_inicio', inicio, fim, campo_fim='data_fim')
+    if id_pops is not None:
+        condicoes.append(('id_pop', 'in', list(id_pops)))
+    return condicoes + caixa(limites)
+
+
+def filtros_eventos(inicio=None, fim=None, limites=None):
+    return periodo('date', inicio, fim) + caixa(limites)
+
+
+# Decidir se as condições são consultadas no MongoDB (ver CONSULTAS_AO_VIVO)
+def consultar_ao_vivo(condicoes):
+    if CONSULTAS_AO_VIVO in ('0', '1'):
+        return CONSULTAS_AO_VIVO == '1'
+    if any(operador == 'caixa' for _, operador, _ in condicoes):
+        return True
+    inicios = [valor for _, operador, valor in condicoes if operador == '>=' and isinstance(valor, datetime)]
+    fins = [valor for _, operador, valor in condicoes if operador == '<=' and isinstance(valor, datetime)]
+    return bool(inicios and fins) and max(fins) - min(inicios) <= timedelta(days=CONSULTAS_DIAS_AO_VIVO)
+
+
+# Traduzir as condições para um filtro do MongoDB
+def para_mongo(condicoes):
+    filtro = {}
+    for campo, operador, valor in condicoes:
+        if operador == 'caixa':
+            lat_min, lng_min, lat_max, lng_max = valor
+            filtro[campo] = {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [[
+                [lng_min, lat_min], [lng_max, lat_min], [lng_max, lat_max], [lng_min, lat_max], [lng_min, lat_min]]]}}}
+        elif operador == 'in':
+            filtro.setdefault(campo, {})['$in'] = valor
+        else:
+            filtro.setdefault(campo, {})['$gte' if operador == '>=' else '$lte'] = valor
+    return filtro
+
+
+# Traduzir as condições para uma expressão do Arrow sobre as colunas do snapshot
+def para_arrow(nome, condicoes):
+    esquema = ESQUEMAS[nome]
+    expressao = None
+    for campo, operador, valor in condicoes:
+        if operador == 'caixa':
+            lat_min, lng_min, lat_max, lng_max = valor
+            coluna_lat, coluna_lng = COLUNAS_GEO[nome]
+            parte = ((pc.field(coluna_lat) >= lat_min) & (pc.field(coluna_lat) <= lat_max)
+                     & (pc.field(coluna_lng) >= lng_min) & (pc.field(coluna_lng) <= lng_max))
+        elif operador == 'in':
+            tipo = esquema[campo][1]
+            # No snapshot, categorias são texto e ObjectIds são os 12 bytes
+            if tipo == OBJECTID:
+                valores = pa.array([bytes_objectid(v) for v in valor], type=OBJECTID)
+            else:
+                valores = [str(v) for v in valor] if tipo in (TEXTO, CATEGORIA) else valor
+            parte = pc.field(campo).isin(valores)
+        else:
+            escalar = pa.scalar(valor, type=DATA) if esquema[campo][1] == DATA else valor
+            parte = pc.field(campo) >= escalar if operador == '>=' else pc.field(campo) <= escalar
+        expressao = parte if expressao is None else expressao & parte
+    return expressao
+
+
+# Ler do snapshot (ou do MongoDB, ver consultar_ao_vivo) apenas as linhas e colunas que atendem
+# às condições
+def carregar(nome, condicoes=(), colunas=None, atualizar=True, ao_vivo=None):
+    if consultar_ao_vivo(condicoes) if ao_vivo is None else ao_vivo:
+        return buscar(nome, condicoes, colunas)
+    with medir("snapshot"):
+        return carregar_snapshot(nome, colunas, atualizar=atualizar, filtro=para_arrow(nome, condicoes))
+
+
+# Consultar diretamente o MongoDB com filtro e projeção (dados ao vivo, sem snapshot); o resultado
+# tem os mesmos tipos das colunas do snapshot
+def buscar(nome, condicoes=(), colunas=None):
+    esquema = ESQUEMAS[nome]
+    if colunas is not None:
+        esquema = {coluna: esquema[coluna] for coluna in colunas}
+    cursor = db[nome].find(para_mongo(condicoes), _projecao(esquema)).batch_size(TAMANHO_LOTE)
+
+    # O tempo no servidor é medido pelo monitor de comandos; aqui entra também a conversão
+    with medir("buscar"):
+        lotes, documentos = [], []
+        for documento in cursor:
+            documentos.append(documento)
+            if len(documentos) >= TAMANHO_LOTE:
+                lotes.append(_lote_para_arrow(documentos, esquema))
+                documentos = []
+        if documentos:
+            lotes.append(_lote_para_arrow(documentos, esquema))
+        return para_pandas(pa.Table.from_batches(lotes, schema=_esquema_arrow(esquema)))
+
+
+# Resolver os ids dos procedimentos operacionais a partir dos títulos escolhidos no formulário
+def resolver_id_pop(titulos, ao_vivo=None):
+    condicoes = [('pop_titulo', 'in', list(titulos))]
+    if consultar_ao_vivo(condicoes) if ao_vivo is None else ao_vivo:
+        return db['procedimento_operacional_padrao'].distinct('id_pop', para_mongo(condicoes))
+    procedimentos = carregar('procedimento_operacional_padrao', condicoes, ['id_pop'])
+    return procedimentos['id_pop'].dropna().unique().tolist()
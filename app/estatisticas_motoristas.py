@@ -0,0 +1,135 @@
+import os
+import argparse
+import logging
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from app.snapshot import _alteracoes
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Conectar ao MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['mobility_data']
+rides_collection = db['rides_original']
+stats_collection = db['driver_stats']
+
+# Marca d'água (_id da última corrida considerada) e contador de alterações de rides_original
+# na última atualização
+controle_collection = db['sincronizacao_driver_stats']
+CHAVE_CONTROLE = 'rides_original'
+
+# Motoristas recalculados por execução do pipeline
+MOTORISTAS_POR_LOTE = 5000
+
+
+# Valor numérico que não é NaN (como os valores considerados por mean/sum/count do pandas)
+def _numero_valido(campo):
+    return {'$and': [{'$isNumber': campo}, {'$ne': [campo, float('nan')]}]}
+
+
+def _contar_se(condicao):
+    return {'$sum': {'$cond': [condicao, 1, 0]}}
+
+
+# Estatísticas por motorista calculadas no servidor: média da avaliação, corridas finalizadas,
+# total de corridas com `finalizada` preenchido, canceladas (finalizada == 0), comentários e o
+# bairro com mais cancelamentos (empates pelo nome do bairro). O resultado é gravado em
+# driver_stats com $merge, substituindo apenas os motoristas recalculados.
+def pipeline_estatisticas(motoristas=None, atualizado_em=None):
+    cancelada = {'$and': [_numero_valido('$finalizada'), {'$eq': ['$finalizada', 0]}]}
+    filtro = {'driver_id': {'$in': motoristas}} if motoristas is not None else {'driver_id': {'$ne': None}}
+    etapas = [
+        {'$match': filtro},
+        # Primeiro por motorista e bairro, para achar o bairro com mais cancelamentos
+        {'$group': {
+            '_id': {'driver_id': '$driver_id', 'bairro': '$suburb_client'},
+            'soma_avaliacoes': {'$sum': {'$cond': [_numero_valido('$rating_score'), '$rating_score', 0]}},
+            'avaliacoes': _contar_se(_numero_valido('$rating_score')),
+            'finalizadas': {'$sum': {'$cond': [_numero_valido('$finalizada'), '$finalizada', 0]}},
+            'corridas': _contar_se(_numero_valido('$finalizada')),
+            'canceladas': _contar_se(cancelada),
+            'comentarios': _contar_se({'$eq': [{'$type': '$rating_comment'}, 'string']}),
+        }},
+        # Bairros ausentes não concorrem ao bairro com mais cancelamentos
+        {'$addFields': {'ordem_bairro': {
+            '$cond': [{'$eq': [{'$type': '$_id.bairro'}, 'string']}, '$canceladas', -1]}}},
+        {'$sort': {'_id.driver_id': 1, 'ordem_bairro': -1, '_id.bairro': 1}},
+        {'$group': {
+            '_id': '$_id.driver_id',
+            'soma_avaliacoes': {'$sum': '$soma_avaliacoes'},
+            'avaliacoes': {'$sum': '$avaliacoes'},
+            'rides_completed': {'$sum': '$finalizadas'},
+            'total_rides': {'$sum': '$corridas'},
+            'cancelled_rides': {'$sum': '$canceladas'},
+            'comments_count': {'$sum': '$comentarios'},
+            'top_cancel_suburb': {'$first': {'$cond': [{'$gt': ['$ordem_bairro', 0]}, '$_id.bairro', None]}},
+            'top_cancel_count': {'$first': {'$max': ['$ordem_bairro', 0]}},
+        }},
+        {'$project': {
+            'average_rating': {'$cond': [{'$gt': ['$avaliacoes', 0]},
+                                         {'$divide': ['$soma_avaliacoes', '$avaliacoes']}, None]},
+            'rides_completed': 1,
+            'total_rides': 1,
+            'cancelled_rides': 1,
+            'cancel_rate': {'$cond': [{'$gt': ['$total_rides', 0]},
+                                      {'$divide': ['$cancelled_rides', '$total_rides']}, None]},
+            'comments_count': 1,
+            'top_cancel_suburb': 1,
+            'top_cancel_count': 1,
+            'atualizado_em': {'$literal': atualizado_em},
+        }},
+    ]
+    return etapas
+
+
+def _gravar(etapas):
+    rides_collection.aggregate(etapas + [{'$merge': {
+        'into': stats_collection.name, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}],
+        allowDiskUse=True)
+
+
+# Atualizar driver_stats. Sem `completo`, só os motoristas com corridas novas (_id acima da marca
+# d'água) são recalculados; se houve alteração registrada em rides_original (registrar_alteracao),
+# todos são recalculados e os motoristas sem corridas são removidos.
+def atualizar_estatisticas(completo=False):
+    inicio = datetime.now()
+    controle = controle_collection.find_one({'_id': CHAVE_CONTROLE}) or {}
+    alteracoes = _alteracoes('rides_original')
+    ultima = rides_collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    if ultima is None:
+        return 0
+    if not controle.get('marca_dagua') or controle.get('alteracoes') != alteracoes:
+        completo = True
+
+    if completo:
+        _gravar(pipeline_estatisticas(atualizado_em=inicio))
+        stats_collection.delete_many({'atualizado_em': {'$lt': inicio}})
+        atualizados = stats_collection.count_documents({})
+    else:
+        tocados = rides_collection.distinct('driver_id', {'_id': {'$gt': controle['marca_dagua'],
+                                                                  '$lte': ultima['_id']}})
+        for posicao in range(0, len(tocados), MOTORISTAS_POR_LOTE):
+            _gravar(pipeline_estatisticas(tocados[posicao:posicao + MOTORISTAS_POR_LOTE], inicio))
+        atualizados = len(tocados)
+
+    controle_collection.update_one({'_id': CHAVE_CONTROLE}, {'$set': {
+        'marca_dagua': ultima['_id'], 'alteracoes': alteracoes, 'atualizado_em': inicio}}, upsert=True)
+    logger.info(f"driver_stats: {atualizados} motoristas atualizados "
+                f"({'completo' if completo else 'incremental'}) em {datetime.now() - inicio}.")
+    return atualizados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Atualiza as estatísticas por motorista (driver_stats).")
+    parser.add_argument('--completo', action='store_true', help="Recalcula todos os motoristas.")
+    args = parser.parse_args()
+    atualizar_estatisticas(args.completo)
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import gzip
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+from dotenv import load_dotenv
+from flask import Blueprint, Response, request
+from pymongo import MongoClient, UpdateOne
+
+from app.normalizacao import extrair_numeros
+from app.snapshot import registrar_alteracao
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Conectar ao MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['mobility_data']
+
+# Limites das favelas do Rio (Data.Rio, 2019), em lng/lat (CRS84)
+CAMINHO_FAVELAS = os.getenv("CAMINHO_FAVELAS", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "Limite_Favelas_2019.geojson"))
+
+# Campos gravados em cada documento (None fora das favelas) e o campo com a versão dos limites usada
+CAMPOS_TERRITORIO = ['favela', 'cod_favela', 'complexo', 'bairro_favela', 'cod_ap']
+CAMPO_VERSAO = 'territorio_versao'
+
+# Caminhos das coordenadas em cada coleção (o primeiro presente é usado)
+COORDENADAS_COLECOES = {
+    'rides_original': (['origin_lat', 'location.coordinates.1'], ['origin_lng', 'location.coordinates.0']),
+    'ocorrencias': (['latitude', 'location.coordinates.1'], ['longitude', 'location.coordinates.0']),
+    'events': (['location.coordinates.1', 'latitude'], ['location.coordinates.0', 'longitude']),
+}
+
+TAMANHO_LOTE = 5000
+
+# Níveis de zoom para os quais a camada de limites é gerada; cada requisição usa o maior nível
+# que não passa do zoom pedido. A tolerância da simplificação é meio pixel do nível e as
+# coordenadas são arredondadas para o décimo de pixel (casas decimais em graus).
+NIVEIS_CAMADA = [10, 12, 14, 16]
+CAMPOS_CAMADA = {'nome': 'favela', 'complexo': 'complexo', 'bairro': 'bairro_favela'}
+
+_indice = None
+_trava = threading.Lock()
+_camadas = {}
+
+favelas_app = Blueprint("favelas_app", __name__)
+URL_LIMITES = "/favelas/limites/"
+
+
+# Índice espacial dos polígonos, carregado uma única vez por processo
+class IndiceFavelas:
+    def __init__(self, caminho=CAMINHO_FAVELAS):
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+        self.versao = hashlib.sha1(conteudo).hexdigest()[:12]
+
+        features = json.loads(conteudo)['features']
+        self.geometrias = np.array([shape(feature['geometry']) for feature in features], dtype=object)
+        shapely.prepare(self.geometrias)
+        self.arvore = shapely.STRtree(self.geometrias)
+
+        propriedades = [feature['properties'] for feature in features]
+        self.atributos = pd.DataFrame({
+            'favela': [p.get('nome') for p in propriedades],
+            'cod_favela': [p.get('cod_favela') for p in propriedades],
+            'complexo': [p.get('complexo') for p in propriedades],
+            'bairro_favela': [p.get('bairro') for p in propriedades],
+            'cod_ap': [p.get('cod_ap') for p in propriedades],
+            'pop_sabren': [p.get('pop_sabren') for p in propriedades],
+        })
+        logger.info(f"{len(features)} polígonos de favelas carregados (versão {self.versao}).")
+
+    # Posição do polígono que contém cada ponto (-1 quando nenhum contém ou a coordenada é inválida)
+    def localizar_indices(self, latitudes, longitudes):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        resultado = np.full(len(latitudes), -1, dtype=np.int64)
+        validos = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+        if validos.size == 0:
+            return resultado
+
+        pontos = shapely.points(longitudes[validos], latitudes[validos])
+        idx_pontos, idx_poligonos = self.arvore.query(pontos, predicate='within')
+        # Em polígonos sobrepostos, fica o primeiro encontrado para cada ponto
+        primeiros = np.unique(idx_pontos, return_index=True)[1]
+        resultado[validos[idx_pontos[primeiros]]] = idx_poligonos[primeiros]
+        return resultado
+
+    # Atributos do território (favela, complexo, bairro, AP) de cada ponto, com None fora das favelas
+    def localizar(self, latitudes, longitudes):
+        posicoes = self.localizar_indices(latitudes, longitudes)
+        territorio = self.atributos.iloc[np.where(posicoes >= 0, posicoes, 0)].reset_index(drop=True)
+        territorio = territorio.astype(object)
+        territorio.loc[posicoes < 0, :] = None
+        return territorio
+
+    # GeoJSON dos limites simplificado e quantizado para um nível de zoom (bytes, sem espaços)
+    def camada_geojson(self, nivel):
+        grau_por_pixel = 360 / (256 * 2 ** nivel)
+        casas = int(np.ceil(-np.log10(grau_por_pixel / 10)))
+        geometrias = shapely.simplify(self.geometrias, grau_por_pixel / 2, preserve_topology=True)
+        geometrias = shapely.transform(geometrias, lambda coordenadas: np.round(coordenadas, casas))
+
+        features = []
+        for posicao, geometria in enumerate(geometrias):
+            if geometria.is_empty:
+                continue
+            propriedades = {chave: _valor_mongo(self.atributos.at[posicao, campo])
+                            for chave, campo in CAMPOS_CAMADA.items()}
+            features.append({'type': 'Feature', 'geometry': shapely.geometry.mapping(geometria),
+                             'properties': propriedades})
+        return json.dumps({'type': 'FeatureCollection', 'features': features},
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def obter_indice():
+    global _indice
+    if _indice is None:
+        with _trava:
+            if _indice is None:
+                _indice = IndiceFavelas()
+    return _indice
+
+
+def nivel_camada(zoom):
+    return max([nivel for nivel in NIVEIS_CAMADA if nivel <= zoom] or NIVEIS_CAMADA[:1])
+
+
+# Camada de um nível, gerada uma vez por processo e guardada junto com a versão gzip
+def obter_camada(nivel):
+    indice = obter_indice()
+    chave = (indice.versao, nivel)
+    if chave not in _camadas:
+        with _trava:
+            if chave not in _camadas:
+                conteudo = indice.camada_geojson(nivel)
+                _camadas[chave] = (conteudo, gzip.compress(conteudo, compresslevel=9))
+                logger.info(f"Camada de favelas do nível {nivel}: {len(conteudo)} bytes "
+                            f"({len(_camadas[chave][1])} com gzip).")
+    return indice.versao, _camadas[chave]
+
+
+# Limites das favelas simplificados para o zoom pedido. O ETag depende da versão do arquivo de
+# limites, do nível e da codificação, para que o navegador revalide com um 304 sem corpo.
+@favelas_app.route('/limites/<int:zoom>')
+def limites(zoom):
+    nivel = nivel_camada(zoom)
+    versao, (conteudo, comprimido) = obter_camada(nivel)
+    usar_gzip = 'gzip' in request.accept_encodings
+
+    resposta = Response(comprimido if usar_gzip else conteudo, mimetype='application/geo+json')
+    if usar_gzip:
+        resposta.headers['Content-Encoding'] = 'gzip'
+    resposta.headers['Vary'] = 'Accept-Encoding'
+    resposta.cache_control.public = True
+    resposta.cache_control.max_age = 86400
+    resposta.set_etag(f"{versao}-{nivel}{'-gz' if usar_gzip else ''}")
+    return resposta.make_conditional(request)
+
+
+def _valor_mongo(valor):
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+# Gravar o território nos documentos de uma coleção que ainda não foram classificados com a
+# versão atual dos limites (documentos novos, ou todos se o arquivo de limites mudar)
+def classificar_colecao(nome, tamanho_lote=TAMANHO_LOTE):
+    indice = obter_indice()
+    caminhos_lat, caminhos_lng = COORDENADAS_COLECOES[nome]
+    projecao = {caminho.split('.')[0]: 1 for caminho in caminhos_lat + caminhos_lng}
+    filtro_pendentes = {CAMPO_VERSAO: {'$ne': indice.versao}}
+
+    atualizados = 0
+    ultimo_id = None
+    while True:
+        filtro = filtro_pendentes if ultimo_id is None else {**filtro_pendentes, '_id': {'$gt': ultimo_id}}
+        lote = list(db[nome].find(filtro, projecao).sort('_id', 1).limit(tamanho_lote))
+        if not lote:
+            break
+        ultimo_id = lote[-1]['_id']
+
+        pontos = {}
+        latitudes = extrair_numeros(lote, caminhos_lat, pontos)
+        longitudes = extrair_numeros(lote, caminhos_lng, pontos)
+        territorio = indice.localizar(latitudes, longitudes)
+
+        operacoes = [
+            UpdateOne({'_id': documento['_id']}, {'$set': {
+                **{campo: _valor_mongo(valor) for campo, valor in zip(CAMPOS_TERRITORIO, valores)},
+                CAMPO_VERSAO: indice.versao,
+            }})
+            for documento, valores in zip(lote, territorio[CAMPOS_TERRITORIO].itertuples(index=False))
+        ]
+        db[nome].bulk_write(operacoes, ordered=False)
+        atualizados += len(operacoes)
+        logger.info(f"{nome}: {atualizados} documentos classificados.")
+
+    if atualizados:
+        registrar_alteracao(nome)
+    return atualizados
+
+
+if __name__ == '__main__':
+    # Uso: python -m app.favelas [colecao ...]
+    for colecao in sys.argv[1:] or list(COORDENADAS_COLECOES):
+        classificar_colecao(colecao)
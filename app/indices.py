@@ -0,0 +1,159 @@
+import os
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Conectar ao MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['mobility_data']
+
+STATUS_CANCELADOS = ['Cancelada pelo Taxista', 'Cancelada pelo Passageiro']
+
+# Índices declarados por coleção (nomes fixos, para que a criação seja idempotente)
+INDICES = {
+    'rides_original': [
+        IndexModel([('location', GEOSPHERE)], name='location_2dsphere'),
+        IndexModel([('created_at', ASCENDING)], name='created_at'),
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING)], name='status_created_at'),
+        IndexModel([('driver_id', ASCENDING), ('finalizada', ASCENDING)], name='driver_id_finalizada'),
+        IndexModel([('finalizada', ASCENDING), ('rating_comment', ASCENDING)], name='finalizada_rating_comment'),
+    ],
+    'events': [
+        IndexModel([('location', GEOSPHERE)], name='location_2dsphere'),
+        IndexModel([('id', ASCENDING)], name='id_unico', unique=True),
+        IndexModel([('date', ASCENDING)], name='date'),
+    ],
+    'ocorrencias': [
+        IndexModel([('location', GEOSPHERE)], name='location_2dsphere'),
+        IndexModel([('data_inicio', ASCENDING), ('data_fim', ASCENDING)], name='data_inicio_data_fim'),
+        IndexModel([('id_pop', ASCENDING)], name='id_pop'),
+    ],
+    'procedimento_operacional_padrao': [
+        IndexModel([('id_pop', ASCENDING)], name='id_pop'),
+        IndexModel([('pop_titulo', ASCENDING)], name='pop_titulo'),
+    ],
+}
+
+
+# Consultas representativas dos dashboards e carregadores: (descrição, coleção, filtro, ordenação)
+def consultas_painel():
+    primeira_corrida = db['rides_original'].find_one({}, {'_id': 1}, sort=[('_id', ASCENDING)])
+    fim = datetime.now()
+    inicio = fim - timedelta(days=30)
+    ponto_centro = {'type': 'Point', 'coordinates': [-43.1729, -22.9068]}
+    return [
+        ("Mapa de ocorrências: corridas no período", 'rides_original',
+         {'created_at': {'$gte': inicio, '$lte': fim}}, None),
+        ("Mapa de ocorrências: cancelamentos no período", 'rides_original',
+         {'status': {'$in': STATUS_CANCELADOS}, 'created_at': {'$gte': inicio, '$lte': fim}}, None),
+        ("Mapa de ocorrências: ocorrências no período", 'ocorrencias',
+         {'data_inicio': {'$gte': inicio}, 'data_fim': {'$lte': fim}}, None),
+        ("Mapa de ocorrências: títulos dos procedimentos", 'procedimento_operacional_padrao',
+         {'id_pop': {'$in': [1, 2, 3]}}, None),
+        ("Comentários: corridas canceladas de um motorista", 'rides_original',
+         {'driver_id': 1, 'finalizada': 0}, None),
+        ("Sentimentos: comentários de corridas canceladas", 'rides_original',
+         {'finalizada': 0, 'rating_comment': {'$type': 'string'}}, None),
+        ("Áreas de risco: eventos no período", 'events',
+         {'date': {'$gte': inicio, '$lte': fim}}, None),
+        ("Áreas de risco: eventos a 5 km do centro", 'events',
+         {'location': {'$nearSphere': {'$geometry': ponto_centro, '$maxDistance': 5000}}}, None),
+        ("Corridas em um retângulo do mapa", 'rides_original',
+         {'location': {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [[
+             [-43.25, -22.95], [-43.15, -22.95], [-43.15, -22.85], [-43.25, -22.85], [-43.25, -22.95]]]}}}}, None),
+        ("Snapshot: documentos novos (marca d'água)", 'rides_original',
+         {'_id': {'$gt': primeira_corrida['_id']}} if primeira_corrida else {}, [('_id', ASCENDING)]),
+        ("Carga Fogo Cruzado: upsert por id", 'events',
+         {'id': 'exemplo'}, None),
+        ("Ocorrências mais recentes", 'ocorrencias',
+         {}, [('data_inicio', DESCENDING)]),
+    ]
+
+
+# Criar os índices declarados (os já existentes com a mesma definição são ignorados pelo MongoDB)
+def criar_indices(colecoes=None):
+    for nome in colecoes or INDICES:
+        for indice in INDICES[nome]:
+            definicao = indice.document
+            try:
+                db[nome].create_indexes([indice])
+                logger.info(f"{nome}: índice '{definicao['name']}' garantido.")
+            except OperationFailure as e:
+                logger.error(f"{nome}: não foi possível criar o índice '{definicao['name']}': {e}")
+
+
+# Percorrer o plano vencedor e coletar os estágios e os índices usados
+def _resumir_plano(plano, estagios=None, indices=None):
+    estagios = [] if estagios is None else estagios
+    indices = [] if indices is None else indices
+    estagios.append(plano.get('stage'))
+    if plano.get('indexName'):
+        indices.append(plano['indexName'])
+    for chave in ('inputStage', 'queryPlan'):
+        if chave in plano:
+            _resumir_plano(plano[chave], estagios, indices)
+    for subplano in plano.get('inputStages', []):
+        _resumir_plano(subplano, estagios, indices)
+    return estagios, indices
+
+
+# Relatório baseado em explain: índice usado, documentos examinados e tempo de cada consulta
+def relatorio_consultas():
+    linhas = []
+    for descricao, nome, filtro, ordenacao in consultas_painel():
+        cursor = db[nome].find(filtro, {'_id': 1})
+        if ordenacao:
+            cursor = cursor.sort(ordenacao)
+        try:
+            explicacao = cursor.explain()
+        except OperationFailure as e:
+            linhas.append((descricao, nome, 'ERRO', str(e), '', ''))
+            continue
+
+        planejador = explicacao.get('queryPlanner', {})
+        estagios, indices = _resumir_plano(planejador.get('winningPlan', {}))
+        execucao = explicacao.get('executionStats', {})
+        linhas.append((
+            descricao, nome,
+            ', '.join(dict.fromkeys(indices)) or ('COLLSCAN' if 'COLLSCAN' in estagios else '-'),
+            ' > '.join(e for e in estagios if e),
+            execucao.get('totalDocsExamined', ''),
+            execucao.get('executionTimeMillis', ''),
+        ))
+    return linhas
+
+
+def imprimir_relatorio(linhas):
+    cabecalho = ('Consulta', 'Coleção', 'Índice', 'Plano', 'Docs examinados', 'ms')
+    larguras = [max(len(str(linha[i])) for linha in [cabecalho] + linhas) for i in range(len(cabecalho))]
+    for linha in [cabecalho] + linhas:
+        print('  '.join(str(valor).ljust(largura) for valor, largura in zip(linha, larguras)))
+
+
+if __name__ == '__main__':
+    # Uso: python -m app.indices [--sem-criar] [--sem-relatorio] [colecao ...]
+    parser = argparse.ArgumentParser(description="Cria os índices do mobility_data e mostra quais consultas os usam.")
+    parser.add_argument('colecoes', nargs='*', help=f"Coleções cujos índices serão criados: {', '.join(INDICES)}.")
+    parser.add_argument('--sem-criar', action='store_true', help="Apenas mostra o relatório.")
+    parser.add_argument('--sem-relatorio', action='store_true', help="Apenas cria os índices.")
+    args = parser.parse_args()
+    desconhecidas = [nome for nome in args.colecoes if nome not in INDICES]
+    if desconhecidas:
+        parser.error(f"coleções desconhecidas: {', '.join(desconhecidas)}")
+
+    if not args.sem_criar:
+        criar_indices(args.colecoes or None)
+    if not args.sem_relatorio:
+        imprimir_relatorio(relatorio_consultas())
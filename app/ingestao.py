@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.normalizacao import normalizar_datas, montar_pontos, indicadores_status
+from app.tarefas import tarefa, db
+from app.rollups import ROLLUPS, atualizar_rollup
+from app.series_temporais import SERIES, atualizar_serie
+from app.estatisticas_motoristas import atualizar_estatisticas
+
+logger = logging.getLogger(__name__)
+
+# Linhas lidas do CSV por vez e documentos por chamada de insert_many
+TAMANHO_BLOCO_CSV = 50_000
+TAMANHO_LOTE_INSERCAO = 5_000
+
+# Tipos declarados das colunas conhecidas do export de corridas; as demais são inferidas
+ESQUEMA_CSV_CORRIDAS = {
+    # Identificador do motorista como inteiro (o mesmo tipo das corridas já gravadas e do gerador
+    # dos benchmarks): inferido por bloco, viria como int64 ou float64 (bloco com vazios), e o
+    # mesmo motorista seria gravado como 123 e 123.0
+    'driver_id': 'Int64',
+    'status': 'string',
+    'suburb_client': 'string',
+    'turno': 'string',
+    'rating_comment': 'string',
+    'origin_lat': 'float64',
+    'origin_lng': 'float64',
+    'driver_distance': 'float64',
+    'route_distance': 'float64',
+    'rating_score': 'float64',
+    'finalizada': 'float64',
+}
+COLUNAS_DATA_CORRIDAS = ['created_at']
+
+
+# Converter um bloco do CSV em documentos prontos para o MongoDB (nulos viram None), com a mesma
+# normalização usada na leitura (app.normalizacao): datas em UTC, `location` como ponto GeoJSON,
+# `driver_id` inteiro e `finalizada` derivada do status quando não vier preenchida
+def _bloco_para_documentos(bloco):
+    if 'driver_id' in bloco:
+        bloco['driver_id'] = bloco['driver_id'].astype('Int64')
+    for coluna in COLUNAS_DATA_CORRIDAS:
+        if coluna in bloco:
+            bloco[coluna] = normalizar_datas(bloco[coluna]).to_numpy()
+    if 'origin_lat' in bloco and 'origin_lng' in bloco:
+        bloco['location'] = montar_pontos(bloco['origin_lat'], bloco['origin_lng'])
+    if 'status' in bloco:
+        finalizadas = indicadores_status(bloco['status'])['completed'].astype(np.float64)
+        finalizadas = finalizadas.where(bloco['status'].notna())
+        bloco['finalizada'] = bloco['finalizada'].fillna(finalizadas) if 'finalizada' in bloco else finalizadas
+
+    bloco = bloco.astype(object).where(bloco.notna(), None)
+    return bloco.to_dict(orient='records')
+
+
+# Ingerir um CSV de corridas em blocos, com memória constante: cada bloco é lido com o esquema
+# declarado, convertido (datas e location) e gravado com insert_many não ordenado em lotes.
+# `progresso`, se informado, é chamado após cada bloco com o total de linhas gravadas e a
+# fração aproximada do arquivo já lida.
+def ingerir_csv(caminho, colecao, tamanho_bloco=TAMANHO_BLOCO_CSV, tamanho_lote=TAMANHO_LOTE_INSERCAO,
+                progresso=None):
+    inicio = time.monotonic()
+    linhas = 0
+    with open(caminho, 'rb') as arquivo:
+        tamanho_arquivo = os.fstat(arquivo.fileno()).st_size or 1
+        leitor = pd.read_csv(arquivo, chunksize=tamanho_bloco, dtype=ESQUEMA_CSV_CORRIDAS)
+        for bloco in leitor:
+            documentos = _bloco_para_documentos(bloco)
+            for posicao in range(0, len(documentos), tamanho_lote):
+                colecao.insert_many(documentos[posicao:posicao + tamanho_lote], ordered=False)
+            linhas += len(documentos)
+            if progresso is not None:
+                progresso(linhas, min(arquivo.tell() / tamanho_arquivo, 1.0))
+            logger.info(f"{linhas} linhas gravadas de {caminho}.")
+
+    segundos = time.monotonic() - inicio
+    return {
+        'linhas': linhas,
+        'segundos': round(segundos, 2),
+        'linhas_por_segundo': round(linhas / segundos, 1) if segundos > 0 else None,
+    }
+
+
+# Ingestão como tarefa em segundo plano (upload de CSV). O hash do conteúdo faz parte dos
+# parâmetros, de modo que reenviar o mesmo arquivo não o grava duas vezes.
+@tarefa("ingestao_csv")
+def tarefa_ingerir_csv(parametros, reportar):
+    resultado = ingerir_csv(parametros['caminho'], db[parametros['colecao']],
+                            progresso=lambda linhas, fracao: reportar(round(fracao, 3), {'linhas': linhas}))
+    # Somar as corridas novas aos agregados em grade e às séries temporais
+    if parametros['colecao'] in ROLLUPS:
+        atualizar_rollup(parametros['colecao'])
+    for nome, config in SERIES.items():
+        if config['colecao'] == parametros['colecao']:
+            atualizar_serie(nome)
+    # Recalcular as estatísticas dos motoristas das corridas novas
+    if parametros['colecao'] == 'rides_original':
+        atualizar_estatisticas()
+    return resultado
@@ -0,0 +1,228 @@
+import os
+import time
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import Response, g, has_request_context, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Instrumentação das requisições: trechos nomeados (spans) medidos com `medir`, tempo e documentos
+# das consultas ao MongoDB (via monitoramento de comandos do pymongo) e tamanho da resposta.
+# Os trechos de cada requisição vão para o cabeçalho Server-Timing; os acumulados do processo são
+# expostos em /metrics no formato texto do Prometheus (um conjunto por worker).
+
+# Perfil (cProfile) por requisição, gravado em PERFIL_DIR quando INSTRUMENTACAO_PERFIL=1 e a
+# requisição pede com ?perfil=1 ou o cabeçalho X-Perfil: 1
+PERFIL_HABILITADO = os.getenv("INSTRUMENTACAO_PERFIL", "0") == "1"
+PERFIL_DIR = os.getenv("PERFIL_DIR", "perfis")
+
+PREFIXO = "mobilidade"
+LIMITES_HISTOGRAMA = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# Comandos do MongoDB cujo retorno traz documentos em um cursor
+COMANDOS_CURSOR = {'find': 'firstBatch', 'aggregate': 'firstBatch', 'getMore': 'nextBatch'}
+
+
+# Acumulados do processo, protegidos por uma trava
+class Metricas:
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.requisicoes = {}
+        self.duracoes = {}
+        self.bytes_resposta = {}
+        self.spans = {}
+        self.mongo = {}
+
+    def registrar_span(self, nome, segundos):
+        with self.trava:
+            soma, contagem = self.spans.get(nome, (0.0, 0))
+            self.spans[nome] = (soma + segundos, contagem + 1)
+
+    def registrar_mongo(self, comando, colecao, segundos, documentos):
+        with self.trava:
+            soma, contagem, total_documentos = self.mongo.get((comando, colecao), (0.0, 0, 0))
+            self.mongo[(comando, colecao)] = (soma + segundos, contagem + 1, total_documentos + documentos)
+
+    def registrar_requisicao(self, rota, metodo, status, segundos, tamanho):
+        with self.trava:
+            chave = (rota, metodo, str(status))
+            self.requisicoes[chave] = self.requisicoes.get(chave, 0) + 1
+            baldes, soma, contagem = self.duracoes.get(rota, ([0] * len(LIMITES_HISTOGRAMA), 0.0, 0))
+            baldes = [total + (segundos <= limite) for total, limite in zip(baldes, LIMITES_HISTOGRAMA)]
+            self.duracoes[rota] = (baldes, soma + segundos, contagem + 1)
+            if tamanho is not None:
+                self.bytes_resposta[rota] = self.bytes_resposta.get(rota, 0) + tamanho
+
+    # Texto no formato de exposição do Prometheus (cada família com suas amostras em sequência)
+    def prometheus(self):
+        linhas = []
+
+        def familia(nome, tipo, ajuda, amostras):
+            linhas.append(f"# HELP {PREFIXO}_{nome} {ajuda}")
+            linhas.append(f"# TYPE {PREFIXO}_{nome} {tipo}")
+            for sufixo, rotulos, valor in amostras:
+                texto = ','.join(f'{chave}="{_escapar(v)}"' for chave, v in rotulos.items())
+                linhas.append(f"{PREFIXO}_{nome}{sufixo}{{{texto}}} {valor}")
+
+        with self.trava:
+            familia('requisicoes_total', 'counter', "Requisições atendidas.",
+                    [('', {'rota': rota, 'metodo': metodo, 'status': status}, total)
+                     for (rota, metodo, status), total in sorted(self.requisicoes.items())])
+
+            amostras = []
+            for rota, (baldes, soma, contagem) in sorted(self.duracoes.items()):
+                amostras += [('_bucket', {'rota': rota, 'le': limite}, total)
+                             for limite, total in zip(LIMITES_HISTOGRAMA, baldes)]
+                amostras += [('_bucket', {'rota': rota, 'le': '+Inf'}, contagem),
+                             ('_sum', {'rota': rota}, f"{soma:.6f}"),
+                             ('_count', {'rota': rota}, contagem)]
+            familia('requisicao_segundos', 'histogram', "Duração das requisições.", amostras)
+
+            familia('resposta_bytes_total', 'counter', "Bytes enviados nas respostas.",
+                    [('', {'rota': rota}, total) for rota, total in sorted(self.bytes_resposta.items())])
+
+            trechos = sorted(self.spans.items())
+            familia('trecho_segundos_total', 'counter', "Tempo gasto em cada trecho instrumentado.",
+                    [('', {'trecho': nome}, f"{soma:.6f}") for nome, (soma, _) in trechos])
+            familia('trecho_execucoes_total', 'counter', "Execuções de cada trecho instrumentado.",
+                    [('', {'trecho': nome}, contagem) for nome, (_, contagem) in trechos])
+
+            comandos = [({'comando': comando, 'colecao': colecao}, valores)
+                        for (comando, colecao), valores in sorted(self.mongo.items())]
+            familia('mongo_segundos_total', 'counter', "Tempo dos comandos no MongoDB.",
+                    [('', rotulos, f"{soma:.6f}") for rotulos, (soma, _, _) in comandos])
+            familia('mongo_comandos_total', 'counter', "Comandos enviados ao MongoDB.",
+                    [('', rotulos, contagem) for rotulos, (_, contagem, _) in comandos])
+            familia('mongo_documentos_total', 'counter', "Documentos devolvidos pelo MongoDB.",
+                    [('', rotulos, documentos) for rotulos, (_, _, documentos) in comandos])
+        return "\n".join(linhas) + "\n"
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metricas = Metricas()
+
+
+# Acumular um trecho na requisição atual (se houver) e nos acumulados do processo
+def _acumular(nome, segundos):
+    metricas.registrar_span(nome, segundos)
+    if has_request_context() and hasattr(g, 'trechos'):
+        soma, contagem = g.trechos.get(nome, (0.0, 0))
+        g.trechos[nome] = (soma + segundos, contagem + 1)
+
+
+# Medir um trecho nomeado; serve como `with medir("juncao"):` ou como decorador `@medir("juncao")`
+@contextmanager
+def medir(nome):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _acumular(nome, time.perf_counter() - inicio)
+
+
+# Tempo e documentos devolvidos de cada comando do MongoDB. Os eventos chegam na thread que executou
+# o comando, então a consulta é atribuída à requisição em andamento nessa thread.
+class MonitorMongo(monitoring.CommandListener):
+    def __init__(self):
+        self.locais = threading.local()
+
+    def _pendentes(self):
+        if not hasattr(self.locais, 'pendentes'):
+            self.locais.pendentes = {}
+        return self.locais.pendentes
+
+    def started(self, event):
+        comando = event.command_name
+        colecao = event.command.get('collection') if comando == 'getMore' else event.command.get(comando)
+        self._pendentes()[event.request_id] = colecao if isinstance(colecao, str) else '-'
+
+    def succeeded(self, event):
+        colecao = self._pendentes().pop(event.request_id, '-')
+        lote = COMANDOS_CURSOR.get(event.command_name)
+        documentos = len(event.reply.get('cursor', {}).get(lote, [])) if lote else 0
+        segundos = event.duration_micros / 1e6
+        metricas.registrar_mongo(event.command_name, colecao, segundos, documentos)
+        if has_request_context() and hasattr(g, 'trechos'):
+            soma, contagem, total_documentos = g.mongo
+            g.mongo = (soma + segundos, contagem + 1, total_documentos + documentos)
+
+    def failed(self, event):
+        self._pendentes().pop(event.request_id, None)
+
+
+# Registrado na importação: vale para os clientes criados depois (importar este módulo antes dos
+# módulos que abrem conexões)
+monitoring.register(MonitorMongo())
+
+
+def _pedir_perfil():
+    return PERFIL_HABILITADO and (request.args.get('perfil') == '1' or request.headers.get('X-Perfil') == '1')
+
+
+def _iniciar_requisicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.trechos = {}
+    g.mongo = (0.0, 0, 0)
+    g.perfil = None
+    if _pedir_perfil():
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+            g.perfil = perfil
+        except ValueError:
+            # Outro perfilador ativo (requisições simultâneas em threads)
+            logger.warning("Perfil não iniciado: já há um perfilador ativo.")
+
+
+def _gravar_perfil(perfil):
+    perfil.disable()
+    os.makedirs(PERFIL_DIR, exist_ok=True)
+    nome = (request.endpoint or 'requisicao').replace('/', '_').replace('.', '_')
+    caminho = os.path.join(PERFIL_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{nome}.prof")
+    perfil.dump_stats(caminho)
+    return caminho
+
+
+def _finalizar_requisicao(resposta):
+    if not hasattr(g, 'inicio_requisicao'):
+        return resposta
+    if g.perfil is not None:
+        resposta.headers['X-Perfil-Arquivo'] = _gravar_perfil(g.perfil)
+
+    segundos = time.perf_counter() - g.inicio_requisicao
+    tamanho = resposta.calculate_content_length() if not resposta.is_streamed else None
+    rota = request.url_rule.rule if request.url_rule is not None else 'desconhecida'
+    metricas.registrar_requisicao(rota, request.method, resposta.status_code, segundos, tamanho)
+
+    entradas = []
+    for nome, (soma, contagem) in g.trechos.items():
+        descricao = f';desc="{contagem}x"' if contagem > 1 else ''
+        entradas.append(f"{nome};dur={soma * 1000:.1f}{descricao}")
+    soma_mongo, comandos, documentos = g.mongo
+    if comandos:
+        entradas.append(f'mongo;dur={soma_mongo * 1000:.1f};desc="{comandos} comandos, {documentos} docs"')
+    if tamanho is not None:
+        entradas.append(f'resposta;desc="{tamanho} bytes"')
+    entradas.append(f"total;dur={segundos * 1000:.1f}")
+    resposta.headers.add('Server-Timing', ', '.join(entradas))
+    return resposta
+
+
+def endpoint_metricas():
+    return Response(metricas.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# Ligar a instrumentação a um app Flask (vale também para os callbacks do Dash montados nele)
+def instrumentar_app(flask_app):
+    flask_app.before_request(_iniciar_requisicao)
+    flask_app.after_request(_finalizar_requisicao)
+    flask_app.add_url_rule('/metrics', 'metricas', endpoint_metricas)
+    return flask_app
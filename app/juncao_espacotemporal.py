@@ -0,0 +1,200 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RAIO_TERRA_KM = 6371.0
+KM_POR_GRAU = np.pi * RAIO_TERRA_KM / 180.0
+
+# Limite de pares candidatos avaliados por bloco (controla o pico de memória)
+LIMITE_CANDIDATOS = 2_000_000
+
+# Deslocamentos das 9 células vizinhas (a própria célula e as 8 ao redor)
+_VIZINHOS = np.array([(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)], dtype=np.int64)
+
+STATUS_CANCELADA_TAXISTA = 'Cancelada pelo Taxista'
+STATUS_CANCELADA_PASSAGEIRO = 'Cancelada pelo Passageiro'
+
+
+# Distância haversine (em km) entre arrays de coordenadas em graus
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(v) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return RAIO_TERRA_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+# Converter datas (Series, array ou lista) para nanossegundos desde a época; NaT vira None na máscara
+def _para_ns(tempos):
+    tempos = pd.to_datetime(pd.Series(tempos).reset_index(drop=True), errors='coerce')
+    if getattr(tempos.dt, 'tz', None) is not None:
+        tempos = tempos.dt.tz_convert(None)
+    validos = tempos.notna().to_numpy()
+    return tempos.to_numpy(dtype='datetime64[ns]').astype(np.int64), validos
+
+
+# Expandir intervalos [inicio, inicio + tamanho) em um único array de posições
+def _expandir_intervalos(inicios, tamanhos):
+    total = int(tamanhos.sum())
+    deslocamentos = np.repeat(inicios - (np.cumsum(tamanhos) - tamanhos), tamanhos)
+    return np.arange(total, dtype=np.int64) + deslocamentos
+
+
+# Gerar, bloco a bloco, todos os pares (a, b) a até `distancia_km` e `janela_horas` um do outro.
+# O lado B é indexado em uma grade regular (células com lado >= raio) ordenada por (célula, tempo),
+# de modo que cada ponto de A consulta apenas as 9 células vizinhas e, dentro de cada uma, o
+# intervalo contíguo da janela temporal, encontrado com searchsorted.
+# Cada bloco é uma tupla (indices_a, indices_b, distancias_km, diferencas_horas) com posições
+# relativas à ordem original das entradas. `progresso`, se informado, é chamado após cada bloco
+# com a fração de A já processada.
+def iterar_pares(lat_a, lng_a, tempo_a, lat_b, lng_b, tempo_b, distancia_km, janela_horas,
+                 limite_candidatos=LIMITE_CANDIDATOS, progresso=None):
+    lat_a = np.asarray(lat_a, dtype=np.float64)
+    lng_a = np.asarray(lng_a, dtype=np.float64)
+    lat_b = np.asarray(lat_b, dtype=np.float64)
+    lng_b = np.asarray(lng_b, dtype=np.float64)
+    t_a, tempo_valido_a = _para_ns(tempo_a)
+    t_b, tempo_valido_b = _para_ns(tempo_b)
+
+    validos_a = np.flatnonzero(np.isfinite(lat_a) & np.isfinite(lng_a) & tempo_valido_a)
+    validos_b = np.flatnonzero(np.isfinite(lat_b) & np.isfinite(lng_b) & tempo_valido_b)
+    if validos_a.size == 0 or validos_b.size == 0:
+        return
+
+    lat_a, lng_a, t_a = lat_a[validos_a], lng_a[validos_a], t_a[validos_a]
+    lat_b, lng_b, t_b = lat_b[validos_b], lng_b[validos_b], t_b[validos_b]
+    janela_ns = int(janela_horas * 3600 * 1e9)
+
+    # Tamanho da célula em graus, garantindo lado >= raio na maior latitude presente
+    raio_grade = max(float(distancia_km), 1e-3)
+    lat_max = min(max(np.abs(lat_a).max(), np.abs(lat_b).max()), 89.0)
+    passo_lat = raio_grade / KM_POR_GRAU
+    passo_lng = raio_grade / (KM_POR_GRAU * np.cos(np.radians(lat_max)))
+    lat0 = min(lat_a.min(), lat_b.min())
+    lng0 = min(lng_a.min(), lng_b.min())
+
+    # Índices de linha/coluna deslocados em 1 para que os vizinhos nunca fiquem negativos
+    i_a = np.floor((lat_a - lat0) / passo_lat).astype(np.int64) + 1
+    j_a = np.floor((lng_a - lng0) / passo_lng).astype(np.int64) + 1
+    i_b = np.floor((lat_b - lat0) / passo_lat).astype(np.int64) + 1
+    j_b = np.floor((lng_b - lng0) / passo_lng).astype(np.int64) + 1
+    n_colunas = int(max(j_a.max(), j_b.max())) + 2
+    n_celulas = (int(max(i_a.max(), i_b.max())) + 2) * n_colunas
+    celula_a = i_a * n_colunas + j_a
+    celula_b = i_b * n_colunas + j_b
+
+    # Chave composta (célula, tempo) em um int64; a granularidade do tempo só aumenta
+    # se a combinação não couber em 62 bits (o filtro exato é aplicado depois)
+    t_base = int(t_b.min())
+    extensao = int(t_b.max()) - t_base
+    granularidade = 10 ** 9
+    bits_celula = n_celulas.bit_length()
+    while bits_celula + (extensao // granularidade + 1).bit_length() > 62:
+        granularidade *= 2
+    bits_tempo = (extensao // granularidade + 1).bit_length()
+
+    chave_b = (celula_b << bits_tempo) | ((t_b - t_base) // granularidade)
+    ordem_b = np.argsort(chave_b, kind='stable')
+    chave_b = chave_b[ordem_b]
+
+    # Intervalo [lo, hi) de B em cada uma das 9 células vizinhas de cada ponto de A
+    celulas_vizinhas = celula_a[:, None] + (_VIZINHOS[:, 0] * n_colunas + _VIZINHOS[:, 1])[None, :]
+    t_lo = np.clip(t_a - janela_ns - t_base, 0, extensao) // granularidade
+    t_hi = np.clip(t_a + janela_ns - t_base, 0, extensao) // granularidade
+    fora_do_periodo = (t_a + janela_ns < t_base) | (t_a - janela_ns > t_base + extensao)
+    lo = np.searchsorted(chave_b, (celulas_vizinhas << bits_tempo) | t_lo[:, None], side='left')
+    hi = np.searchsorted(chave_b, (celulas_vizinhas << bits_tempo) | t_hi[:, None], side='right')
+    tamanhos = hi - lo
+    tamanhos[fora_do_periodo] = 0
+
+    # Dividir A em blocos com no máximo `limite_candidatos` pares candidatos
+    acumulado = np.cumsum(tamanhos.sum(axis=1))
+    inicio = 0
+    while inicio < len(acumulado):
+        base = acumulado[inicio - 1] if inicio > 0 else 0
+        fim = max(int(np.searchsorted(acumulado, base + limite_candidatos, side='right')), inicio + 1)
+
+        tamanhos_bloco = tamanhos[inicio:fim].ravel()
+        if tamanhos_bloco.sum() > 0:
+            dono = np.repeat(np.repeat(np.arange(inicio, fim), len(_VIZINHOS)), tamanhos_bloco)
+            pos_b = ordem_b[_expandir_intervalos(lo[inicio:fim].ravel(), tamanhos_bloco)]
+
+            distancias = haversine_km(lat_a[dono], lng_a[dono], lat_b[pos_b], lng_b[pos_b])
+            diferencas_ns = np.abs(t_a[dono] - t_b[pos_b])
+            dentro = (distancias <= distancia_km) & (diferencas_ns <= janela_ns)
+            if dentro.any():
+                yield (validos_a[dono[dentro]], validos_b[pos_b[dentro]],
+                       distancias[dentro], diferencas_ns[dentro] / 3.6e12)
+        inicio = fim
+        if progresso is not None:
+            progresso(inicio / len(acumulado))
+
+
+# Retornar todos os pares de uma vez (conveniente para volumes pequenos)
+def pares_espacotemporais(lat_a, lng_a, tempo_a, lat_b, lng_b, tempo_b, distancia_km, janela_horas):
+    blocos = list(iterar_pares(lat_a, lng_a, tempo_a, lat_b, lng_b, tempo_b, distancia_km, janela_horas))
+    if not blocos:
+        vazio = np.array([], dtype=np.int64)
+        return vazio, vazio.copy(), np.array([], dtype=np.float64), np.array([], dtype=np.float64)
+    return tuple(np.concatenate(partes) for partes in zip(*blocos))
+
+
+# Contar, para cada evento (lado A), as corridas próximas (lado B) e as canceladas por taxista e
+# por passageiro (`e_taxista`/`e_passageiro`: máscaras sobre as corridas). Devolve os arrays
+# (corridas_proximas, cancelamentos_taxista, cancelamentos_passageiro, primeira_corrida), com
+# primeira_corrida = menor posição das corridas próximas (em `posicoes_corridas`, se informado)
+# ou -1. Usado também por cada fatia da junção paralela (app.juncao_paralela).
+def contar_por_evento(lat_e, lng_e, t_e, lat_c, lng_c, t_c, e_taxista, e_passageiro, distancia_km, janela_horas,
+                      progresso=None, posicoes_corridas=None):
+    n_eventos = len(lat_e)
+    sem_corrida = np.iinfo(np.int64).max
+    corridas_proximas = np.zeros(n_eventos, dtype=np.int64)
+    cancel_taxista = np.zeros(n_eventos, dtype=np.int64)
+    cancel_passageiro = np.zeros(n_eventos, dtype=np.int64)
+    primeira = np.full(n_eventos, sem_corrida, dtype=np.int64)
+
+    def reportar_bloco(fracao):
+        progresso(fracao, {
+            'eventos_com_cancelamentos': int(np.count_nonzero(cancel_taxista + cancel_passageiro)),
+            'total_cancelamentos': int(cancel_taxista.sum() + cancel_passageiro.sum()),
+        })
+
+    for idx_evento, idx_corrida, _, _ in iterar_pares(
+            lat_e, lng_e, t_e, lat_c, lng_c, t_c, distancia_km, janela_horas,
+            progresso=reportar_bloco if progresso is not None else None):
+        corridas_proximas += np.bincount(idx_evento, minlength=n_eventos)
+        cancel_taxista += np.bincount(idx_evento, weights=e_taxista[idx_corrida], minlength=n_eventos).astype(np.int64)
+        cancel_passageiro += np.bincount(idx_evento, weights=e_passageiro[idx_corrida], minlength=n_eventos).astype(np.int64)
+        np.minimum.at(primeira, idx_evento, idx_corrida if posicoes_corridas is None else posicoes_corridas[idx_corrida])
+
+    primeira[primeira == sem_corrida] = -1
+    return corridas_proximas, cancel_taxista, cancel_passageiro, primeira
+
+
+def tabela_contagens(corridas_proximas, cancel_taxista, cancel_passageiro, primeira, indice):
+    return pd.DataFrame({
+        'corridas_proximas': corridas_proximas,
+        'cancelamentos_taxista': cancel_taxista,
+        'cancelamentos_passageiro': cancel_passageiro,
+        'total_cancelamentos': cancel_taxista + cancel_passageiro,
+        'primeira_corrida': primeira,
+    }, index=indice)
+
+
+# Contar, para cada evento, as corridas próximas e os cancelamentos por taxista/passageiro.
+# Retorna um DataFrame com o mesmo índice de `eventos`; 'primeira_corrida' é a posição (em
+# `corridas`) da primeira corrida próxima na ordem original, ou -1 quando não houver nenhuma.
+# `progresso`, se informado, recebe a fração concluída e os totais parciais a cada bloco.
+def contar_cancelamentos_por_evento(eventos, corridas, distancia_km, janela_horas,
+                                    colunas_eventos=('latitude', 'longitude', 'data_inicio'),
+                                    colunas_corridas=('origin_lat', 'origin_lng', 'created_at'),
+                                    progresso=None):
+    status = corridas['status'].to_numpy()
+    lat_e, lng_e, t_e = colunas_eventos
+    lat_c, lng_c, t_c = colunas_corridas
+    contagens = contar_por_evento(
+        eventos[lat_e], eventos[lng_e], eventos[t_e], corridas[lat_c], corridas[lng_c], corridas[t_c],
+        status == STATUS_CANCELADA_TAXISTA, status == STATUS_CANCELADA_PASSAGEIRO,
+        distancia_km, janela_horas, progresso)
+    return tabela_contagens(*contagens, eventos.index)
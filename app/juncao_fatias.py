@@ -0,0 +1,48 @@
+import signal
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.juncao_espacotemporal import contar_por_evento
+
+# Lado dos processos do pool da junção paralela (app.juncao_paralela): montar as views sobre a
+# memória compartilhada e contar os eventos de uma fatia. O módulo só depende de numpy e de
+# app.juncao_espacotemporal, para que os processos do pool carreguem apenas o necessário.
+
+
+# Views (sem cópia) de cada array do bloco de memória compartilhada, a partir do descritor
+# (nome -> deslocamento, tipo, tamanho)
+def views(memoria, descritor):
+    return {nome: np.ndarray((tamanho,), dtype=np.dtype(tipo), buffer=memoria.buf, offset=deslocamento)
+            for nome, (deslocamento, tipo, tamanho) in descritor.items()}
+
+
+# Inicialização de cada processo do pool: Ctrl+C fica com o processo principal, que encerra o pool
+def iniciar_processo():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# Contar os eventos de uma fatia e gravar as contagens nos arrays de saída
+def contar_fatia(arrays, fatia, distancia_km, janela_horas):
+    e0, e1, c0, c1 = fatia
+    sinal = arrays['sinal_c'][c0:c1]
+    proximas, taxista, passageiro, primeira = contar_por_evento(
+        arrays['lat_e'][e0:e1], arrays['lng_e'][e0:e1], arrays['t_e'][e0:e1].view('datetime64[ns]'),
+        arrays['lat_c'][c0:c1], arrays['lng_c'][c0:c1], arrays['t_c'][c0:c1].view('datetime64[ns]'),
+        sinal == 1, sinal == 2, distancia_km, janela_horas, posicoes_corridas=arrays['posicao_c'][c0:c1])
+    arrays['proximas'][e0:e1] = proximas
+    arrays['taxista'][e0:e1] = taxista
+    arrays['passageiro'][e0:e1] = passageiro
+    arrays['primeira'][e0:e1] = primeira
+
+
+# Tarefa do pool: abrir o bloco de memória compartilhada pelo nome e processar a fatia
+def processar_fatia(nome_memoria, descritor, fatia, distancia_km, janela_horas):
+    memoria = shared_memory.SharedMemory(name=nome_memoria)
+    try:
+        arrays = views(memoria, descritor)
+        contar_fatia(arrays, fatia, distancia_km, janela_horas)
+        del arrays
+    finally:
+        memoria.close()
+    return fatia
@@ -0,0 +1,177 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.juncao_espacotemporal import (tabela_contagens, contar_cancelamentos_por_evento, _para_ns,
+                                       STATUS_CANCELADA_TAXISTA, STATUS_CANCELADA_PASSAGEIRO)
+from app.juncao_fatias import views, iniciar_processo, processar_fatia
+
+logger = logging.getLogger(__name__)
+
+# Junção espaço-temporal em vários processos. Eventos e corridas são ordenados por tempo e o
+# período é dividido em fatias; cada fatia tem os eventos do seu intervalo e as corridas do mesmo
+# intervalo estendido pela janela temporal nos dois lados, de modo que nenhum par se perde e cada
+# evento é contado em uma única fatia. Coordenadas, tempos e contagens ficam em memória
+# compartilhada: as tarefas do pool recebem só os limites da fatia e gravam as contagens dos seus
+# eventos diretamente no resultado. O código executado nos processos fica em app.juncao_fatias.
+# Os processos são criados com spawn: um script que chame a junção paralela precisa da proteção
+# `if __name__ == '__main__':`, pois cada processo do pool importa de novo o script principal.
+
+# Processos do pool (1 desliga o modo paralelo) e tamanho mínimo (corridas) para usá-lo
+JUNCAO_PROCESSOS = int(os.getenv("JUNCAO_PROCESSOS", os.cpu_count() or 1))
+JUNCAO_MINIMO_PARALELO = int(os.getenv("JUNCAO_MINIMO_PARALELO", 200_000))
+
+# Processos de app.tarefas: dentro de uma tarefa (já em um processo de pool) a junção divide os
+# núcleos com as demais tarefas em vez de abrir JUNCAO_PROCESSOS processos em cada uma
+TAREFAS_PROCESSOS = int(os.getenv("TAREFAS_PROCESSOS", 2))
+
+# Fatias por processo (fatias menores equilibram melhor a carga entre os processos)
+FATIAS_POR_PROCESSO = 4
+
+# Pool de processos e número de processos com que foi criado
+_executor = None
+_processos_executor = None
+
+
+def _obter_executor(processos):
+    global _executor, _processos_executor
+    if _executor is None or _processos_executor != processos:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=iniciar_processo)
+        _processos_executor = processos
+    return _executor
+
+
+# Descartar o pool (p.ex. depois que um processo morreu); o próximo uso cria outro
+def _descartar_executor():
+    global _executor, _processos_executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _processos_executor = None
+
+
+# Processos a usar: dentro de um processo de pool, só a parte dos núcleos que cabe a ele
+def _limitar_processos(processos):
+    if multiprocessing.parent_process() is None:
+        return processos
+    return max(1, processos // TAREFAS_PROCESSOS)
+
+
+# Copiar arrays para um bloco de memória compartilhada; o descritor (nome -> deslocamento, tipo,
+# tamanho) permite que os processos do pool montem as mesmas views sem copiar os dados
+def _compartilhar(arrays):
+    descritor, deslocamento = {}, 0
+    for nome, array in arrays.items():
+        descritor[nome] = (deslocamento, array.dtype.str, len(array))
+        deslocamento += -(-array.nbytes // 8) * 8
+    memoria = shared_memory.SharedMemory(create=True, size=max(deslocamento, 8))
+    for nome, array in arrays.items():
+        views(memoria, {nome: descritor[nome]})[nome][:] = array
+    return memoria, descritor
+
+
+# Limites das fatias: quantis dos tempos de eventos e corridas juntos, para que as fatias tenham
+# volumes parecidos; cada fatia é (e0, e1, c0, c1) sobre os arrays ordenados por tempo
+def _fatiar(t_e, t_c, janela_ns, n_fatias):
+    fronteiras = np.unique(np.quantile(np.concatenate([t_e, t_c]), np.linspace(0, 1, n_fatias + 1)).astype(np.int64))
+    fronteiras[0] = min(t_e[0], t_c[0])
+    inicios_e = np.searchsorted(t_e, fronteiras[:-1], side='left')
+    fins_e = np.append(inicios_e[1:], len(t_e))
+    inicios_c = np.searchsorted(t_c, fronteiras[:-1] - janela_ns, side='left')
+    fins_c = np.searchsorted(t_c, np.append(fronteiras[1:-1], t_e[-1]) + janela_ns, side='right')
+    return [(int(e0), int(e1), int(c0), int(c1))
+            for e0, e1, c0, c1 in zip(inicios_e, fins_e, inicios_c, fins_c) if e1 > e0]
+
+
+# Mesma entrada e saída de contar_cancelamentos_por_evento, com as fatias processadas em
+# `processos` processos. `progresso` recebe a fração dos eventos concluída e os totais parciais.
+def contar_cancelamentos_paralelo(eventos, corridas, distancia_km, janela_horas,
+                                  colunas_eventos=('latitude', 'longitude', 'data_inicio'),
+                                  colunas_corridas=('origin_lat', 'origin_lng', 'created_at'),
+                                  processos=None, progresso=None):
+    processos = processos or JUNCAO_PROCESSOS
+    lat_e, lng_e, tempo_e = colunas_eventos
+    lat_c, lng_c, tempo_c = colunas_corridas
+    n_eventos = len(eventos)
+
+    # Só entram eventos e corridas com tempo válido, ordenados por tempo
+    t_e, validos_e = _para_ns(eventos[tempo_e])
+    t_c, validos_c = _para_ns(corridas[tempo_c])
+    posicoes_e = np.flatnonzero(validos_e)
+    posicoes_e = posicoes_e[np.argsort(t_e[posicoes_e], kind='stable')]
+    posicoes_c = np.flatnonzero(validos_c)
+    posicoes_c = posicoes_c[np.argsort(t_c[posicoes_c], kind='stable')]
+
+    resultado = (np.zeros(n_eventos, dtype=np.int64), np.zeros(n_eventos, dtype=np.int64),
+                 np.zeros(n_eventos, dtype=np.int64), np.full(n_eventos, -1, dtype=np.int64))
+    if posicoes_e.size == 0 or posicoes_c.size == 0:
+        return tabela_contagens(*resultado, eventos.index)
+
+    status = corridas['status'].to_numpy()
+    sinal = np.where(status == STATUS_CANCELADA_TAXISTA, 1, np.where(status == STATUS_CANCELADA_PASSAGEIRO, 2, 0))
+    n_validos = len(posicoes_e)
+    memoria, descritor = _compartilhar({
+        'lat_e': eventos[lat_e].to_numpy(dtype=np.float64)[posicoes_e],
+        'lng_e': eventos[lng_e].to_numpy(dtype=np.float64)[posicoes_e],
+        't_e': t_e[posicoes_e],
+        'lat_c': corridas[lat_c].to_numpy(dtype=np.float64)[posicoes_c],
+        'lng_c': corridas[lng_c].to_numpy(dtype=np.float64)[posicoes_c],
+        't_c': t_c[posicoes_c],
+        'sinal_c': sinal[posicoes_c].astype(np.int8),
+        'posicao_c': posicoes_c.astype(np.int64),
+        'proximas': np.zeros(n_validos, dtype=np.int64),
+        'taxista': np.zeros(n_validos, dtype=np.int64),
+        'passageiro': np.zeros(n_validos, dtype=np.int64),
+        'primeira': np.full(n_validos, -1, dtype=np.int64),
+    })
+    try:
+        arrays = views(memoria, descritor)
+        janela_ns = int(janela_horas * 3600 * 1e9)
+        fatias = _fatiar(arrays['t_e'], arrays['t_c'], janela_ns, processos * FATIAS_POR_PROCESSO)
+
+        executor = _obter_executor(processos)
+        pendentes = [executor.submit(processar_fatia, memoria.name, descritor, fatia, distancia_km, janela_horas)
+                     for fatia in fatias]
+        concluidos = 0
+        for futuro in as_completed(pendentes):
+            e0, e1, _, _ = futuro.result()
+            concluidos += e1 - e0
+            if progresso is not None:
+                progresso(concluidos / n_validos, {
+                    'eventos_com_cancelamentos': int(np.count_nonzero(arrays['taxista'] + arrays['passageiro'])),
+                    'total_cancelamentos': int(arrays['taxista'].sum() + arrays['passageiro'].sum()),
+                })
+
+        for destino, nome in zip(resultado, ('proximas', 'taxista', 'passageiro', 'primeira')):
+            destino[posicoes_e] = arrays[nome]
+        del arrays
+    finally:
+        memoria.close()
+        memoria.unlink()
+
+    logger.info(f"Junção paralela: {n_validos} eventos, {len(posicoes_c)} corridas, {len(fatias)} fatias "
+                f"em {processos} processos.")
+    return tabela_contagens(*resultado, eventos.index)
+
+
+# Escolher entre a junção em um processo e a paralela conforme o volume de corridas. Se um processo
+# do pool morrer (p.ex. por falta de memória), o pool é descartado e a junção refeita em um processo.
+def contar_cancelamentos(eventos, corridas, distancia_km, janela_horas, processos=None, progresso=None, **colunas):
+    processos = _limitar_processos(processos or JUNCAO_PROCESSOS)
+    if processos > 1 and len(corridas) >= JUNCAO_MINIMO_PARALELO:
+        try:
+            return contar_cancelamentos_paralelo(eventos, corridas, distancia_km, janela_horas, processos=processos,
+                                                 progresso=progresso, **colunas)
+        except BrokenProcessPool as e:
+            logger.error(f"Pool da junção paralela interrompido ({e}); refazendo em um processo.")
+            _descartar_executor()
+    return contar_cancelamentos_por_evento(eventos, corridas, distancia_km, janela_horas, progresso=progresso,
+                                           **colunas)
@@ -0,0 +1,197 @@
+import base64
+
+import numpy as np
+from branca.element import MacroElement, Template
+from folium.map import Layer
+
+# Resolução da quantização das coordenadas (1e-5 grau ~ 1,1 m)
+ESCALA_COORDENADAS = 100_000
+
+
+# Codificar coordenadas em graus como Int32 quantizado em base64 (~5,3 bytes por valor no HTML)
+def codificar_coordenadas(valores):
+    quantizados = np.round(np.asarray(valores, dtype=np.float64) * ESCALA_COORDENADAS).astype('<i4')
+    return base64.b64encode(quantizados.tobytes()).decode('ascii')
+
+
+# Camada de pontos desenhada no navegador com o renderizador canvas do Leaflet.
+# Em vez de um CircleMarker (e um popup HTML) por ponto no HTML gerado, a camada envia apenas
+# dois arrays colunares de coordenadas; o popup de cada ponto é buscado sob demanda em
+# `url_popup + posicao`, onde posicao = deslocamento + índice do ponto na camada.
+class CamadaPontos(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                function decodificar(texto) {
+                    var bytes = Uint8Array.from(atob(texto), function(c) { return c.charCodeAt(0); });
+                    return new Int32Array(bytes.buffer);
+                }
+                var lat = decodificar("{{ this.lat }}");
+                var lng = decodificar("{{ this.lng }}");
+                var renderer = L.canvas({padding: 0.5});
+                var camada = L.featureGroup();
+                for (var i = 0; i < lat.length; i++) {
+                    var marcador = L.circleMarker([lat[i] / {{ this.escala }}, lng[i] / {{ this.escala }}], {
+                        renderer: renderer,
+                        radius: {{ this.raio }},
+                        color: {{ this.cor|tojson }},
+                        fillColor: {{ this.cor|tojson }},
+                        fill: true,
+                        fillOpacity: 0.6,
+                        weight: 1
+                    });
+                    marcador.posicao = {{ this.deslocamento }} + i;
+                    camada.addLayer(marcador);
+                }
+                {% if this.url_popup %}
+                camada.on('click', function(e) {
+                    var marcador = e.layer;
+                    fetch({{ this.url_popup|tojson }} + marcador.posicao)
+                        .then(function(resposta) { return resposta.json(); })
+                        .then(function(dados) { marcador.bindPopup(dados.html || dados.error).openPopup(); });
+                });
+                {% endif %}
+                return camada;
+            })();
+            {% if this.show %}
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+            {% endif %}
+        {% endmacro %}
+    """)
+
+    def __init__(self, lat, lng, nome, cor='blue', raio=4, url_popup=None, deslocamento=0, show=True):
+        super().__init__(name=nome, overlay=True, control=True, show=show)
+        self._name = 'CamadaPontos'
+        self.lat = codificar_coordenadas(lat)
+        self.lng = codificar_coordenadas(lng)
+        self.escala = ESCALA_COORDENADAS
+        self.cor = cor
+        self.raio = raio
+        self.url_popup = url_popup
+        self.deslocamento = int(deslocamento)
+
+    # A própria template adiciona a camada ao mapa (quando show=True); evita que versões mais
+    # novas do folium a adicionem uma segunda vez em Layer.render
+    def render(self, **kwargs):
+        MacroElement.render(self, **kwargs)
+
+
+# Camada com os limites das favelas, buscada do app (/favelas/limites/<nível>) em vez de ser
+# embutida no HTML. Ao mudar de zoom, carrega o nível de simplificação correspondente; o
+# navegador reaproveita as respostas já baixadas pelo ETag.
+class CamadaLimites(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var mapa = {{ this._parent.get_name() }};
+                var niveis = {{ this.niveis|tojson }};
+                var camada = L.geoJSON(null, {
+                    renderer: L.canvas({padding: 0.5}),
+                    style: {color: {{ this.cor|tojson }}, weight: 1, fillOpacity: 0.15},
+                    onEachFeature: function(feature, poligono) {
+                        var p = feature.properties;
+                        poligono.bindTooltip("<b>" + p.nome + "</b>" + (p.complexo ? "<br>" + p.complexo : "")
+                                             + "<br>" + p.bairro);
+                    }
+                });
+                var nivelAtual = null;
+                function nivelDoZoom(zoom) {
+                    var nivel = niveis[0];
+                    niveis.forEach(function(n) { if (n <= zoom) { nivel = n; } });
+                    return nivel;
+                }
+                function atualizar() {
+                    if (!mapa.hasLayer(camada)) { return; }
+                    var nivel = nivelDoZoom(mapa.getZoom());
+                    if (nivel === nivelAtual) { return; }
+                    nivelAtual = nivel;
+                    fetch({{ this.url|tojson }} + nivel)
+                        .then(function(resposta) { return resposta.json(); })
+                        .then(function(dados) {
+                            if (nivel !== nivelAtual) { return; }
+                            camada.clearLayers();
+                            camada.addData(dados);
+                        });
+                }
+                mapa.on('zoomend', atualizar);
+                camada.on('add', atualizar);
+                return camada;
+            })();
+            {% if this.show %}
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+            {% endif %}
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, niveis, nome='Favelas', cor='#6a3d9a', show=True):
+        super().__init__(name=nome, overlay=True, control=True, show=show)
+        self._name = 'CamadaLimites'
+        self.url = url
+        self.niveis = list(niveis)
+        self.cor = cor
+
+    def render(self, **kwargs):
+        MacroElement.render(self, **kwargs)
+
+
+# Células agregadas da grade (app.rollups) para a área visível, buscadas a cada movimento do mapa
+# em `url?zoom=..&limites=..` mais os parâmetros fixos da camada (ex.: período). A opacidade de
+# cada célula acompanha o total em escala logarítmica; o tooltip mostra as contagens.
+class CamadaCelulas(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var mapa = {{ this._parent.get_name() }};
+                var renderer = L.canvas({padding: 0.5});
+                var camada = L.featureGroup();
+                var requisicao = 0;
+                function atualizar() {
+                    if (!mapa.hasLayer(camada)) { return; }
+                    var b = mapa.getBounds();
+                    var parametros = new URLSearchParams({{ this.parametros|tojson }});
+                    parametros.set("zoom", mapa.getZoom());
+                    parametros.set("limites", [b.getSouth(), b.getWest(), b.getNorth(), b.getEast()].join(","));
+                    var atual = ++requisicao;
+                    fetch({{ this.url|tojson }} + "?" + parametros.toString())
+                        .then(function(resposta) { return resposta.json(); })
+                        .then(function(dados) {
+                            if (atual !== requisicao) { return; }
+                            camada.clearLayers();
+                            var maximo = Math.log1p(Math.max.apply(null, dados.total.concat([1])));
+                            var campos = Object.keys(dados).filter(function(c) {
+                                return Array.isArray(dados[c]) && c !== "i" && c !== "j";
+                            });
+                            for (var k = 0; k < dados.i.length; k++) {
+                                var lat = dados.i[k] * dados.tamanho, lng = dados.j[k] * dados.tamanho;
+                                var celula = L.rectangle([[lat, lng], [lat + dados.tamanho, lng + dados.tamanho]], {
+                                    renderer: renderer,
+                                    color: {{ this.cor|tojson }},
+                                    weight: 0,
+                                    fillOpacity: 0.1 + 0.7 * Math.log1p(dados.total[k]) / maximo
+                                });
+                                celula.bindTooltip(campos.map(function(c) {
+                                    return c + ": " + dados[c][k];
+                                }).join("<br>"));
+                                camada.addLayer(celula);
+                            }
+                        });
+                }
+                mapa.on('moveend', atualizar);
+                camada.on('add', atualizar);
+                return camada;
+            })();
+            {% if this.show %}
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+            {% endif %}
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, nome, parametros=None, cor='#e31a1c', show=True):
+        super().__init__(name=nome, overlay=True, control=True, show=show)
+        self._name = 'CamadaCelulas'
+        self.url = url
+        self.parametros = {chave: valor for chave, valor in (parametros or {}).items() if valor is not None}
+        self.cor = cor
+
+    def render(self, **kwargs):
+        MacroElement.render(self, **kwargs)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+# Normalização em lote dos valores vindos do MongoDB ou dos CSVs, compartilhada pela ingestão
+# (app.ingestao), pelos snapshots (app.snapshot, também usado nas consultas ao vivo) e pela
+# classificação territorial (app.favelas): datas em codificações mistas, pontos GeoJSON separados
+# em arrays de latitude/longitude e indicadores derivados do status das corridas.
+
+# Indicadores derivados do status (o status contém o rótulo)
+INDICADORES_STATUS = {
+    'canceled_by_driver': "Cancelada pelo Taxista",
+    'canceled_by_passenger': "Cancelada pelo Passageiro",
+    'completed': "Finalizada",
+}
+
+
+def normalizar_numeros(valores):
+    return pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+# Datas em lote, aceitando datetime, texto (ISO ou outros formatos), milissegundos desde a época e
+# o formato estendido {'$date': ...} (com texto, milissegundos ou {'$numberLong': ...}).
+# Devolve uma Series datetime64[us] sem fuso (em UTC), com NaT nos valores inválidos.
+def normalizar_datas(valores):
+    serie = pd.Series(valores).reset_index(drop=True)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        if serie.dt.tz is not None:
+            serie = serie.dt.tz_convert(None)
+        return serie.astype('datetime64[us]')
+
+    serie = serie.astype(object)
+    tipos = serie.map(type)
+    estendidas = tipos == dict
+    if estendidas.any():
+        serie[estendidas] = serie[estendidas].map(lambda v: v.get('$date'))
+        longas = serie.map(type) == dict
+        serie[longas] = pd.to_numeric(serie[longas].map(lambda v: v.get('$numberLong')), errors='coerce')
+        tipos = serie.map(type)
+
+    datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[us]')
+    numeros = tipos.isin([int, float, np.int64, np.float64]) & serie.notna()
+    if numeros.any():
+        datas[numeros] = pd.to_datetime(serie[numeros].astype(np.float64), unit='ms', errors='coerce')
+
+    outros = ~numeros & serie.notna()
+    if outros.any():
+        # Formato ISO em um passo; o que não for ISO é interpretado valor a valor
+        convertidas = pd.to_datetime(serie[outros], errors='coerce', utc=True, format='ISO8601')
+        falhas = convertidas.isna()
+        if falhas.any():
+            convertidas[falhas] = pd.to_datetime(serie[outros][falhas], errors='coerce', utc=True,
+                                                 format='mixed')
+        datas[outros] = convertidas.dt.tz_convert(None).astype('datetime64[us]')
+    return datas
+
+
+# Separar pontos GeoJSON ({'type': 'Point', 'coordinates': [lng, lat]}) em arrays de latitude e
+# longitude; pontos ausentes ou inválidos viram NaN
+def separar_pontos(pontos):
+    coordenadas = [p.get('coordinates') if isinstance(p, dict) else None for p in pontos]
+    coordenadas = [c if isinstance(c, (list, tuple)) and len(c) >= 2 else (None, None) for c in coordenadas]
+    longitudes = normalizar_numeros([c[0] for c in coordenadas])
+    latitudes = normalizar_numeros([c[1] for c in coordenadas])
+    return latitudes, longitudes
+
+
+# Ponto GeoJSON (lng, lat) para cada linha com coordenadas válidas; None nas demais
+def montar_pontos(latitudes, longitudes):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    validas = np.isfinite(latitudes) & np.isfinite(longitudes)
+    return [{'type': 'Point', 'coordinates': [lng, lat]} if valida else None
+            for lat, lng, valida in zip(latitudes.tolist(), longitudes.tolist(), validas.tolist())]
+
+
+# Valor numérico de cada documento pelo primeiro caminho preenchido. Os caminhos são campos
+# ('origin_lat') ou coordenadas de um ponto GeoJSON ('location.coordinates.1'); cada ponto é
+# separado uma vez e guardado em `pontos`, que pode ser compartilhado entre latitude e longitude.
+def extrair_numeros(documentos, caminhos, pontos=None):
+    pontos = {} if pontos is None else pontos
+    resultado = np.full(len(documentos), np.nan)
+    for caminho in caminhos:
+        campo, *resto = caminho.split('.')
+        if resto[:1] == ['coordinates']:
+            if campo not in pontos:
+                pontos[campo] = separar_pontos([documento.get(campo) for documento in documentos])
+            latitudes, longitudes = pontos[campo]
+            valores = latitudes if resto[1] == '1' else longitudes
+        else:
+            valores = normalizar_numeros([documento.get(campo) for documento in documentos])
+        resultado = np.where(np.isnan(resultado), valores, resultado)
+    return resultado
+
+
+# Indicadores 0/1 (int8) de cada rótulo de INDICADORES_STATUS, calculados uma vez por categoria
+# de status e distribuídos pelos códigos; status ausente tem todos os indicadores 0
+def indicadores_status(status):
+    categorias = pd.Categorical(status)
+    rotulos = list(INDICADORES_STATUS.values())
+    por_categoria = np.array([[rotulo in categoria for rotulo in rotulos]
+                              for categoria in categorias.categories.astype(str)]
+                             + [[False] * len(rotulos)], dtype=np.int8)
+    indicadores = por_categoria[categorias.codes]
+    return pd.DataFrame(indicadores, columns=list(INDICADORES_STATUS),
+                        index=status.index if isinstance(status, pd.Series) else None)
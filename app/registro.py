@@ -0,0 +1,119 @@
+import os
+import sys
+import glob
+import fcntl
+import logging
+import threading
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+# Diretório compartilhado pelos workers para os artefatos (dados processados e modelos treinados)
+ARTEFATOS_DIR = os.getenv("ARTEFATOS_DIR", "artefatos")
+
+# Funções que constroem cada artefato e (opcionalmente) calculam sua versão,
+# registradas pelos módulos com @registrar
+_construtores = {}
+_versoes = {}
+
+# Artefatos já carregados neste processo: nome -> (versão, artefato)
+_carregados = {}
+_trava = threading.Lock()
+
+
+# Decorador para registrar a função que constrói um artefato. `versao`, se informada, é uma
+# função sem argumentos que identifica os dados de origem (p.ex. o hash do snapshot); quando
+# ela muda, o artefato é reconstruído e gravado em um novo arquivo.
+def registrar(nome, versao=None):
+    def decorador(funcao):
+        _construtores[nome] = funcao
+        if versao is not None:
+            _versoes[nome] = versao
+        return funcao
+    return decorador
+
+
+def versao_atual(nome):
+    return _versoes[nome]() if nome in _versoes else 'atual'
+
+
+def _caminho(nome, versao):
+    return os.path.join(ARTEFATOS_DIR, f"{nome}-{versao}.joblib")
+
+
+# Verificar se o artefato da versão atual (ou da `versao` informada) já está disponível (em
+# memória ou em disco) sem construí-lo
+def disponivel(nome, versao=None):
+    versao = versao or versao_atual(nome)
+    carregado = _carregados.get(nome)
+    return (carregado is not None and carregado[0] == versao) or os.path.exists(_caminho(nome, versao))
+
+
+# Obter um artefato sob demanda: primeiro da memória do processo, depois do disco e, só em
+# último caso, construindo-o. A construção é protegida por uma trava de arquivo, de modo que
+# apenas um worker faz o trabalho e os demais carregam o resultado gravado em disco.
+def obter(nome, versao=None):
+    versao = versao or versao_atual(nome)
+    carregado = _carregados.get(nome)
+    if carregado is not None and carregado[0] == versao:
+        return carregado[1]
+
+    with _trava:
+        carregado = _carregados.get(nome)
+        if carregado is not None and carregado[0] == versao:
+            return carregado[1]
+
+        os.makedirs(ARTEFATOS_DIR, exist_ok=True)
+        caminho = _caminho(nome, versao)
+        with open(os.path.join(ARTEFATOS_DIR, f"{nome}.lock"), 'w') as trava_arquivo:
+            fcntl.flock(trava_arquivo, fcntl.LOCK_EX)
+            if os.path.exists(caminho):
+                artefato = joblib.load(caminho)
+                _carregados[nome] = (versao, artefato)
+            else:
+                artefato = construir(nome, versao)
+
+        return artefato
+
+
+# Construir (ou reconstruir) um artefato, gravá-lo em disco de forma atômica e remover as
+# versões anteriores
+def construir(nome, versao=None):
+    versao = versao or versao_atual(nome)
+    logger.info(f"Construindo artefato '{nome}' (versão {versao})...")
+    artefato = _construtores[nome]()
+
+    os.makedirs(ARTEFATOS_DIR, exist_ok=True)
+    caminho = _caminho(nome, versao)
+    temporario = f"{caminho}.tmp"
+    joblib.dump(artefato, temporario)
+    os.replace(temporario, caminho)
+
+    for antigo in glob.glob(os.path.join(ARTEFATOS_DIR, f"{nome}-*.joblib")):
+        if antigo != caminho:
+            os.remove(antigo)
+
+    _carregados[nome] = (versao, artefato)
+    logger.info(f"Artefato '{nome}' gravado em {caminho}.")
+    return artefato
+
+
+# Descartar o artefato da memória e do disco (será reconstruído no próximo uso)
+def invalidar(nome):
+    _carregados.pop(nome, None)
+    for arquivo in glob.glob(os.path.join(ARTEFATOS_DIR, f"{nome}-*.joblib")):
+        os.remove(arquivo)
+
+
+if __name__ == '__main__':
+    # Aquecimento: python -m app.registro [nome ...] constrói os artefatos antes de subir os workers.
+    # Usa o módulo importado como app.registro, onde os construtores são registrados.
+    from app import registro
+    import app.Analise_espacial_cluster_v1  # noqa: F401
+
+    for nome_artefato in sys.argv[1:] or list(registro._construtores):
+        if registro.disponivel(nome_artefato):
+            logger.info(f"Artefato '{nome_artefato}' já está atualizado.")
+        else:
+            registro.construir(nome_artefato)
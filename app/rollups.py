@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import fcntl
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from flask import Blueprint, jsonify, request
+
+from app.snapshot import SNAPSHOT_DIR, SNAPSHOT_INTERVALO, atualizar_snapshot, carregar_snapshot
+from app.tabelas import escalar_objectid, texto_objectid
+
+logger = logging.getLogger(__name__)
+
+# Agregados em grade quadrada hierárquica: em cada nível a célula tem metade do lado da célula do
+# nível anterior, de modo que a célula (i, j) do nível n contém as células (2i..2i+1, 2j..2j+1)
+# do nível n+1. Lado da célula em graus (0,02° ~ 2,2 km no Rio).
+ROLLUP_DIR = os.getenv("ROLLUP_DIR", os.path.join(SNAPSHOT_DIR, "rollups"))
+NIVEIS_GRADE = {0: 0.02, 1: 0.01, 2: 0.005}
+
+# Zoom mínimo do mapa a partir do qual cada nível é usado
+ZOOM_NIVEIS = {0: 0, 1: 12, 2: 14}
+
+# Chave de cada célula agregada (nível, linha, coluna e hora cheia)
+CHAVE = ['nivel', 'i', 'j', 'hora']
+
+# Coleções agregadas: colunas do snapshot e contagens por status (além do total)
+ROLLUPS = {
+    'rides_original': {
+        'data': 'created_at', 'lat': 'origin_lat', 'lng': 'origin_lng', 'status': 'status',
+        'contagens': {
+            'finalizadas': 'Finalizada',
+            'canceladas_taxista': 'Cancelada pelo Taxista',
+            'canceladas_passageiro': 'Cancelada pelo Passageiro',
+        },
+    },
+    'ocorrencias': {
+        'data': 'data_inicio', 'lat': 'latitude', 'lng': 'longitude', 'status': None, 'contagens': {},
+    },
+}
+
+_tabelas = {}
+_trava = threading.Lock()
+
+rollups_app = Blueprint("rollups_app", __name__)
+URL_CELULAS = "/rollups/celulas/"
+
+
+def _caminho_arquivo(nome):
+    return os.path.join(ROLLUP_DIR, f"{nome}.parquet")
+
+
+def _caminho_metadados(nome):
+    return os.path.join(ROLLUP_DIR, f"{nome}.json")
+
+
+def ler_metadados(nome):
+    try:
+        with open(_caminho_metadados(nome), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def campos_contagem(nome):
+    return ['total'] + list(ROLLUPS[nome]['contagens'])
+
+
+def nivel_grade(zoom):
+    return max(nivel for nivel, minimo in ZOOM_NIVEIS.items() if zoom >= minimo)
+
+
+# Agregar linhas do snapshot em células de todos os níveis, por hora
+def _agregar(nome, df):
+    config = ROLLUPS[nome]
+    df = df.dropna(subset=[config['data'], config['lat'], config['lng']])
+    latitudes = df[config['lat']].to_numpy(dtype=np.float64)
+    longitudes = df[config['lng']].to_numpy(dtype=np.float64)
+
+    colunas = {'hora': df[config['data']].dt.floor('h').to_numpy(), 'total': np.ones(len(df), dtype=np.int64)}
+    for campo, status in config['contagens'].items():
+        colunas[campo] = (df[config['status']] == status).to_numpy(dtype=np.int64)
+
+    partes = []
+    for nivel, tamanho in NIVEIS_GRADE.items():
+        celulas = pd.DataFrame({
+            'nivel': np.full(len(df), nivel, dtype=np.int8),
+            'i': np.floor(latitudes / tamanho).astype(np.int32),
+            'j': np.floor(longitudes / tamanho).astype(np.int32),
+            **colunas,
+        })
+        partes.append(celulas.groupby(CHAVE, as_index=False, sort=False).sum())
+    return pd.concat(partes, ignore_index=True)
+
+
+# Atualizar um arquivo de agregados derivado do snapshot de uma coleção. Só as linhas com _id acima
+# da marca d'água são agregadas (`agregar(df)`) e somadas às linhas existentes com a mesma `chave`;
+# se o snapshot foi reconstruído (alteração registrada ou mudança de esquema), o arquivo é refeito
+# do zero. Também usado pelas séries temporais (app.series_temporais).
+def atualizar_agregado(arquivo, colecao, colunas, agregar, chave, completo=False):
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    caminho = _caminho_arquivo(arquivo)
+
+    with open(os.path.join(ROLLUP_DIR, f"{arquivo}.lock"), 'w') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+
+        snapshot = atualizar_snapshot(colecao)
+        geracao = [snapshot['versao_esquema'], snapshot['alteracoes']]
+        metadados = ler_metadados(arquivo)
+        if metadados is None or metadados.get('geracao') != geracao or not os.path.exists(caminho):
+            completo = True
+
+        marca_dagua = None if completo else metadados.get('marca_dagua')
+        filtro = pc.field('_id') > escalar_objectid(marca_dagua) if marca_dagua else None
+        novos = carregar_snapshot(colecao, ['_id'] + colunas, atualizar=False, filtro=filtro)
+
+        if completo or len(novos):
+            agregados = agregar(novos)
+            if not completo:
+                agregados = pd.concat([pd.read_parquet(caminho), agregados], ignore_index=True)
+            # Ordenadas pela chave, as linhas de um mesmo nível ou período ficam contíguas no arquivo
+            agregados = agregados.groupby(chave, as_index=False, sort=True, observed=True).sum()
+            temporario = f"{caminho}.tmp"
+            pq.write_table(pa.Table.from_pandas(agregados, preserve_index=False), temporario,
+                           row_group_size=100_000)
+            os.replace(temporario, caminho)
+            linhas = len(agregados)
+            if len(novos):
+                marca_dagua = texto_objectid(novos['_id'].max())
+        else:
+            linhas = metadados['linhas']
+
+        metadados = {
+            'arquivo': arquivo,
+            'colecao': colecao,
+            'geracao': geracao,
+            'marca_dagua': marca_dagua,
+            'linhas': linhas,
+            'atualizado_em': datetime.now().isoformat(),
+        }
+        with open(_caminho_metadados(arquivo), 'w', encoding='utf-8') as f:
+            json.dump(metadados, f)
+
+    logger.info(f"Agregados '{arquivo}': {len(novos)} linhas novas, {linhas} linhas no total.")
+    return metadados
+
+
+def atualizar_rollup(nome, completo=False):
+    config = ROLLUPS[nome]
+    colunas = [config['data'], config['lat'], config['lng']] + ([config['status']] if config['status'] else [])
+    return atualizar_agregado(nome, nome, colunas, lambda df: _agregar(nome, df), CHAVE, completo)
+
+
+def _desatualizado(arquivo):
+    caminho = _caminho_metadados(arquivo)
+    if not os.path.exists(caminho) or not os.path.exists(_caminho_arquivo(arquivo)):
+        return True
+    return (datetime.now().timestamp() - os.path.getmtime(caminho)) > SNAPSHOT_INTERVALO
+
+
+# Tabela de um arquivo de agregados, lida uma vez por versão do arquivo. Quando o arquivo tem mais
+# de SNAPSHOT_INTERVALO s, `atualizar()` é chamado antes da leitura.
+def ler_agregado(arquivo, atualizar):
+    if _desatualizado(arquivo):
+        atualizar()
+    caminho = _caminho_arquivo(arquivo)
+    modificacao = os.path.getmtime(caminho)
+    with _trava:
+        if arquivo not in _tabelas or _tabelas[arquivo][0] != modificacao:
+            _tabelas[arquivo] = (modificacao, pq.read_table(caminho))
+        return _tabelas[arquivo][1]
+
+
+# Somar as células de um nível no período e na caixa (lat_min, lng_min, lat_max, lng_max) pedidos
+def consultar_celulas(nome, nivel, inicio=None, fim=None, limites=None):
+    tamanho = NIVEIS_GRADE[nivel]
+    filtro = pc.field('nivel') == nivel
+    if inicio is not None:
+        filtro &= pc.field('hora') >= pa.scalar(pd.Timestamp(inicio).floor('h').to_pydatetime(), type=pa.timestamp('us'))
+    if fim is not None:
+        filtro &= pc.field('hora') <= pa.scalar(pd.Timestamp(fim).to_pydatetime(), type=pa.timestamp('us'))
+    if limites:
+        lat_min, lng_min, lat_max, lng_max = limites
+        filtro &= ((pc.field('i') >= int(np.floor(lat_min / tamanho))) & (pc.field('i') <= int(np.floor(lat_max / tamanho)))
+                   & (pc.field('j') >= int(np.floor(lng_min / tamanho))) & (pc.field('j') <= int(np.floor(lng_max / tamanho))))
+
+    celulas = ds.dataset(ler_agregado(nome, lambda: atualizar_rollup(nome))).to_table(columns=['i', 'j'] + campos_contagem(nome), filter=filtro)
+    return celulas.to_pandas().groupby(['i', 'j'], as_index=False).sum()
+
+
+# Células agregadas para o zoom e a área visível do mapa, em formato colunar. Parâmetros:
+# zoom, limites=lat_min,lng_min,lat_max,lng_max, inicio e fim (datas ISO, opcionais).
+@rollups_app.route('/celulas/<nome>')
+def celulas(nome):
+    if nome not in ROLLUPS:
+        return jsonify({"error": "Coleção sem agregados"}), 404
+    try:
+        nivel = nivel_grade(int(request.args.get('zoom', 11)))
+        limites = request.args.get('limites')
+        limites = tuple(float(valor) for valor in limites.split(',')) if limites else None
+        if limites is not None and len(limites) != 4:
+            raise ValueError("limites deve ter quatro valores")
+        resultado = consultar_celulas(nome, nivel, request.args.get('inicio') or None,
+                                      request.args.get('fim') or None, limites)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "nivel": nivel,
+        "tamanho": NIVEIS_GRADE[nivel],
+        **{coluna: resultado[coluna].tolist() for coluna in resultado.columns},
+    })
+
+
+if __name__ == '__main__':
+    # Uso: python -m app.rollups [--completo] [colecao ...]
+    argumentos = sys.argv[1:]
+    reconstruir = '--completo' in argumentos
+    colecoes = [a for a in argumentos if not a.startswith('--')] or list(ROLLUPS)
+    for colecao in colecoes:
+        atualizar_rollup(colecao, completo=reconstruir)
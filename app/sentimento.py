@@ -0,0 +1,124 @@
+import os
+import hashlib
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Conectar ao MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['mobility_data']
+
+# Cache dos sentimentos já calculados, indexado pelo hash do texto do comentário
+sentimentos_collection = db['sentimentos_comentarios']
+
+MODELO_SENTIMENTO = "nlptown/bert-base-multilingual-uncased-sentiment"
+# Comentários por passada do modelo e comentários gravados no cache por vez
+TAMANHO_LOTE_SENTIMENTO = int(os.getenv("TAMANHO_LOTE_SENTIMENTO", 32))
+COMENTARIOS_POR_GRAVACAO = 1000
+
+# O modelo devolve de '1 star' a '5 stars'; o dashboard agrupa em três categorias
+CATEGORIAS_POR_ESTRELAS = {1: 'negative', 2: 'negative', 3: 'neutral', 4: 'positive', 5: 'positive'}
+
+_sentiment_analyzer = None
+
+
+# Configurar o pipeline de análise de sentimento (carregado só quando há comentários novos)
+def setup_sentiment_pipeline():
+    global _sentiment_analyzer
+    if _sentiment_analyzer is None:
+        from transformers import pipeline
+        _sentiment_analyzer = pipeline("sentiment-analysis", model=MODELO_SENTIMENTO)
+    return _sentiment_analyzer
+
+
+# Chave do cache: hash do modelo + texto do comentário
+def hash_comentario(texto):
+    return hashlib.sha1(f"{MODELO_SENTIMENTO}\x00{texto}".encode('utf-8')).hexdigest()
+
+
+def categoria_sentimento(label):
+    try:
+        return CATEGORIAS_POR_ESTRELAS[int(str(label).split()[0])]
+    except (ValueError, KeyError):
+        return 'neutral'
+
+
+# Buscar no cache os sentimentos já calculados para um conjunto de hashes
+def _buscar_cache(hashes):
+    encontrados = {}
+    for inicio in range(0, len(hashes), 10_000):
+        cursor = sentimentos_collection.find({'_id': {'$in': hashes[inicio:inicio + 10_000]}},
+                                             {'label': 1, 'score': 1})
+        for documento in cursor:
+            encontrados[documento['_id']] = (documento['label'], documento['score'])
+    return encontrados
+
+
+# Analisar os comentários que ainda não estão no cache, em lotes, e gravar os resultados
+def _analisar_novos(textos, tamanho_lote):
+    analisador = setup_sentiment_pipeline()
+    resultados = {}
+    for inicio in range(0, len(textos), COMENTARIOS_POR_GRAVACAO):
+        parte = textos[inicio:inicio + COMENTARIOS_POR_GRAVACAO]
+        saidas = analisador(parte, batch_size=tamanho_lote, truncation=True)
+
+        agora = datetime.now()
+        operacoes = []
+        for texto, saida in zip(parte, saidas):
+            chave = hash_comentario(texto)
+            resultados[chave] = (saida['label'], float(saida['score']))
+            operacoes.append(UpdateOne(
+                {'_id': chave},
+                {'$setOnInsert': {'label': saida['label'], 'score': float(saida['score']),
+                                  'modelo': MODELO_SENTIMENTO, 'analisado_em': agora}},
+                upsert=True))
+        sentimentos_collection.bulk_write(operacoes, ordered=False)
+        logger.info(f"Sentimento calculado para {inicio + len(parte)}/{len(textos)} comentários novos.")
+    return resultados
+
+
+# Obter o sentimento de uma série de comentários. Os textos são deduplicados, os já vistos vêm
+# do cache e só os inéditos passam pelo modelo. Retorna um DataFrame com o mesmo índice e as
+# colunas 'label' (estrelas), 'score' e 'sentimento' (positive/neutral/negative).
+def analisar_sentimentos(comentarios, tamanho_lote=TAMANHO_LOTE_SENTIMENTO):
+    comentarios = pd.Series(comentarios)
+    textos = comentarios[comentarios.map(lambda c: isinstance(c, str))].unique().tolist()
+    hashes = [hash_comentario(texto) for texto in textos]
+
+    resultados = _buscar_cache(hashes)
+    novos = [texto for texto, chave in zip(textos, hashes) if chave not in resultados]
+    logger.info(f"{len(textos)} comentários distintos; {len(novos)} ainda não analisados.")
+    if novos:
+        resultados.update(_analisar_novos(novos, tamanho_lote))
+
+    por_texto = {texto: resultados[chave] for texto, chave in zip(textos, hashes)}
+    labels = comentarios.map(lambda c: por_texto[c][0] if isinstance(c, str) else None)
+    scores = comentarios.map(lambda c: por_texto[c][1] if isinstance(c, str) else np.nan)
+    sentimentos = labels.map(lambda l: categoria_sentimento(l) if l is not None else 'neutral')
+    return pd.DataFrame({'label': labels, 'score': scores, 'sentimento': sentimentos}, index=comentarios.index)
+
+
+# Pré-calcular o sentimento de todos os comentários de corridas canceladas ainda não vistos
+def atualizar_sentimentos():
+    cursor = db['rides_original'].aggregate([
+        {'$match': {'finalizada': 0, 'rating_comment': {'$type': 'string'}}},
+        {'$group': {'_id': '$rating_comment'}},
+    ], allowDiskUse=True)
+    comentarios = pd.Series([documento['_id'] for documento in cursor], dtype=object)
+    analisar_sentimentos(comentarios)
+
+
+if __name__ == '__main__':
+    atualizar_sentimentos()
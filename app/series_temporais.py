@@ -0,0 +1,148 @@
+import sys
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+from flask import Blueprint, jsonify, request
+
+from app.consultas import carregar
+from app.rollups import ROLLUPS, atualizar_agregado, ler_agregado
+
+logger = logging.getLogger(__name__)
+
+# Séries temporais agregadas por hora: corridas por bairro (total e por status) e ocorrências por
+# procedimento. Os totais por hora ficam em Parquet junto dos agregados em grade (app.rollups) e são
+# atualizados incrementalmente; as consultas por dia, semana ou mês partem de uma versão diária
+# montada uma vez por versão do arquivo.
+SERIES = {
+    'corridas': {
+        'colecao': 'rides_original', 'data': 'created_at', 'grupo': 'bairro', 'coluna_grupo': 'suburb_client',
+        'status': 'status', 'contagens': ROLLUPS['rides_original']['contagens'],
+    },
+    'ocorrencias': {
+        'colecao': 'ocorrencias', 'data': 'data_inicio', 'grupo': 'id_pop', 'coluna_grupo': 'id_pop',
+        'status': None, 'contagens': {},
+    },
+}
+
+# Início de cada período a partir da data (semanas começando na segunda-feira)
+INTERVALOS = {
+    'hora': lambda datas: datas,
+    'dia': lambda datas: datas,
+    'semana': lambda datas: datas - pd.to_timedelta(datas.dt.dayofweek, unit='D'),
+    'mes': lambda datas: datas.dt.to_period('M').dt.start_time,
+}
+
+_series = {}
+_trava = threading.Lock()
+
+series_app = Blueprint("series_app", __name__)
+
+
+def _arquivo(nome):
+    return f"serie_{nome}"
+
+
+def campos_contagem(nome):
+    return ['total'] + list(SERIES[nome]['contagens'])
+
+
+# Contagens por hora e grupo das linhas novas do snapshot
+def _agregar(nome, df):
+    config = SERIES[nome]
+    df = df.dropna(subset=[config['data']])
+    colunas = {
+        'hora': df[config['data']].dt.floor('h').to_numpy(),
+        config['grupo']: df[config['coluna_grupo']].astype(object).fillna("Desconhecido").astype(str).to_numpy(),
+        'total': np.ones(len(df), dtype=np.int64),
+    }
+    for campo, status in config['contagens'].items():
+        colunas[campo] = (df[config['status']] == status).to_numpy(dtype=np.int64)
+    return pd.DataFrame(colunas)
+
+
+def atualizar_serie(nome, completo=False):
+    config = SERIES[nome]
+    colunas = [config['data'], config['coluna_grupo']] + ([config['status']] if config['status'] else [])
+    return atualizar_agregado(_arquivo(nome), config['colecao'], colunas, lambda df: _agregar(nome, df),
+                              ['hora', config['grupo']], completo)
+
+
+# Série horária ou diária como DataFrame ordenado por período, montada uma vez por versão do arquivo
+def _tabela(nome, diaria):
+    tabela = ler_agregado(_arquivo(nome), lambda: atualizar_serie(nome))
+    with _trava:
+        if (nome, diaria) not in _series or _series[(nome, diaria)][0] is not tabela:
+            df = tabela.to_pandas().rename(columns={'hora': 'periodo'})
+            if diaria:
+                df['periodo'] = df['periodo'].dt.floor('D')
+                df = df.groupby(['periodo', SERIES[nome]['grupo']], as_index=False, sort=True).sum()
+            _series[(nome, diaria)] = (tabela, df)
+        return _series[(nome, diaria)][1]
+
+
+# Totais de uma série no intervalo [inicio, fim], reamostrados para hora, dia, semana ou mês.
+# `grupos` restringe aos bairros/procedimentos escolhidos; com `por_grupo`, cada grupo tem sua série.
+def consultar_serie(nome, intervalo='dia', inicio=None, fim=None, grupos=None, por_grupo=False):
+    if intervalo not in INTERVALOS:
+        raise ValueError(f"intervalo deve ser um de: {', '.join(INTERVALOS)}")
+    grupo = SERIES[nome]['grupo']
+    df = _tabela(nome, diaria=intervalo != 'hora')
+
+    # Recorte do período por busca binária na coluna ordenada
+    periodos = df['periodo'].to_numpy()
+    primeiro = np.searchsorted(periodos, pd.Timestamp(inicio).to_datetime64(), 'left') if inicio else 0
+    ultimo = np.searchsorted(periodos, pd.Timestamp(fim).to_datetime64(), 'right') if fim else len(df)
+    df = df.iloc[primeiro:ultimo]
+    if grupos is not None:
+        df = df[df[grupo].isin([str(g) for g in grupos])]
+
+    chave = ['periodo', grupo] if por_grupo else ['periodo']
+    df = df.assign(periodo=INTERVALOS[intervalo](df['periodo']))
+    return df.groupby(chave, as_index=False, sort=True)[campos_contagem(nome)].sum()
+
+
+# Título de cada procedimento, por id_pop
+def _procedimentos():
+    procedimentos = carregar('procedimento_operacional_padrao', colunas=['id_pop', 'pop_titulo']).dropna()
+    return dict(zip(procedimentos['id_pop'], procedimentos['pop_titulo'].astype(str)))
+
+
+# Série em formato colunar. Parâmetros: intervalo (hora, dia, semana ou mês), inicio, fim,
+# grupo (repetível: bairros das corridas ou títulos dos procedimentos das ocorrências) e
+# por_grupo=1 para separar as séries por grupo.
+@series_app.route('/<nome>')
+def serie(nome):
+    if nome not in SERIES:
+        return jsonify({"error": "Série desconhecida"}), 404
+    grupos = request.args.getlist('grupo') or None
+    titulos = None
+    if nome == 'ocorrencias':
+        titulos = _procedimentos()
+        if grupos:
+            grupos = [id_pop for id_pop, titulo in titulos.items() if titulo in grupos]
+    try:
+        resultado = consultar_serie(nome, request.args.get('intervalo', 'dia'),
+                                    request.args.get('inicio') or None, request.args.get('fim') or None,
+                                    grupos, request.args.get('por_grupo') == '1')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    resposta = {"intervalo": request.args.get('intervalo', 'dia'),
+                "periodo": resultado['periodo'].dt.strftime('%Y-%m-%dT%H:%M:%S').tolist()}
+    for coluna in resultado.columns.drop('periodo'):
+        valores = resultado[coluna]
+        if coluna == 'id_pop':
+            resposta['pop_titulo'] = valores.map(titulos).fillna(valores).tolist()
+        else:
+            resposta[coluna] = valores.tolist()
+    return jsonify(resposta)
+
+
+if __name__ == '__main__':
+    # Uso: python -m app.series_temporais [--completo] [serie ...]
+    argumentos = sys.argv[1:]
+    reconstruir = '--completo' in argumentos
+    for serie_temporal in [a for a in argumentos if not a.startswith('--')] or list(SERIES):
+        atualizar_serie(serie_temporal, completo=reconstruir)
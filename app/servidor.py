@@ -0,0 +1,70 @@
+from flask import Flask
+from flask_session import Session
+from flask_cors import CORS
+from pymongo import MongoClient
+import os
+import secrets
+# A instrumentação registra o monitor de comandos do pymongo; deve vir antes dos módulos que criam clientes
+from app.instrumentacao import instrumentar_app
+from app.Analise_espacial_cluster_v1 import create_analise_espacial_cluster_app
+from app.Mapa_ocorrencias_v2_1 import mapa_ocorrencias_app
+from app.tarefas import tarefas_app
+from app.favelas import favelas_app
+from app.rollups import rollups_app
+from app.series_temporais import series_app
+
+# Montagem do servidor: app Flask com os blueprints, os dashboards Dash e as rotas de app.views.
+# Carregado sob demanda pelo pacote (`app.app`, p.ex. `gunicorn app:app`); importar só um módulo
+# de app (scripts, processos de pool, testes) não monta o servidor.
+
+# Configurações gerais do Flask
+app = Flask(__name__)
+CORS(app)
+
+# Server-Timing por requisição e métricas em /metrics
+instrumentar_app(app)
+
+# Registro do blueprint
+# app.register_blueprint(impacto_eventos_app, url_prefix="/impacto_eventos")
+app.register_blueprint(mapa_ocorrencias_app, url_prefix="/mapa_ocorrencias")
+app.register_blueprint(tarefas_app, url_prefix="/tarefas")
+app.register_blueprint(favelas_app, url_prefix="/favelas")
+app.register_blueprint(rollups_app, url_prefix="/rollups")
+app.register_blueprint(series_app, url_prefix="/series")
+
+# Registro do Dash como um Blueprint dentro do Flask
+create_analise_espacial_cluster_app(app)
+
+# Configurações de upload
+UPLOAD_FOLDER = 'upload_files/'
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+# Configurações de sessão
+app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_FILE_DIR'] = './flask_session'
+app.config['SESSION_PERMANENT'] = False
+app.config['SECRET_KEY'] = secrets.token_hex(16)
+Session(app)
+
+# Configuração do MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["mobility_data"]
+
+# Importar rotas do arquivo views.py
+from app.views import *
+# Configurações de sessão
+app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_FILE_DIR'] = './flask_session'
+app.config['SESSION_PERMANENT'] = False
+app.config['SECRET_KEY'] = secrets.token_hex(16)
+Session(app)
+
+# Configuração do MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["mobility_data"]
+
+# Importar rotas do arquivo views.py
+from app.views import *
@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import hashlib
+import fcntl
+import logging
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from app.normalizacao import normalizar_datas, extrair_numeros
+from app.tabelas import CATEGORIA, COORDENADA, NUMERO, DATA, OBJECTID, TEXTO, converter_ids, para_pandas
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Conectar ao MongoDB
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['mobility_data']
+
+# Diretório dos snapshots e intervalo mínimo (s) entre atualizações incrementais
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_INTERVALO = float(os.getenv("SNAPSHOT_INTERVALO", 300))
+TAMANHO_LOTE = 50_000
+
+# Incrementar sempre que algum esquema mudar, para forçar a reconstrução completa
+VERSAO_ESQUEMA = 3
+
+# Esquema de cada coleção: coluna -> (caminhos alternativos no documento, tipo de app.tabelas)
+ESQUEMAS = {
+    'rides_original': {
+        '_id': (['_id'], OBJECTID),
+        'created_at': (['created_at'], DATA),
+        'origin_lat': (['origin_lat', 'location.coordinates.1'], COORDENADA),
+        'origin_lng': (['origin_lng', 'location.coordinates.0'], COORDENADA),
+        'status': (['status'], CATEGORIA),
+        'suburb_client': (['suburb_client'], CATEGORIA),
+        'turno': (['turno'], CATEGORIA),
+        'driver_id': (['driver_id'], TEXTO),
+        'driver_distance': (['driver_distance'], NUMERO),
+        'route_distance': (['route_distance'], NUMERO),
+        'rating_score': (['rating_score'], NUMERO),
+        'rating_comment': (['rating_comment'], TEXTO),
+        'finalizada': (['finalizada'], NUMERO),
+        'favela': (['favela'], CATEGORIA),
+        'complexo': (['complexo'], CATEGORIA),
+        'bairro_favela': (['bairro_favela'], CATEGORIA),
+    },
+    'events': {
+        '_id': (['_id'], OBJECTID),
+        'id': (['id'], TEXTO),
+        'date': (['date'], DATA),
+        'latitude': (['location.coordinates.1', 'latitude'], COORDENADA),
+        'longitude': (['location.coordinates.0', 'longitude'], COORDENADA),
+        'favela': (['favela'], CATEGORIA),
+        'complexo': (['complexo'], CATEGORIA),
+        'bairro_favela': (['bairro_favela'], CATEGORIA),
+    },
+    'ocorrencias': {
+        '_id': (['_id'], OBJECTID),
+        'data_inicio': (['data_inicio'], DATA),
+        'data_fim': (['data_fim'], DATA),
+        'latitude': (['latitude', 'location.coordinates.1'], COORDENADA),
+        'longitude': (['longitude', 'location.coordinates.0'], COORDENADA),
+        'id_pop': (['id_pop'], TEXTO),
+        'descricao': (['descricao'], TEXTO),
+        'favela': (['favela'], CATEGORIA),
+        'complexo': (['complexo'], CATEGORIA),
+        'bairro_favela': (['bairro_favela'], CATEGORIA),
+    },
+    'procedimento_operacional_padrao': {
+        '_id': (['_id'], OBJECTID),
+        'id_pop': (['id_pop'], TEXTO),
+        'pop_titulo': (['pop_titulo'], CATEGORIA),
+    },
+}
+
+
+# Contador de alterações por coleção, incrementado por quem atualiza ou remove documentos
+# (inserções já são percebidas pela contagem e pelo maior _id)
+versoes_collection = db['versoes_dados']
+
+
+def _caminho_arquivo(nome):
+    return os.path.join(SNAPSHOT_DIR, f"{nome}.arrow")
+
+
+def _caminho_metadados(nome):
+    return os.path.join(SNAPSHOT_DIR, f"{nome}.json")
+
+
+def ler_metadados(nome):
+    try:
+        with open(_caminho_metadados(nome), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Buscar um valor aninhado por caminho pontuado ('location.coordinates.1')
+def _valor(documento, caminho):
+    valor = documento
+    for parte in caminho.split('.'):
+        if isinstance(valor, dict):
+            valor = valor.get(parte)
+        elif isinstance(valor, (list, tuple)) and parte.isdigit() and int(parte) < len(valor):
+            valor = valor[int(parte)]
+        else:
+            return None
+    return valor
+
+
+def _primeiro_valor(documento, caminhos):
+    for caminho in caminhos:
+        valor = _valor(documento, caminho)
+        if valor is not None:
+            return valor
+    return None
+
+
+def _converter_textos(valores):
+    return pa.array([None if v is None else str(v) for v in valores], type=pa.string())
+
+
+# Montar um RecordBatch tipado a partir de um lote de documentos (datas e números normalizados
+# em lote por app.normalizacao; os pontos GeoJSON são separados uma vez por lote)
+def _lote_para_arrow(documentos, esquema):
+    colunas = {}
+    pontos = {}
+    for coluna, (caminhos, tipo) in esquema.items():
+        if pa.types.is_floating(tipo):
+            colunas[coluna] = pa.array(extrair_numeros(documentos, caminhos, pontos), type=tipo, from_pandas=True)
+            continue
+        valores = [_primeiro_valor(doc, caminhos) for doc in documentos]
+        if tipo == DATA:
+            colunas[coluna] = pa.array(normalizar_datas(valores), type=DATA, from_pandas=True)
+        elif tipo == CATEGORIA:
+            colunas[coluna] = _converter_textos(valores).dictionary_encode().cast(CATEGORIA)
+        elif tipo == OBJECTID:
+            colunas[coluna] = converter_ids(valores)
+        else:
+            colunas[coluna] = _converter_textos(valores)
+    return pa.RecordBatch.from_pydict(colunas, schema=_esquema_arrow(esquema))
+
+
+def _esquema_arrow(esquema):
+    return pa.schema([(coluna, tipo) for coluna, (_, tipo) in esquema.items()])
+
+
+def _projecao(esquema):
+    campos = {caminho.split('.')[0] for caminhos, _ in esquema.values() for caminho in caminhos}
+    return {campo: 1 for campo in campos}
+
+
+# Ler lotes de documentos novos da coleção (com _id acima da marca d'água), em ordem de _id
+def _ler_lotes(nome, esquema, marca_dagua=None):
+    filtro = {'_id': {'$gt': ObjectId(marca_dagua)}} if marca_dagua else {}
+    cursor = db[nome].find(filtro, _projecao(esquema)).sort('_id', 1).batch_size(TAMANHO_LOTE)
+    lote = []
+    for documento in cursor:
+        lote.append(documento)
+        if len(lote) >= TAMANHO_LOTE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# Registrar que documentos de uma coleção foram alterados ou removidos (força a reconstrução
+# completa do snapshot e invalida os resultados derivados)
+def registrar_alteracao(nome):
+    versoes_collection.update_one({'_id': nome}, {'$inc': {'alteracoes': 1},
+                                                  '$set': {'alterado_em': datetime.now()}}, upsert=True)
+
+
+def _alteracoes(nome):
+    controle = versoes_collection.find_one({'_id': nome}) or {}
+    return controle.get('alteracoes', 0)
+
+
+# Impressão digital barata do estado atual da coleção no MongoDB: contagem estimada, maior _id
+# e contador de alterações
+def impressao_colecao(nome):
+    colecao = db[nome]
+    ultimo = colecao.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    ultimo_id = ultimo['_id'] if ultimo else None
+    return f"{colecao.estimated_document_count()}:{ultimo_id}:{_alteracoes(nome)}"
+
+
+def _abrir_tabela(caminho):
+    with pa.memory_map(caminho, 'r') as fonte:
+        return pa.ipc.open_file(fonte).read_all()
+
+
+# Exportar (ou completar) o snapshot de uma coleção em formato Arrow IPC.
+# Sem `completo`, apenas documentos com _id acima da última marca d'água são lidos do MongoDB;
+# documentos alterados depois de exportados só são refletidos em uma reconstrução completa, que
+# também acontece automaticamente quando registrar_alteracao(nome) foi chamado desde o último snapshot.
+def atualizar_snapshot(nome, completo=False):
+    esquema = ESQUEMAS[nome]
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    caminho = _caminho_arquivo(nome)
+
+    with open(os.path.join(SNAPSHOT_DIR, f"{nome}.lock"), 'w') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+
+        metadados = ler_metadados(nome)
+        impressao = impressao_colecao(nome)
+        alteracoes = _alteracoes(nome)
+        if (metadados is None or metadados.get('versao_esquema') != VERSAO_ESQUEMA
+                or not metadados.get('marca_dagua') or not os.path.exists(caminho)
+                or metadados.get('alteracoes', 0) != alteracoes):
+            completo = True
+
+        marca_dagua = None if completo else metadados.get('marca_dagua')
+        lotes = []
+        for documentos in _ler_lotes(nome, esquema, marca_dagua):
+            lotes.append(_lote_para_arrow(documentos, esquema))
+            ultimo_id = documentos[-1]['_id']
+            marca_dagua = str(ultimo_id) if isinstance(ultimo_id, ObjectId) else None
+
+        novos = sum(lote.num_rows for lote in lotes)
+        if completo or novos:
+            tabelas = [] if completo else [_abrir_tabela(caminho)]
+            tabelas.append(pa.Table.from_batches(lotes, schema=_esquema_arrow(esquema)))
+            tabela = pa.concat_tables(tabelas)
+
+            # Escrever em arquivo temporário e trocar atomicamente; leitores abertos seguem no arquivo antigo
+            temporario = f"{caminho}.tmp"
+            opcoes = pa.ipc.IpcWriteOptions(unify_dictionaries=True)
+            with pa.OSFile(temporario, 'wb') as destino:
+                with pa.ipc.new_file(destino, tabela.schema, options=opcoes) as escritor:
+                    escritor.write_table(tabela)
+            os.replace(temporario, caminho)
+            linhas = tabela.num_rows
+        else:
+            linhas = metadados['linhas']
+
+        metadados = {
+            'colecao': nome,
+            'versao_esquema': VERSAO_ESQUEMA,
+            'marca_dagua': marca_dagua,
+            'linhas': linhas,
+            'alteracoes': alteracoes,
+            'impressao': impressao,
+            'atualizado_em': datetime.now().isoformat(),
+        }
+        with open(_caminho_metadados(nome), 'w', encoding='utf-8') as f:
+            json.dump(metadados, f)
+
+    logger.info(f"Snapshot de '{nome}': {novos} documentos novos, {linhas} no total.")
+    return metadados
+
+
+def _desatualizado(nome):
+    caminho = _caminho_metadados(nome)
+    if not os.path.exists(caminho) or not os.path.exists(_caminho_arquivo(nome)):
+        return True
+    return (datetime.now().timestamp() - os.path.getmtime(caminho)) > SNAPSHOT_INTERVALO
+
+
+# Hash que identifica o conteúdo atual do snapshot (usado para versionar artefatos derivados)
+def hash_snapshot(nome, atualizar=True):
+    if atualizar and _desatualizado(nome):
+        atualizar_snapshot(nome)
+    metadados = ler_metadados(nome) or {}
+    identificacao = f"{metadados.get('versao_esquema')}:{metadados.get('marca_dagua')}:{metadados.get('linhas')}"
+    return hashlib.sha1(identificacao.encode('utf-8')).hexdigest()[:12]
+
+
+# Versão dos dados de um conjunto de coleções, para chavear resultados derivados delas.
+# Consulta a impressão digital de cada coleção no MongoDB e, se ela mudou desde o último
+# snapshot, atualiza o snapshot antes, de modo que a versão sempre corresponda ao que
+# carregar_snapshot devolve.
+def versao_dados(nomes):
+    impressoes = []
+    for nome in nomes:
+        impressao = impressao_colecao(nome)
+        metadados = ler_metadados(nome) or {}
+        if metadados.get('impressao') != impressao or not os.path.exists(_caminho_arquivo(nome)):
+            atualizar_snapshot(nome)
+        impressoes.append(f"{nome}={impressao}")
+    return hashlib.sha1("|".join(impressoes).encode('utf-8')).hexdigest()[:12]
+
+
+# Carregar o snapshot de uma coleção como DataFrame a partir do arquivo mapeado em memória.
+# O snapshot é atualizado incrementalmente se a última atualização tiver mais de SNAPSHOT_INTERVALO s.
+# O mapeamento evita ler e decodificar o arquivo inteiro, mas o DataFrame devolvido é uma cópia
+# (em memória do processo) das colunas e linhas selecionadas: `colunas` e `filtro` (expressão do
+# Arrow, ver app.consultas) são aplicados sobre o arquivo mapeado antes de montar o DataFrame, e
+# só o que eles selecionam é materializado.
+def carregar_snapshot(nome, colunas=None, atualizar=True, filtro=None):
+    if atualizar and _desatualizado(nome):
+        atualizar_snapshot(nome)
+
+    tabela = _abrir_tabela(_caminho_arquivo(nome))
+    if filtro is not None:
+        tabela = ds.dataset(tabela).to_table(columns=colunas, filter=filtro)
+    elif colunas is not None:
+        tabela = tabela.select(colunas)
+    return para_pandas(tabela)
+
+
+if __name__ == '__main__':
+    # Uso: python -m app.snapshot [--completo] [colecao ...]
+    argumentos = sys.argv[1:]
+    reconstruir = '--completo' in argumentos
+    colecoes = [a for a in argumentos if not a.startswith('--')] or list(ESQUEMAS)
+    for colecao in colecoes:
+        atualizar_snapshot(colecao, completo=reconstruir)
@@ -0,0 +1,50 @@
+import pandas as pd
+import pyarrow as pa
+from bson import ObjectId
+
+# Tipos das colunas das tabelas em memória (corridas, eventos, ocorrências e procedimentos).
+# Os esquemas de app.snapshot declaram cada coluna com um destes tipos, que valem tanto para o
+# arquivo do snapshot quanto para os DataFrames entregues aos dashboards; nenhuma das colunas
+# abaixo guarda objetos Python, então os filtros sobre elas são vetorizados:
+# - CATEGORIA: textos repetidos (status, bairro, turno, pop_titulo...) como códigos + dicionário,
+#   que viram pandas.Categorical com códigos int8/int16
+# - COORDENADA e NUMERO: float32
+# - DATA: instantes em microssegundos desde a época (int64; datetime64[us] no pandas)
+# - OBJECTID: os 12 bytes do ObjectId (fixed_size_binary, mantido no pandas como coluna do Arrow)
+CATEGORIA = pa.dictionary(pa.int32(), pa.string())
+COORDENADA = pa.float32()
+NUMERO = pa.float32()
+DATA = pa.timestamp('us')
+OBJECTID = pa.binary(12)
+TEXTO = pa.string()
+
+TIPOS_PANDAS = {OBJECTID: pd.ArrowDtype(OBJECTID)}
+
+
+# Bytes de um ObjectId (aceita ObjectId, texto hexadecimal ou os próprios bytes)
+def bytes_objectid(valor):
+    if isinstance(valor, ObjectId):
+        return valor.binary
+    if isinstance(valor, bytes) and len(valor) == 12:
+        return valor
+    if isinstance(valor, str) and ObjectId.is_valid(valor):
+        return ObjectId(valor).binary
+    return None
+
+
+def converter_ids(valores):
+    return pa.array([bytes_objectid(v) for v in valores], type=OBJECTID)
+
+
+def escalar_objectid(valor):
+    return pa.scalar(bytes_objectid(valor), type=OBJECTID)
+
+
+# Texto hexadecimal dos ids (para exibição e para gravar marcas d'água em JSON)
+def texto_objectid(valor):
+    return None if valor is None or pd.isna(valor) else bytes(valor).hex()
+
+
+# Montar o DataFrame de uma tabela do Arrow mantendo os tipos compactos
+def para_pandas(tabela):
+    return tabela.to_pandas(types_mapper=TIPOS_PANDAS.get)
@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import logging
+import importlib
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import gridfs
+from bson import ObjectId
+from dotenv import load_dotenv
+from flask import Blueprint, jsonify
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Conectar ao MongoDB (cada processo do pool cria a sua própria conexão ao importar o módulo)
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['mobility_data']
+
+# Estado das tarefas e resultados (no GridFS, pois podem passar do limite de 16 MB por documento)
+tarefas_collection = db['tarefas']
+resultados_fs = gridfs.GridFS(db, collection='resultados_tarefas')
+
+# Processos de cálculo por worker do gunicorn e tempo sem atualização após o qual uma
+# tarefa em andamento é considerada perdida (p.ex. worker reiniciado) e pode ser refeita
+TAREFAS_PROCESSOS = int(os.getenv("TAREFAS_PROCESSOS", 2))
+TAREFA_EXPIRACAO = timedelta(seconds=int(os.getenv("TAREFA_EXPIRACAO", 1800)))
+# Intervalo do sinal de vida (atualizado_em) de uma tarefa em execução, mesmo sem progresso
+# reportado, para que ela só expire se o processo que a executa deixar de existir
+TAREFA_BATIMENTO = TAREFA_EXPIRACAO / 6
+
+# Funções de cada tipo de tarefa: nome -> (módulo, função), registradas com @tarefa
+_tarefas = {}
+_executor = None
+
+tarefas_app = Blueprint("tarefas_app", __name__)
+
+
+# Decorador para registrar uma função como tarefa em segundo plano. A função recebe os
+# parâmetros (dict serializável em JSON) e uma função `reportar(progresso, parcial=None)`,
+# e devolve o resultado (também serializável em JSON).
+def tarefa(nome):
+    def decorador(funcao):
+        _tarefas[nome] = (funcao.__module__, funcao)
+        return funcao
+    return decorador
+
+
+# Identificador determinístico: o mesmo tipo de tarefa com os mesmos parâmetros gera o mesmo id
+def id_tarefa(nome, parametros):
+    chave = json.dumps({'nome': nome, 'parametros': parametros}, sort_keys=True, default=str)
+    return hashlib.sha1(chave.encode('utf-8')).hexdigest()
+
+
+def _obter_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=TAREFAS_PROCESSOS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+# Descartar o pool se ele ainda for o atual; o próximo uso cria outro
+def _descartar_executor(executor):
+    global _executor
+    if _executor is executor:
+        _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Enviar a tarefa ao pool. Um pool interrompido (processo morto, p.ex. por falta de memória) é
+# trocado por um novo; as tarefas que estavam nele terminam com erro.
+def _enviar(identificador, modulo, nome, parametros):
+    executor = _obter_executor()
+    try:
+        futuro = executor.submit(_executar, identificador, modulo, nome, parametros)
+    except BrokenProcessPool:
+        _descartar_executor(executor)
+        executor = _obter_executor()
+        futuro = executor.submit(_executar, identificador, modulo, nome, parametros)
+    futuro.add_done_callback(lambda f: _verificar_interrupcao(f, executor, identificador, nome))
+
+
+def _verificar_interrupcao(futuro, executor, identificador, nome):
+    if futuro.cancelled() or not isinstance(futuro.exception(), BrokenProcessPool):
+        return
+    logger.error(f"Processo da tarefa '{nome}' ({identificador}) interrompido: {futuro.exception()}")
+    # Chamado na thread de gerenciamento do próprio pool: só deixa de usá-lo, sem encerrá-lo aqui
+    global _executor
+    if _executor is executor:
+        _executor = None
+    tarefas_collection.update_one(
+        {'_id': identificador, 'status': {'$in': ['pendente', 'executando']}},
+        {'$set': {'status': 'erro', 'erro': "Processo de cálculo interrompido", 'atualizado_em': datetime.now()}})
+
+
+# Submeter uma tarefa. Se já houver uma concluída (ou em andamento) com os mesmos parâmetros,
+# apenas devolve o id dela, sem recalcular.
+def submeter(nome, parametros):
+    identificador = id_tarefa(nome, parametros)
+    agora = datetime.now()
+
+    existente = tarefas_collection.find_one({'_id': identificador})
+    if existente is not None:
+        if existente['status'] == 'concluida':
+            return identificador
+        if existente['status'] in ('pendente', 'executando') and agora - existente['atualizado_em'] < TAREFA_EXPIRACAO:
+            return identificador
+
+    # Reservar a tarefa; se outro worker a reservou antes (inserção ou atualização concorrente),
+    # apenas devolver o id dela
+    filtro = {'_id': identificador}
+    if existente is not None:
+        filtro['atualizado_em'] = existente['atualizado_em']
+    try:
+        reserva = tarefas_collection.update_one(filtro, {
+            '$set': {'nome': nome, 'parametros': parametros, 'status': 'pendente', 'progresso': 0.0,
+                     'parcial': None, 'erro': None, 'resultado_id': None, 'atualizado_em': agora},
+            '$setOnInsert': {'criado_em': agora},
+        }, upsert=existente is None)
+    except DuplicateKeyError:
+        return identificador
+    if existente is not None and reserva.modified_count == 0:
+        return identificador
+
+    modulo, _ = _tarefas[nome]
+    _enviar(identificador, modulo, nome, parametros)
+    logger.info(f"Tarefa '{nome}' submetida ({identificador}).")
+    return identificador
+
+
+# Executado no processo do pool: roda a função da tarefa e grava progresso e resultado
+def _executar(identificador, modulo, nome, parametros):
+    importlib.import_module(modulo)
+    _, funcao = _tarefas[nome]
+
+    def reportar(progresso, parcial=None):
+        tarefas_collection.update_one({'_id': identificador}, {'$set': {
+            'progresso': progresso, 'parcial': parcial, 'atualizado_em': datetime.now()}})
+
+    # Sinal de vida enquanto a função executa
+    parar = threading.Event()
+
+    def bater():
+        while not parar.wait(TAREFA_BATIMENTO.total_seconds()):
+            tarefas_collection.update_one({'_id': identificador, 'status': 'executando'}, {'$set': {
+                'atualizado_em': datetime.now()}})
+
+    tarefas_collection.update_one({'_id': identificador}, {'$set': {
+        'status': 'executando', 'atualizado_em': datetime.now()}})
+    threading.Thread(target=bater, daemon=True).start()
+    try:
+        resultado = funcao(parametros, reportar)
+        resultado_id = resultados_fs.put(json.dumps(resultado, default=str).encode('utf-8'),
+                                         tarefa=identificador)
+        tarefas_collection.update_one({'_id': identificador}, {'$set': {
+            'status': 'concluida', 'progresso': 1.0, 'resultado_id': resultado_id,
+            'atualizado_em': datetime.now()}})
+    except Exception as e:
+        logger.error(f"Erro na tarefa '{nome}' ({identificador}): {e}")
+        tarefas_collection.update_one({'_id': identificador}, {'$set': {
+            'status': 'erro', 'erro': str(e), 'detalhes': traceback.format_exc(),
+            'atualizado_em': datetime.now()}})
+    finally:
+        parar.set()
+
+
+# Estado atual de uma tarefa (e o resultado, se concluída); None se não existir
+def consultar(identificador, incluir_resultado=True):
+    documento = tarefas_collection.find_one({'_id': identificador}, {'detalhes': 0})
+    if documento is None:
+        return None
+
+    estado = {
+        'tarefa': documento['_id'],
+        'nome': documento['nome'],
+        'status': documento['status'],
+        'progresso': documento.get('progresso'),
+        'parcial': documento.get('parcial'),
+        'erro': documento.get('erro'),
+    }
+    if incluir_resultado and documento['status'] == 'concluida' and documento.get('resultado_id'):
+        estado['resultado'] = json.loads(resultados_fs.get(ObjectId(documento['resultado_id'])).read())
+    return estado
+
+
+# Resposta padrão de um endpoint pesado em modo assíncrono
+def resposta_submetida(identificador):
+    return jsonify({'tarefa': identificador, 'status_url': f"/tarefas/{identificador}"}), 202
+
+
+# Consultar progresso, resultado parcial e resultado final de uma tarefa
+@tarefas_app.route('/<identificador>')
+def status_tarefa(identificador):
+    estado = consultar(identificador)
+    if estado is None:
+        return jsonify({'error': 'Tarefa não encontrada'}), 404
+    return jsonify(estado)
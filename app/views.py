@@ -1,10 +1,12 @@
 import logging
 import os
+import hashlib
 
-import pandas as pd
 from flask import render_template, request, jsonify, Blueprint
 
-from app import app, db
+from app.servidor import app, db
+from app.ingestao import tarefa_ingerir_csv  # noqa: F401 (registra a tarefa 'ingestao_csv')
+from app.tarefas import submeter, resposta_submetida
 
 # Configurações do MongoDB e variáveis de ambiente
 FOGO_EMAIL = os.getenv("FOGO_EMAIL")
@@ -42,17 +44,21 @@ def upload_csv():
 
     if file and file.filename.endswith('.csv'):
         try:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+            # Salvar com o hash do conteúdo como nome: uploads diferentes não se sobrescrevem e o mesmo
+            # conteúdo (com qualquer nome de arquivo) gera os mesmos parâmetros, logo a mesma tarefa
+            conteudo_hash = hashlib.sha1()
+            for parte in iter(lambda: file.stream.read(1 << 20), b''):
+                conteudo_hash.update(parte)
+            conteudo_hash = conteudo_hash.hexdigest()
+            file.stream.seek(0)
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{conteudo_hash}.csv")
             file.save(file_path)
 
-            # Processar o CSV e armazenar no MongoDB
-            data = pd.read_csv(file_path)
-            json_data = data.to_dict(orient='records')
-            client = get_mongo_client()
-            db = client['mobility_data']
-            db['rides_original'].insert_many(json_data)
-            logging.info(f"Arquivo {file.filename} carregado com sucesso.")
-            return jsonify({'success': 'Arquivo CSV carregado e armazenado com sucesso'}), 201
+            # Processar o CSV em blocos e armazenar no MongoDB, em segundo plano
+            tarefa_id = submeter("ingestao_csv", {'caminho': file_path, 'sha1': conteudo_hash,
+                                                  'colecao': 'rides_original'})
+            logging.info(f"Arquivo {file.filename} enviado para ingestão (tarefa {tarefa_id}).")
+            return resposta_submetida(tarefa_id)
         except Exception as e:
             logging.error(f"Erro ao processar o arquivo CSV: {e}")
             return jsonify({'error': str(e)}), 500
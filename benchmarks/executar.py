@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import importlib.util
+from datetime import datetime
+
+# Benchmarks dos dashboards sobre dados sintéticos (benchmarks.gerador).
+#
+# Dependências (o modo padrão usa o mongomock): pip install -r benchmarks/requirements.txt
+#
+# Uso:
+#   python -m benchmarks.executar --escala 10k                       # mongomock, em memória
+#   python -m benchmarks.executar --escala 1m --mongo-uri mongodb://localhost:27017 --limpar
+#   python -m benchmarks.executar --escala 100k --comparar benchmarks/resultados/<base>.json
+#
+# Cada benchmark roda em um subprocesso próprio, para que o pico de memória (RSS) medido seja só
+# dele; o tempo mede apenas a operação, sem a preparação (o menor de --repeticoes execuções). Com mongomock cada subprocesso gera os
+# próprios dados em memória; com um mongod os dados são gerados uma vez na base `mobility_data`
+# (vazia, ou apagada com --limpar) e lidos por todos. O resultado é gravado em JSON com o commit,
+# para comparar execuções entre commits.
+
+RAIZ_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRETORIO_RESULTADOS = os.path.join(RAIZ_PROJETO, "benchmarks", "resultados")
+COLECOES = ['rides_original', 'ocorrencias', 'events', 'procedimento_operacional_padrao']
+
+# Parâmetros dos dashboards usados nas medições (valores padrão dos formulários)
+DISTANCIA_KM = 5
+JANELA_HORAS = 48
+
+# Aumento relativo (tempo ou memória) a partir do qual a comparação aponta regressão
+LIMITE_REGRESSAO = 0.10
+
+_benchmarks = {}
+
+
+# Registrar um benchmark: a função faz a preparação e devolve a operação medida (sem argumentos),
+# cujo retorno é um dicionário com informações do resultado (tamanhos etc.)
+def benchmark(nome):
+    def decorador(funcao):
+        _benchmarks[nome] = funcao
+        return funcao
+    return decorador
+
+
+def _rss_pico_mb():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Em kB no Linux e em bytes no macOS
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=RAIZ_PROJETO).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconhecido'
+
+
+def _usar_mongomock():
+    import mongomock
+    import mongomock.gridfs
+    import pymongo
+
+    # Todos os módulos do app compartilham o mesmo servidor em memória
+    mongomock.gridfs.enable_gridfs_integration()
+    cliente = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: cliente
+    return cliente
+
+
+def _importar_arquivo(nome, caminho):
+    especificacao = importlib.util.spec_from_file_location(nome, caminho)
+    modulo = importlib.util.module_from_spec(especificacao)
+    especificacao.loader.exec_module(modulo)
+    return modulo
+
+
+def _atualizar_snapshots():
+    from app.snapshot import atualizar_snapshot
+    for nome in COLECOES:
+        atualizar_snapshot(nome)
+
+
+@benchmark("snapshot_completo")
+def bench_snapshot_completo(args):
+    from app.snapshot import atualizar_snapshot
+
+    def medir():
+        metadados = atualizar_snapshot('rides_original', completo=True)
+        return {'linhas': metadados['linhas']}
+    return medir
+
+
+@benchmark("carregar_dados")
+def bench_carregar_dados(args):
+    from app import Mapa_ocorrencias_v2_1 as mapa
+    _atualizar_snapshots()
+
+    def medir():
+        corridas, ocorrencias = mapa.carregar_dados()
+        return {'corridas': len(corridas), 'ocorrencias': len(ocorrencias)}
+    return medir
+
+
+@benchmark("juncao_mapa")
+def bench_juncao_mapa(args):
+    from app import Mapa_ocorrencias_v2_1 as mapa
+    from app.juncao_espacotemporal import contar_cancelamentos_por_evento
+    _atualizar_snapshots()
+    corridas, ocorrencias = mapa.carregar_dados()
+
+    def medir():
+        contagens = contar_cancelamentos_por_evento(ocorrencias, corridas, DISTANCIA_KM, JANELA_HORAS)
+        return {'ocorrencias': len(contagens), 'cancelamentos': int(contagens['total_cancelamentos'].sum())}
+    return medir
+
+
+# Mesma junção nas fatias em paralelo (processos: JUNCAO_PROCESSOS, padrão = núcleos); o pool é
+# iniciado no preparo, então a medida não inclui a criação dos processos
+@benchmark("juncao_paralela")
+def bench_juncao_paralela(args):
+    from app import Mapa_ocorrencias_v2_1 as mapa
+    from app.juncao_paralela import contar_cancelamentos_paralelo
+    _atualizar_snapshots()
+    corridas, ocorrencias = mapa.carregar_dados()
+    contar_cancelamentos_paralelo(ocorrencias, corridas, DISTANCIA_KM, JANELA_HORAS)
+
+    def medir():
+        contagens = contar_cancelamentos_paralelo(ocorrencias, corridas, DISTANCIA_KM, JANELA_HORAS)
+        return {'ocorrencias': len(contagens), 'cancelamentos': int(contagens['total_cancelamentos'].sum())}
+    return medir
+
+
+@benchmark("mapa_ocorrencias")
+def bench_mapa_ocorrencias(args):
+    from app import Mapa_ocorrencias_v2_1 as mapa
+    _atualizar_snapshots()
+    parametros = {'distancia': DISTANCIA_KM, 'tempo': JANELA_HORAS, 'data_inicio': None, 'data_fim': None,
+                  'tipo_evento': []}
+
+    def medir():
+        resultado = mapa.calcular_mapa_ocorrencias(parametros)
+        return {'bytes_html': sum(len(valor) for valor in resultado.values())}
+    return medir
+
+
+@benchmark("correlacao_crimes")
+def bench_correlacao_crimes(args):
+    _atualizar_snapshots()
+    modulo = _importar_arquivo("mapa_areas_risco", os.path.join(RAIZ_PROJETO, "app", "Mapa_areas de risco_crimes.py"))
+    corridas = modulo.rides_data.dropna(subset=['origin_lat', 'origin_lng', 'created_at'])
+    eventos = modulo.events_data.dropna(subset=['latitude', 'longitude', 'date'])
+
+    def medir():
+        pares = modulo.correlacionar_cancelamentos(corridas, eventos, DISTANCIA_KM, JANELA_HORAS)
+        return {'corridas': len(corridas), 'eventos': len(eventos), 'pares': len(pares)}
+    return medir
+
+
+@benchmark("clusters")
+def bench_clusters(args):
+    from app.Analise_espacial_cluster_v1 import treinar_clusters
+    _atualizar_snapshots()
+
+    def medir():
+        resultado = treinar_clusters()
+        return {'corridas': len(resultado['df']), 'optimal_k': int(resultado['optimal_k'])}
+    return medir
+
+
+@benchmark("ingestao_csv")
+def bench_ingestao_csv(args):
+    from app.ingestao import ingerir_csv
+    from app.tarefas import db
+    from benchmarks.gerador import ESCALAS, gerar_csv_corridas
+
+    caminho = gerar_csv_corridas(os.path.join(args.diretorio_temporario, "corridas.csv"),
+                                 ESCALAS[args.escala], args.semente)
+    colecao = db['benchmark_ingestao']
+    colecao.drop()
+
+    def medir():
+        resultado = ingerir_csv(caminho, colecao)
+        colecao.drop()
+        return {'linhas': resultado['linhas'], 'bytes_csv': os.path.getsize(caminho)}
+    return medir
+
+
+# Executar um benchmark no processo atual e imprimir o resultado em JSON (modo --interno)
+def executar_interno(args):
+    if not args.mongo_uri:
+        from benchmarks.gerador import popular
+        cliente = _usar_mongomock()
+        popular(cliente['mobility_data'], args.escala, args.semente)
+
+    medir = _benchmarks[args.interno](args)
+    rss_preparo = _rss_pico_mb()
+    tempos = []
+    for _ in range(args.repeticoes):
+        inicio = time.perf_counter()
+        informacoes = medir()
+        tempos.append(time.perf_counter() - inicio)
+    print(json.dumps({
+        'segundos': round(min(tempos), 4),
+        'segundos_mediana': round(float(sorted(tempos)[len(tempos) // 2]), 4),
+        'repeticoes': len(tempos),
+        'rss_pico_mb': _rss_pico_mb(),
+        'rss_preparo_mb': rss_preparo,
+        'resultado': informacoes,
+    }))
+
+
+def _popular_mongod(args):
+    from pymongo import MongoClient
+    from benchmarks.gerador import popular
+
+    db = MongoClient(args.mongo_uri)['mobility_data']
+    existentes = [nome for nome in COLECOES if db[nome].estimated_document_count()]
+    if existentes and not args.limpar:
+        sys.exit(f"A base mobility_data já tem dados ({', '.join(existentes)}). "
+                 "Use uma base vazia ou --limpar para apagá-la.")
+    for nome in COLECOES + ['versoes_dados']:
+        db[nome].drop()
+    popular(db, args.escala, args.semente)
+
+
+# Executar cada benchmark em um subprocesso e reunir os resultados
+def executar(args):
+    if args.mongo_uri:
+        _popular_mongod(args)
+
+    resultados = {}
+    for nome in args.benchmarks:
+        with tempfile.TemporaryDirectory(prefix="benchmark-") as temporario:
+            ambiente = dict(os.environ, PYTHONPATH=RAIZ_PROJETO,
+                            SNAPSHOT_DIR=os.path.join(temporario, "snapshots"),
+                            ARTEFATOS_DIR=os.path.join(temporario, "artefatos"))
+            if args.mongo_uri:
+                ambiente['MONGO_URI'] = args.mongo_uri
+            comando = [sys.executable, '-m', 'benchmarks.executar', '--interno', nome, '--escala', args.escala,
+                       '--semente', str(args.semente), '--repeticoes', str(args.repeticoes),
+                       '--diretorio-temporario', temporario]
+            if args.mongo_uri:
+                comando += ['--mongo-uri', args.mongo_uri]
+            processo = subprocess.run(comando, capture_output=True, text=True, env=ambiente,
+                                      cwd=temporario)
+        if processo.returncode != 0:
+            print(f"{nome}: falhou\n{processo.stderr[-2000:]}", file=sys.stderr)
+            resultados[nome] = {'erro': processo.stderr.strip().splitlines()[-1:]}
+            continue
+        resultados[nome] = json.loads(processo.stdout.strip().splitlines()[-1])
+        print(f"{nome}: {resultados[nome]['segundos']:.3f} s, pico de {resultados[nome]['rss_pico_mb']} MB")
+
+    return {
+        'commit': _commit(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'escala': args.escala,
+        'semente': args.semente,
+        'banco': 'mongod' if args.mongo_uri else 'mongomock',
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'processadores': os.cpu_count(),
+        'resultados': resultados,
+    }
+
+
+# Comparar com uma execução anterior: razão de tempo e de pico de memória por benchmark
+def comparar(base, atual):
+    regressoes = []
+    print(f"\nComparação com {base['commit']} ({base['escala']}, {base['banco']}):")
+    for nome, resultado in atual['resultados'].items():
+        anterior = base['resultados'].get(nome)
+        if not anterior or 'erro' in anterior or 'erro' in resultado:
+            continue
+        razao_tempo = resultado['segundos'] / anterior['segundos'] if anterior['segundos'] else float('inf')
+        razao_memoria = resultado['rss_pico_mb'] / anterior['rss_pico_mb'] if anterior['rss_pico_mb'] else float('inf')
+        regrediu = razao_tempo > 1 + LIMITE_REGRESSAO or razao_memoria > 1 + LIMITE_REGRESSAO
+        if regrediu:
+            regressoes.append(nome)
+        print(f"  {nome}: tempo x{razao_tempo:.2f}, memória x{razao_memoria:.2f}{'  <- regressão' if regrediu else ''}")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks dos dashboards com dados sintéticos.")
+    parser.add_argument('--escala', default='10k', choices=['10k', '100k', '1m'])
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--repeticoes', type=int, default=1, help="Execuções medidas por benchmark (vale o menor tempo).")
+    parser.add_argument('--mongo-uri', help="mongod local; sem ele, os dados ficam no mongomock.")
+    parser.add_argument('--limpar', action='store_true', help="Apaga as coleções do dashboard no mongod antes de gerar.")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(_benchmarks), default=list(_benchmarks))
+    parser.add_argument('--saida', help="Arquivo JSON do resultado (padrão: benchmarks/resultados/).")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para comparação.")
+    parser.add_argument('--interno', choices=list(_benchmarks), help=argparse.SUPPRESS)
+    parser.add_argument('--diretorio-temporario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        executar_interno(args)
+        return
+
+    resultado = executar(args)
+    saida = args.saida or os.path.join(
+        DIRETORIO_RESULTADOS, f"{resultado['data'][:10]}-{resultado['commit']}-{args.escala}-{resultado['banco']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"Resultados gravados em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            if comparar(json.load(f), resultado):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
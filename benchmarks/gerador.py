@@ -0,0 +1,165 @@
+import os
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Gerador determinístico (por semente) de dados sintéticos com a forma das coleções de produção:
+# corridas em torno dos bairros do Rio, ocorrências, eventos do Fogo Cruzado e procedimentos.
+# As corridas passam pela mesma conversão do upload de CSV (app.ingestao), de modo que os
+# documentos têm os mesmos tipos e o campo `location` dos importados pelo dashboard.
+
+ESCALAS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Bairros (centro aproximado) e peso relativo no sorteio das corridas
+BAIRROS = [
+    ('Centro', -22.9068, -43.1729, 12), ('Copacabana', -22.9711, -43.1822, 10),
+    ('Tijuca', -22.9249, -43.2322, 8), ('Botafogo', -22.9519, -43.1825, 8),
+    ('Barra da Tijuca', -23.0004, -43.3659, 9), ('Jacarepaguá', -22.9530, -43.3650, 7),
+    ('Méier', -22.9023, -43.2795, 6), ('Madureira', -22.8747, -43.3386, 6),
+    ('Penha', -22.8410, -43.2770, 4), ('Maré', -22.8580, -43.2430, 4),
+    ('Bangu', -22.8791, -43.4650, 5), ('Campo Grande', -22.9035, -43.5615, 5),
+]
+DISPERSAO_GRAUS = 0.012
+
+STATUS = ['Finalizada', 'Cancelada pelo Taxista', 'Cancelada pelo Passageiro']
+PESOS_STATUS = [0.70, 0.15, 0.15]
+
+# Demanda por hora do dia (picos de manhã e no fim da tarde)
+PESOS_HORA = np.array([1, 1, 1, 1, 1, 2, 4, 7, 9, 6, 5, 5, 6, 5, 5, 5, 6, 8, 9, 7, 5, 4, 3, 2], dtype=np.float64)
+TURNOS = np.array(['Madrugada'] * 6 + ['Manhã'] * 6 + ['Tarde'] * 6 + ['Noite'] * 6)
+
+COMENTARIOS = [
+    "Motorista muito educado", "Carro limpo e confortável", "Chegou rápido", "Ótima corrida",
+    "Demorou muito para chegar", "Motorista cancelou sem avisar", "Carro sujo",
+    "Não encontrou o endereço", "Cobrou a mais", "Motorista mal educado", "Normal",
+]
+
+PROCEDIMENTOS = [
+    'Alagamento', 'Tiroteio', 'Acidente de trânsito', 'Queda de árvore', 'Incêndio',
+    'Manifestação', 'Operação policial', 'Deslizamento', 'Bolsão d\'água', 'Falta de energia',
+]
+
+INICIO_PERIODO = datetime(2024, 1, 1)
+DIAS_PERIODO = 365
+
+# Ocorrências e eventos gerados por corrida
+OCORRENCIAS_POR_CORRIDA = 0.01
+EVENTOS_POR_CORRIDA = 0.01
+
+TAMANHO_BLOCO = 100_000
+
+
+def _datas(rng, n):
+    dias = rng.integers(0, DIAS_PERIODO, n)
+    horas = rng.choice(24, n, p=PESOS_HORA / PESOS_HORA.sum())
+    segundos = rng.integers(0, 3600, n)
+    deslocamento = dias.astype('timedelta64[D]') + horas.astype('timedelta64[h]') + segundos.astype('timedelta64[s]')
+    return np.datetime64(INICIO_PERIODO, 's') + deslocamento, horas
+
+
+def _coordenadas(rng, n, fracao_nulas=0.0):
+    pesos = np.array([peso for *_, peso in BAIRROS], dtype=np.float64)
+    bairros = rng.choice(len(BAIRROS), n, p=pesos / pesos.sum())
+    latitudes = np.array([lat for _, lat, _, _ in BAIRROS])[bairros] + rng.normal(0, DISPERSAO_GRAUS, n)
+    longitudes = np.array([lng for _, _, lng, _ in BAIRROS])[bairros] + rng.normal(0, DISPERSAO_GRAUS, n)
+    if fracao_nulas:
+        nulas = rng.random(n) < fracao_nulas
+        latitudes[nulas] = np.nan
+        longitudes[nulas] = np.nan
+    return bairros, latitudes, longitudes
+
+
+# Corridas em blocos de DataFrames com as colunas do export de CSV
+def blocos_corridas(n, semente=0, tamanho_bloco=TAMANHO_BLOCO):
+    rng = np.random.default_rng(semente)
+    motoristas = max(n // 50, 1)
+    nomes_bairros = np.array([nome for nome, *_ in BAIRROS], dtype=object)
+    for inicio in range(0, n, tamanho_bloco):
+        tamanho = min(tamanho_bloco, n - inicio)
+        bairros, latitudes, longitudes = _coordenadas(rng, tamanho, fracao_nulas=0.01)
+        criadas, horas = _datas(rng, tamanho)
+        status = rng.choice(len(STATUS), tamanho, p=PESOS_STATUS)
+        finalizada = (status == 0).astype(np.float64)
+
+        avaliacoes = rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], tamanho, p=[0.05, 0.05, 0.1, 0.3, 0.5])
+        avaliacoes[status != 0] = np.nan
+        comentarios = np.array(COMENTARIOS, dtype=object)[rng.integers(0, len(COMENTARIOS), tamanho)]
+        comentarios[rng.random(tamanho) >= 0.08] = None
+
+        yield pd.DataFrame({
+            'created_at': criadas,
+            'origin_lat': latitudes,
+            'origin_lng': longitudes,
+            'suburb_client': nomes_bairros[bairros],
+            'status': np.array(STATUS, dtype=object)[status],
+            'finalizada': finalizada,
+            'turno': TURNOS[horas],
+            'driver_id': rng.integers(1, motoristas + 1, tamanho),
+            'driver_distance': np.round(rng.lognormal(7.2, 0.6, tamanho), 1),
+            'route_distance': np.round(rng.lognormal(8.9, 0.7, tamanho), 1),
+            'rating_score': avaliacoes,
+            'rating_comment': comentarios,
+        })
+
+
+def gerar_procedimentos():
+    return [{'id_pop': id_pop, 'pop_titulo': titulo} for id_pop, titulo in enumerate(PROCEDIMENTOS, start=1)]
+
+
+def gerar_ocorrencias(n, semente=0):
+    rng = np.random.default_rng(semente + 1)
+    _, latitudes, longitudes = _coordenadas(rng, n, fracao_nulas=0.02)
+    inicios, _ = _datas(rng, n)
+    duracoes = (rng.uniform(0.5, 6.0, n) * 3600).astype('timedelta64[s]')
+    id_pops = rng.integers(1, len(PROCEDIMENTOS) + 1, n)
+    documentos = []
+    for inicio, fim, lat, lng, id_pop in zip(pd.to_datetime(inicios), pd.to_datetime(inicios + duracoes),
+                                             latitudes.tolist(), longitudes.tolist(), id_pops.tolist()):
+        documento = {'data_inicio': inicio.to_pydatetime(), 'data_fim': fim.to_pydatetime(),
+                     'latitude': None if np.isnan(lat) else lat, 'longitude': None if np.isnan(lng) else lng,
+                     'id_pop': id_pop, 'descricao': PROCEDIMENTOS[id_pop - 1]}
+        if documento['latitude'] is not None:
+            documento['location'] = {'type': 'Point', 'coordinates': [lng, lat]}
+        documentos.append(documento)
+    return documentos
+
+
+def gerar_eventos(n, semente=0):
+    rng = np.random.default_rng(semente + 2)
+    _, latitudes, longitudes = _coordenadas(rng, n)
+    datas, _ = _datas(rng, n)
+    return [{'id': rng.bytes(12).hex(), 'date': data.to_pydatetime(), 'latitude': lat, 'longitude': lng,
+             'location': {'type': 'Point', 'coordinates': [lng, lat]}}
+            for data, lat, lng in zip(pd.to_datetime(datas), latitudes.tolist(), longitudes.tolist())]
+
+
+# Gravar as corridas em CSV (mesmo formato do upload), bloco a bloco
+def gerar_csv_corridas(caminho, n, semente=0):
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    for posicao, bloco in enumerate(blocos_corridas(n, semente)):
+        bloco.to_csv(caminho, mode='w' if posicao == 0 else 'a', header=posicao == 0, index=False)
+    return caminho
+
+
+# Popular as coleções do dashboard em `db` (MongoDB local ou mongomock) na escala pedida
+def popular(db, escala, semente=0, tamanho_lote=5000):
+    from app.ingestao import _bloco_para_documentos
+
+    n = ESCALAS[escala] if isinstance(escala, str) else int(escala)
+    for bloco in blocos_corridas(n, semente):
+        documentos = _bloco_para_documentos(bloco)
+        for posicao in range(0, len(documentos), tamanho_lote):
+            db['rides_original'].insert_many(documentos[posicao:posicao + tamanho_lote], ordered=False)
+
+    db['procedimento_operacional_padrao'].insert_many(gerar_procedimentos())
+    for nome, documentos in (('ocorrencias', gerar_ocorrencias(max(int(n * OCORRENCIAS_POR_CORRIDA), 1), semente)),
+                             ('events', gerar_eventos(max(int(n * EVENTOS_POR_CORRIDA), 1), semente))):
+        for posicao in range(0, len(documentos), tamanho_lote):
+            db[nome].insert_many(documentos[posicao:posicao + tamanho_lote], ordered=False)
+
+    logger.info(f"Dados sintéticos gerados: {n} corridas (semente {semente}).")
+    return n
@@ -1,9 +1,23 @@
 import os
+import sys
 import logging
-import requests
-from pymongo import MongoClient
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+
+from app.normalizacao import normalizar_datas, normalizar_numeros, montar_pontos
+from app.snapshot import registrar_alteracao
+
 # Configuração de Logs
 logging.basicConfig(level=logging.INFO)
 
@@ -17,49 +31,82 @@ FOGO_CRUZADO_API_URL = os.getenv("FOGO_CRUZADO_API_URL")
 client = MongoClient(MONGO_URI)
 db = client["mobility_data"]
 collection = db["events"]
+# Ponto de controle por estado: última data já carregada
+checkpoints_collection = db["sincronizacao_fogo_cruzado"]
 
-# Função para autenticação na API
-def authenticate():
-    try:
-        response = requests.post(
-            f"{FOGO_CRUZADO_API_URL}/auth/login",
-            json={"email": FOGO_EMAIL, "password": FOGO_PASSWORD},
-        )
+# Tamanho da janela de datas, ocorrências por página e janelas buscadas em paralelo
+JANELA_DIAS = 30
+TAKE = 100
+TRABALHADORES = int(os.getenv("FOGO_TRABALHADORES", 4))
+# Operações por bulk_write
+TAMANHO_LOTE_GRAVACAO = 1000
+# Dias antes do ponto de controle buscados de novo a cada execução, para pegar ocorrências
+# registradas ou corrigidas com atraso (a gravação é idempotente, então não duplica)
+SOBREPOSICAO_DIAS = int(os.getenv("FOGO_SOBREPOSICAO_DIAS", 3))
+
+# Início da série histórica de cada estado (demais estados: 2022-07-01)
+INICIO_ESTADOS = {
+    "Rio de Janeiro": datetime(2016, 7, 1),
+    "Pernambuco": datetime(2018, 4, 1),
+}
+INICIO_PADRAO = datetime(2022, 7, 1)
+
+
+# Sessão HTTP compartilhada pelas threads: conexões reaproveitadas, novas tentativas com
+# espera exponencial em falhas temporárias e renovação do token quando a API responde 401
+class SessaoFogoCruzado:
+    def __init__(self, trabalhadores=TRABALHADORES):
+        tentativas = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                           allowed_methods=["GET", "POST"], respect_retry_after_header=True)
+        adaptador = HTTPAdapter(pool_connections=trabalhadores, pool_maxsize=trabalhadores,
+                                max_retries=tentativas)
+        self.sessao = requests.Session()
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+        self.token = None
+        self._trava = threading.Lock()
+
+    # Autenticação na API (só renova se nenhuma outra thread já tiver renovado o token expirado)
+    def authenticate(self, token_expirado=None):
+        with self._trava:
+            if self.token is None or self.token == token_expirado:
+                response = self.sessao.post(
+                    f"{FOGO_CRUZADO_API_URL}/auth/login",
+                    json={"email": FOGO_EMAIL, "password": FOGO_PASSWORD},
+                    timeout=30,
+                )
+                response.raise_for_status()
+                self.token = response.json()["data"]["accessToken"]
+                logging.info("Autenticação realizada com sucesso!")
+            return self.token
+
+    def get(self, caminho, params=None):
+        token = self.token or self.authenticate()
+        response = self.sessao.get(f"{FOGO_CRUZADO_API_URL}{caminho}", params=params,
+                                   headers={"Authorization": f"Bearer {token}"}, timeout=60)
+        if response.status_code == 401:
+            token = self.authenticate(token_expirado=token)
+            response = self.sessao.get(f"{FOGO_CRUZADO_API_URL}{caminho}", params=params,
+                                       headers={"Authorization": f"Bearer {token}"}, timeout=60)
         response.raise_for_status()
-        logging.info("Autenticação realizada com sucesso!")
-        return response.json()["data"]["accessToken"]
-    except Exception as e:
-        logging.error(f"Erro ao autenticar na API: {e}")
-        return None
+        return response.json()
+
 
 # Função para buscar estados
-def fetch_states(token):
-    try:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{FOGO_CRUZADO_API_URL}/states", headers=headers)
-        response.raise_for_status()
-        return response.json()["data"]
-    except Exception as e:
-        logging.error(f"Erro ao buscar estados: {e}")
-        return []
+def fetch_states(sessao):
+    return sessao.get("/states")["data"]
+
 
 # Função para buscar cidades de um estado
-def fetch_cities(token, state_id):
-    try:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(
-            f"{FOGO_CRUZADO_API_URL}/cities", headers=headers, params={"stateId": state_id}
-        )
-        response.raise_for_status()
-        return response.json()["data"]
-    except Exception as e:
-        logging.error(f"Erro ao buscar cidades: {e}")
-        return []
+def fetch_cities(sessao, state_id):
+    return sessao.get("/cities", params={"stateId": state_id})["data"]
 
-# Função para buscar dados de ocorrências
-def fetch_occurrences(token, state_id, city_ids, initial_date, final_date, page=1, take=100):
-    try:
-        headers = {"Authorization": f"Bearer {token}"}
+
+# Função para buscar todas as ocorrências de uma janela de datas, seguindo a paginação até o fim
+def fetch_occurrences(sessao, state_id, city_ids, initial_date, final_date, take=TAKE):
+    ocorrencias = []
+    page = 1
+    while True:
         params = {
             "idState": state_id,
             "idCities": ",".join(city_ids) if city_ids else None,
@@ -68,80 +115,212 @@ def fetch_occurrences(token, state_id, city_ids, initial_date, final_date, page=
             "page": page,
             "take": take,
         }
-        response = requests.get(f"{FOGO_CRUZADO_API_URL}/occurrences", headers=headers, params=params)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        logging.error(f"Erro ao buscar ocorrências: {e}")
-        return None
+        result = sessao.get("/occurrences", params=params)
+        dados = result.get("data") or []
+        ocorrencias.extend(dados)
 
-# Função para armazenar dados no MongoDB
-def store_data_in_mongo(data):
+        meta = result.get("pageMeta") or {}
+        if "hasNextPage" in meta:
+            tem_proxima = meta["hasNextPage"]
+        elif "pageCount" in meta:
+            tem_proxima = page < meta["pageCount"]
+        else:
+            tem_proxima = len(dados) == take
+        if not tem_proxima or not dados:
+            return ocorrencias
+        page += 1
+
+
+# Índice único no id da ocorrência do Fogo Cruzado, base da gravação idempotente
+def ensure_unique_index():
     try:
-        if data:
-            for record in data:
-                record["inserido_em"] = datetime.now()
-            collection.insert_many(data)
-            logging.info(f"{len(data)} registros inseridos no MongoDB.")
-    except Exception as e:
-        logging.error(f"Erro ao salvar dados no MongoDB: {e}")
-
-# Função de carga inicial
-def load_initial_data():
-    token = authenticate()
-    if not token:
-        logging.error("Autenticação falhou. Encerrando script.")
-        return
-
-    # Buscar estados disponíveis
-    states = fetch_states(token)
-    if not states:
-        logging.error("Falha ao obter estados. Encerrando script.")
-        return
-
-    # Seleção do estado pelo usuário
-    logging.info("Estados disponíveis:")
-    for i, state in enumerate(states):
-        logging.info(f"{i + 1}. {state['name']}")
-    state_index = int(input("Selecione o número do estado: ")) - 1
-    state_id = states[state_index]["id"]
-    state_name = states[state_index]["name"]
-
-    # Buscar cidades disponíveis no estado
-    cities = fetch_cities(token, state_id)
-    logging.info(f"Cidades disponíveis no estado {state_name}:")
-    for i, city in enumerate(cities):
-        logging.info(f"{i + 1}. {city['name']}")
-    selected_cities = input("Selecione as cidades (números separados por vírgula) ou pressione Enter para todas: ")
-    if selected_cities:
-        city_ids = [cities[int(i) - 1]["id"] for i in selected_cities.split(",")]
-    else:
-        city_ids = [city["id"] for city in cities]
-
-    # Configuração do período de coleta
-    start_date = datetime(2016, 7, 1) if state_name == "Rio de Janeiro" else \
-                 datetime(2018, 4, 1) if state_name == "Pernambuco" else \
-                 datetime(2022, 7, 1)
-    end_date = datetime.now()
-    current_date = start_date
-
-    # Loop para buscar dados mês a mês
-    while current_date < end_date:
-        next_date = current_date + timedelta(days=30)
-        logging.info(f"Carregando dados de {current_date.strftime('%Y-%m-%d')} a {next_date.strftime('%Y-%m-%d')}")
-        result = fetch_occurrences(
-            token,
-            state_id,
-            city_ids,
-            current_date.strftime("%Y-%m-%d"),
-            next_date.strftime("%Y-%m-%d"),
-        )
-        if result and "data" in result:
-            store_data_in_mongo(result["data"])
-        current_date = next_date
-
-    logging.info("Carga inicial concluída.")
+        collection.create_index("id", unique=True, name="id_unico")
+    except OperationFailure as e:
+        logging.error(f"Não foi possível criar o índice único em events.id (há duplicatas?): {e}. "
+                      "Execute com --deduplicar.")
+        raise
+
+
+# Remover duplicatas já gravadas, mantendo o documento mais antigo de cada id
+def remove_duplicates():
+    removidos = 0
+    cursor = collection.aggregate([
+        {"$match": {"id": {"$exists": True}}},
+        {"$group": {"_id": "$id", "ids": {"$push": "$_id"}, "total": {"$sum": 1}}},
+        {"$match": {"total": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for grupo in cursor:
+        removidos += collection.delete_many({"_id": {"$in": sorted(grupo["ids"])[1:]}}).deleted_count
+    logging.info(f"{removidos} eventos duplicados removidos.")
+    return removidos
+
+
+# Normalizar um lote de ocorrências da API com o mesmo código da ingestão de CSV e dos snapshots
+# (app.normalizacao): `date` como datetime em UTC, latitude/longitude numéricas e `location` como
+# ponto GeoJSON (base dos índices de `events`). Eventos gravados antes da normalização são
+# regravados com --reiniciar.
+def normalizar_ocorrencias(data):
+    datas = normalizar_datas([record.get("date") for record in data])
+    latitudes = normalizar_numeros([record.get("latitude") for record in data])
+    longitudes = normalizar_numeros([record.get("longitude") for record in data])
+    pontos = montar_pontos(latitudes, longitudes)
+    documentos = []
+    for record, data_ocorrencia, lat, lng, ponto in zip(data, datas, latitudes.tolist(), longitudes.tolist(), pontos):
+        documentos.append({**record,
+                           "date": None if pd.isna(data_ocorrencia) else data_ocorrencia.to_pydatetime(),
+                           "latitude": None if np.isnan(lat) else lat,
+                           "longitude": None if np.isnan(lng) else lng,
+                           "location": ponto})
+    return documentos
+
+
+# Função para armazenar dados no MongoDB: upserts idempotentes pelo id da ocorrência, em lotes
+# não ordenados, já normalizados. Documentos iguais aos já gravados não são modificados. Eventos corrigidos
+# (atualizados) são registrados como alteração em `events`, para que o snapshot e os resultados
+# em cache sejam refeitos. Retorna as contagens de inseridos, atualizados e inalterados.
+def store_data_in_mongo(data):
+    contagens = {"inseridos": 0, "atualizados": 0, "inalterados": 0}
+    agora = datetime.now()
+    for inicio in range(0, len(data), TAMANHO_LOTE_GRAVACAO):
+        operacoes = [
+            UpdateOne({"id": record["id"]},
+                      {"$set": {campo: valor for campo, valor in record.items() if campo != "_id"},
+                       "$setOnInsert": {"inserido_em": agora}},
+                      upsert=True)
+            for record in normalizar_ocorrencias(data[inicio:inicio + TAMANHO_LOTE_GRAVACAO])
+        ]
+        resultado = collection.bulk_write(operacoes, ordered=False)
+        contagens["inseridos"] += resultado.upserted_count
+        contagens["atualizados"] += resultado.modified_count
+        contagens["inalterados"] += resultado.matched_count - resultado.modified_count
+    if contagens["atualizados"] > 0:
+        registrar_alteracao("events")
+    return contagens
+
+
+# Janelas de datas sem sobreposição [inicio, fim], com fim inclusivo
+def janelas_de_datas(inicio, fim, dias=JANELA_DIAS):
+    janelas = []
+    atual = inicio
+    while atual <= fim:
+        final = min(atual + timedelta(days=dias - 1), fim)
+        janelas.append((atual, final))
+        atual = final + timedelta(days=1)
+    return janelas
+
+
+def chave_checkpoint(state_id, city_ids):
+    return f"{state_id}:{','.join(sorted(city_ids))}" if city_ids else str(state_id)
+
+
+# Sincronizar um estado: busca as janelas em paralelo (com no máximo 2x o número de
+# trabalhadores em andamento, para limitar a memória) e grava cada uma na ordem das datas,
+# avançando o ponto de controle; uma execução interrompida recomeça da última janela gravada.
+def sincronizar_estado(sessao, state, city_ids, desde=None, ate=None, trabalhadores=TRABALHADORES):
+    chave = chave_checkpoint(state["id"], city_ids)
+    checkpoint = checkpoints_collection.find_one({"_id": chave})
+
+    if desde is None and checkpoint is not None:
+        desde = checkpoint["ultima_data"] - timedelta(days=SOBREPOSICAO_DIAS - 1)
+    elif desde is None:
+        desde = INICIO_ESTADOS.get(state["name"], INICIO_PADRAO)
+    ate = ate or datetime.combine(datetime.now().date(), datetime.min.time())
+
+    janelas = janelas_de_datas(desde, ate)
+    if not janelas:
+        logging.info(f"{state['name']}: nenhuma data nova para sincronizar.")
+        return {"inseridos": 0, "atualizados": 0, "inalterados": 0}
+
+    logging.info(f"{state['name']}: sincronizando {len(janelas)} janelas de "
+                 f"{desde.strftime('%Y-%m-%d')} a {ate.strftime('%Y-%m-%d')}.")
+    totais = {"inseridos": 0, "atualizados": 0, "inalterados": 0}
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        pendentes = deque()
+        proximas = iter(janelas)
+
+        def submeter_proxima():
+            janela = next(proximas, None)
+            if janela is not None:
+                pendentes.append((janela, executor.submit(
+                    fetch_occurrences, sessao, state["id"], city_ids,
+                    janela[0].strftime("%Y-%m-%d"), janela[1].strftime("%Y-%m-%d"))))
+
+        for _ in range(2 * trabalhadores):
+            submeter_proxima()
+
+        while pendentes:
+            (inicio, final), futuro = pendentes.popleft()
+            ocorrencias = futuro.result()
+            submeter_proxima()
+
+            contagens = store_data_in_mongo(ocorrencias)
+            for campo, valor in contagens.items():
+                totais[campo] += valor
+            checkpoints_collection.update_one(
+                {"_id": chave},
+                {"$set": {"estado": state["name"], "state_id": state["id"], "city_ids": city_ids,
+                          "ultima_data": final, "atualizado_em": datetime.now()}},
+                upsert=True)
+            logging.info(f"{state['name']}: {len(ocorrencias)} ocorrências de "
+                         f"{inicio.strftime('%Y-%m-%d')} a {final.strftime('%Y-%m-%d')} "
+                         f"({contagens['inseridos']} novas, {contagens['atualizados']} atualizadas, "
+                         f"{contagens['inalterados']} inalteradas).")
+
+    logging.info(f"{state['name']}: {totais['inseridos']} inseridas, {totais['atualizados']} atualizadas, "
+                 f"{totais['inalterados']} inalteradas.")
+    return totais
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sincroniza as ocorrências da API Fogo Cruzado com o MongoDB.")
+    parser.add_argument("--estado", action="append", dest="estados", default=None,
+                        help="Nome do estado (pode repetir). Padrão: Rio de Janeiro.")
+    parser.add_argument("--cidade", action="append", dest="cidades", default=None,
+                        help="Nome da cidade (pode repetir). Padrão: todas as cidades do estado.")
+    parser.add_argument("--desde", type=lambda v: datetime.strptime(v, "%Y-%m-%d"),
+                        help="Data inicial (AAAA-MM-DD); ignora o ponto de controle.")
+    parser.add_argument("--ate", type=lambda v: datetime.strptime(v, "%Y-%m-%d"),
+                        help="Data final (AAAA-MM-DD). Padrão: hoje.")
+    parser.add_argument("--reiniciar", action="store_true",
+                        help="Ignora o ponto de controle e recomeça do início da série histórica.")
+    parser.add_argument("--trabalhadores", type=int, default=TRABALHADORES,
+                        help="Janelas buscadas em paralelo.")
+    parser.add_argument("--deduplicar", action="store_true",
+                        help="Remove eventos duplicados já gravados antes de criar o índice único.")
+    args = parser.parse_args(argv)
+
+    if args.deduplicar:
+        remove_duplicates()
+    ensure_unique_index()
+
+    sessao = SessaoFogoCruzado(args.trabalhadores)
+    estados_por_nome = {state["name"]: state for state in fetch_states(sessao)}
+
+    for nome_estado in args.estados or ["Rio de Janeiro"]:
+        state = estados_por_nome.get(nome_estado)
+        if state is None:
+            logging.error(f"Estado '{nome_estado}' não encontrado na API.")
+            return 1
+
+        city_ids = []
+        if args.cidades:
+            cidades_por_nome = {city["name"]: city["id"] for city in fetch_cities(sessao, state["id"])}
+            faltando = [nome for nome in args.cidades if nome not in cidades_por_nome]
+            if faltando:
+                logging.error(f"Cidades não encontradas em {nome_estado}: {', '.join(faltando)}")
+                return 1
+            city_ids = [cidades_por_nome[nome] for nome in args.cidades]
+
+        desde = args.desde
+        if args.reiniciar and desde is None:
+            desde = INICIO_ESTADOS.get(state["name"], INICIO_PADRAO)
+        sincronizar_estado(sessao, state, city_ids, desde=desde, ate=args.ate,
+                           trabalhadores=args.trabalhadores)
+
+    logging.info("Sincronização concluída.")
+    return 0
+
 
 # Execução principal
 if __name__ == "__main__":
-    load_initial_data()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import mongomock
+import mongomock.gridfs
+import pymongo
+import pytest
+
+# Testes do app. Dependências: pip install -r tests/requirements.txt
+# Uso (na raiz do projeto): python -m pytest -q
+#
+# Os módulos do app conectam ao MongoDB na importação; nos testes todos compartilham o mesmo
+# servidor em memória (mongomock), como no modo padrão dos benchmarks
+mongomock.gridfs.enable_gridfs_integration()
+cliente = mongomock.MongoClient()
+pymongo.MongoClient = lambda *args, **kwargs: cliente
+
+
+# Base vazia a cada teste
+@pytest.fixture
+def db():
+    banco = cliente['mobility_data']
+    for nome in banco.list_collection_names():
+        banco.drop_collection(nome)
+    return banco
+
+
+# Snapshots gravados em um diretório temporário
+@pytest.fixture
+def snapshot(db, tmp_path, monkeypatch):
+    from app import snapshot
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    return snapshot
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.juncao_espacotemporal import (STATUS_CANCELADA_PASSAGEIRO, STATUS_CANCELADA_TAXISTA,
+                                       contar_cancelamentos_por_evento, haversine_km, iterar_pares)
+
+STATUS = ['Finalizada', STATUS_CANCELADA_TAXISTA, STATUS_CANCELADA_PASSAGEIRO]
+
+
+def gerar_dados(semente, n_eventos=60, n_corridas=800):
+    rng = np.random.default_rng(semente)
+    inicio = pd.Timestamp('2024-01-01')
+    eventos = pd.DataFrame({
+        'latitude': -22.9 + rng.normal(0, 0.05, n_eventos),
+        'longitude': -43.2 + rng.normal(0, 0.05, n_eventos),
+        'data_inicio': inicio + pd.to_timedelta(rng.integers(0, 3 * 86400, n_eventos), unit='s'),
+    }, index=rng.permutation(n_eventos) + 100)
+    corridas = pd.DataFrame({
+        'origin_lat': -22.9 + rng.normal(0, 0.05, n_corridas),
+        'origin_lng': -43.2 + rng.normal(0, 0.05, n_corridas),
+        'created_at': inicio + pd.to_timedelta(rng.integers(0, 3 * 86400, n_corridas), unit='s'),
+        'status': rng.choice(STATUS, n_corridas),
+    })
+    # Coordenadas e datas ausentes ficam de fora da junção
+    eventos.iloc[0, 0] = np.nan
+    corridas.iloc[:5, 0] = np.nan
+    corridas.iloc[5:10, 2] = pd.NaT
+    return eventos, corridas
+
+
+# Oráculo por força bruta: compara cada evento com todas as corridas
+def pares_forca_bruta(eventos, corridas, distancia_km, janela_horas):
+    distancias = haversine_km(eventos['latitude'].to_numpy()[:, None], eventos['longitude'].to_numpy()[:, None],
+                              corridas['origin_lat'].to_numpy()[None, :], corridas['origin_lng'].to_numpy()[None, :])
+    diferencas = np.abs(eventos['data_inicio'].to_numpy()[:, None] - corridas['created_at'].to_numpy()[None, :])
+    return (distancias <= distancia_km) & (diferencas <= np.timedelta64(int(janela_horas * 3600), 's'))
+
+
+@pytest.mark.parametrize('distancia_km, janela_horas', [(0.5, 1), (2, 6), (5, 48)])
+def test_contagens_iguais_a_forca_bruta(distancia_km, janela_horas):
+    eventos, corridas = gerar_dados(semente=int(distancia_km * 10))
+    proximos = pares_forca_bruta(eventos, corridas, distancia_km, janela_horas)
+    taxista = (corridas['status'] == STATUS_CANCELADA_TAXISTA).to_numpy()
+    passageiro = (corridas['status'] == STATUS_CANCELADA_PASSAGEIRO).to_numpy()
+
+    contagens = contar_cancelamentos_por_evento(eventos, corridas, distancia_km, janela_horas)
+
+    assert contagens.index.equals(eventos.index)
+    assert contagens['corridas_proximas'].tolist() == proximos.sum(axis=1).tolist()
+    assert contagens['cancelamentos_taxista'].tolist() == (proximos & taxista).sum(axis=1).tolist()
+    assert contagens['cancelamentos_passageiro'].tolist() == (proximos & passageiro).sum(axis=1).tolist()
+    assert contagens['total_cancelamentos'].tolist() == (proximos & (taxista | passageiro)).sum(axis=1).tolist()
+    primeira = np.where(proximos.any(axis=1), proximos.argmax(axis=1), -1)
+    assert contagens['primeira_corrida'].tolist() == primeira.tolist()
+
+
+def test_pares_em_blocos_pequenos_iguais_a_forca_bruta():
+    eventos, corridas = gerar_dados(semente=7)
+    proximos = pares_forca_bruta(eventos, corridas, 2, 6)
+
+    progressos = []
+    pares = set()
+    for idx_evento, idx_corrida, distancias, diferencas in iterar_pares(
+            eventos['latitude'], eventos['longitude'], eventos['data_inicio'],
+            corridas['origin_lat'], corridas['origin_lng'], corridas['created_at'], 2, 6,
+            limite_candidatos=50, progresso=progressos.append):
+        assert (distancias <= 2).all() and (diferencas <= 6).all()
+        pares.update(zip(idx_evento.tolist(), idx_corrida.tolist()))
+
+    assert pares == set(zip(*np.nonzero(proximos)))
+    assert len(progressos) > 1 and progressos[-1] == 1.0
+
+
+def test_sem_corridas():
+    eventos, corridas = gerar_dados(semente=1)
+    contagens = contar_cancelamentos_por_evento(eventos, corridas.iloc[:0], 5, 2)
+    assert (contagens['corridas_proximas'] == 0).all()
+    assert (contagens['primeira_corrida'] == -1).all()
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.normalizacao import normalizar_datas, montar_pontos, separar_pontos
+
+INSTANTE = pd.Timestamp('2024-01-02 03:04:05')
+MILISSEGUNDOS = 1704164645000
+
+
+def test_datas_no_formato_estendido():
+    datas = normalizar_datas([
+        {'$date': '2024-01-02T03:04:05Z'},
+        {'$date': MILISSEGUNDOS},
+        {'$date': {'$numberLong': str(MILISSEGUNDOS)}},
+    ])
+    assert datas.dtype == 'datetime64[us]'
+    assert datas.tolist() == [INSTANTE] * 3
+
+
+def test_datas_em_milissegundos_desde_a_epoca():
+    datas = normalizar_datas([MILISSEGUNDOS, float(MILISSEGUNDOS), np.int64(MILISSEGUNDOS)])
+    assert datas.tolist() == [INSTANTE] * 3
+
+
+def test_datas_iso_convertidas_para_utc():
+    datas = normalizar_datas(['2024-01-02T03:04:05Z', '2024-01-02T00:04:05-03:00', '2024-01-02 03:04:05'])
+    assert datas.tolist() == [INSTANTE] * 3
+
+
+def test_datas_mistas_e_invalidas():
+    datas = normalizar_datas([datetime(2024, 1, 2, 3, 4, 5), {'$date': MILISSEGUNDOS}, '2024-01-02T03:04:05Z',
+                              None, 'sem data', float('nan')])
+    assert datas.tolist()[:3] == [INSTANTE] * 3
+    assert datas[3:].isna().all()
+
+
+def test_datas_com_fuso_em_serie_datetime():
+    datas = normalizar_datas(pd.Series(pd.to_datetime(['2024-01-02T00:04:05-03:00'], utc=True)))
+    assert datas.dtype == 'datetime64[us]'
+    assert datas.tolist() == [INSTANTE]
+
+
+def test_pontos_ida_e_volta():
+    pontos = montar_pontos([-22.9, np.nan, -22.8], [-43.2, -43.1, None])
+    assert pontos == [{'type': 'Point', 'coordinates': [-43.2, -22.9]}, None, None]
+
+    latitudes, longitudes = separar_pontos(pontos + [{'type': 'Point'}, 'invalido'])
+    np.testing.assert_array_equal(latitudes, [-22.9, np.nan, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(longitudes, [-43.2, np.nan, np.nan, np.nan, np.nan])
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+from app.tabelas import texto_objectid
+
+INICIO = pd.Timestamp('2024-01-01')
+
+
+def inserir_corridas(db, quantidade, inicio=0):
+    documentos = [{
+        'created_at': (INICIO + pd.Timedelta(hours=i)).to_pydatetime(),
+        'status': 'Finalizada' if i % 3 else 'Cancelada pelo Taxista',
+        'location': {'type': 'Point', 'coordinates': [-43.2 + i / 1000, -22.9]},
+        'driver_distance': float(i),
+    } for i in range(inicio, inicio + quantidade)]
+    db['rides_original'].insert_many(documentos)
+    return documentos
+
+
+def test_snapshot_completo(db, snapshot):
+    documentos = inserir_corridas(db, 20)
+
+    metadados = snapshot.atualizar_snapshot('rides_original')
+    corridas = snapshot.carregar_snapshot('rides_original', atualizar=False)
+
+    assert metadados['linhas'] == 20
+    assert metadados['marca_dagua'] == str(documentos[-1]['_id'])
+    assert [texto_objectid(v) for v in corridas['_id']] == [str(d['_id']) for d in documentos]
+    assert corridas['created_at'].dtype == 'datetime64[us]'
+    assert isinstance(corridas['status'].dtype, pd.CategoricalDtype)
+    assert corridas['origin_lng'].tolist() == pytest.approx([-43.2 + i / 1000 for i in range(20)], abs=1e-4)
+
+
+def test_atualizacao_incremental_le_apenas_documentos_novos(db, snapshot, monkeypatch):
+    inserir_corridas(db, 20)
+    snapshot.atualizar_snapshot('rides_original')
+    novos = inserir_corridas(db, 5, inicio=20)
+
+    convertidos = []
+    converter = snapshot._lote_para_arrow
+    monkeypatch.setattr(snapshot, '_lote_para_arrow',
+                        lambda documentos, esquema: convertidos.append(len(documentos)) or converter(documentos, esquema))
+    metadados = snapshot.atualizar_snapshot('rides_original')
+    corridas = snapshot.carregar_snapshot('rides_original', atualizar=False)
+
+    assert convertidos == [5]
+    assert metadados['linhas'] == 25
+    assert metadados['marca_dagua'] == str(novos[-1]['_id'])
+    assert corridas['driver_distance'].tolist() == [float(i) for i in range(25)]
+
+    # Sem documentos novos, nada é lido nem regravado
+    convertidos.clear()
+    assert snapshot.atualizar_snapshot('rides_original')['linhas'] == 25
+    assert convertidos == []
+
+
+def test_alteracao_registrada_forca_reconstrucao(db, snapshot):
+    documentos = inserir_corridas(db, 10)
+    snapshot.atualizar_snapshot('rides_original')
+    db['rides_original'].update_one({'_id': documentos[0]['_id']}, {'$set': {'status': 'Cancelada pelo Passageiro'}})
+
+    # Alterações não são vistas pela marca d'água...
+    snapshot.atualizar_snapshot('rides_original')
+    assert snapshot.carregar_snapshot('rides_original', atualizar=False)['status'][0] == 'Cancelada pelo Taxista'
+
+    # ...até serem registradas, o que reconstrói o snapshot e muda a versão dos dados
+    versao = snapshot.versao_dados(['rides_original'])
+    snapshot.registrar_alteracao('rides_original')
+    assert snapshot.versao_dados(['rides_original']) != versao
+    assert snapshot.carregar_snapshot('rides_original', atualizar=False)['status'][0] == 'Cancelada pelo Passageiro'
+
+
+def test_consulta_no_snapshot_igual_a_consulta_ao_vivo(db, snapshot):
+    from app.consultas import carregar, filtros_corridas
+
+    inserir_corridas(db, 50)
+    condicoes = filtros_corridas('2024-01-01 05:00', '2024-01-02 10:00', status=['Cancelada pelo Taxista'])
+    colunas = ['_id', 'created_at', 'status', 'driver_distance']
+
+    do_snapshot = carregar('rides_original', condicoes, colunas, ao_vivo=False)
+    ao_vivo = carregar('rides_original', condicoes, colunas, ao_vivo=True)
+
+    assert len(do_snapshot) == len([i for i in range(5, 35) if i % 3 == 0])
+    # As categorias do snapshot são as da coleção inteira; as da consulta ao vivo, só as do resultado
+    pd.testing.assert_frame_equal(do_snapshot.astype({'status': str}), ao_vivo.astype({'status': str}))
+